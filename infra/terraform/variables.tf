@@ -88,7 +88,7 @@ variable "agent_env_maps_api_key" {
 # ----- アプリ側のバージョン・モデル名（環境ごとに変える場合はここだけ変更） -----
 variable "agent_env_features_version" {
   type        = string
-  default     = "mvp_v1"
+  default     = "mvp_v2"
   description = "Agent の FEATURES_VERSION"
 }
 
@@ -8,6 +8,7 @@ import math
 import asyncio
 from typing import Any, Dict, List, Optional, TypedDict
 
+import numpy as np
 import polyline as polyline_lib
 from fastapi import HTTPException
 from langgraph.graph import END, StateGraph
@@ -23,14 +24,17 @@ from app.schemas import (
 )
 from app.services import (
     bq_writer,
+    candidate_pool,
     fallback,
     maps_routes_client,
+    places_cache,
     places_client,
     polyline,
     ranker_client,
     vertex_llm,
 )
-from app.services.feature_calc import Candidate, calc_features
+from app.services.feature_calc import Candidate, calc_features, candidate_geometry
+from app.services.ttl_cache import SingleFlight
 from app.settings import settings
 from app.utils import translate_place_type_to_japanese
 
@@ -47,6 +51,7 @@ class AgentState(TypedDict, total=False):
     bq_request_logged: bool
     request_row_id: Optional[str]
     candidates: List[Dict[str, Any]]
+    candidate_pool_bypass: bool
     routes_api_status: str
     routes_error: Optional[str]
     fallback_used: bool
@@ -68,6 +73,8 @@ class AgentState(TypedDict, total=False):
     places: List[Dict[str, Any]]
     places_status: str
     places_error: Optional[str]
+    places_hidden_keyword: Optional[str]
+    places_memo: Dict[tuple, List[Dict[str, Any]]]
     nav_waypoints: List[LatLng]
     simplify_meta: Dict[str, Any]
     description: str
@@ -81,6 +88,7 @@ class AgentState(TypedDict, total=False):
     is_fallback_route: bool
     quality_score: float
     total_latency_ms: int
+    logging_latency_ms: int
     latency_ms: Dict[str, int]
     fallback_details: List[FallbackDetail]
     title: str
@@ -92,7 +100,6 @@ class AgentState(TypedDict, total=False):
 def _init_state(req: GenerateRouteRequest) -> AgentState:
     plan_steps = [
         "validate_request",
-        "log_request_bq",
         "generate_candidates_routes",
         "fallback_candidates",
         "compute_features",
@@ -104,9 +111,11 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "simplify_polyline_to_waypoints",
         "compute_quality",
         "build_fallback_details",
+        "build_response",
+        # 以下はレスポンス返却後にバックグラウンドで実行
+        "log_request_bq",
         "store_candidates_bq",
         "store_proposal_bq",
-        "build_response",
     ]
     return {
         "request": req,
@@ -118,6 +127,7 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "bq_request_logged": False,
         "request_row_id": None,
         "candidates": [],
+        "candidate_pool_bypass": False,
         "routes_api_status": "pending",
         "routes_error": None,
         "fallback_used": False,
@@ -137,6 +147,8 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "places": [],
         "places_status": "pending",
         "places_error": None,
+        "places_hidden_keyword": None,
+        "places_memo": {},
         "nav_waypoints": [],
         "simplify_meta": {},
         "desc_llm_status": "pending",
@@ -149,6 +161,7 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "is_fallback_route": False,
         "quality_score": 0.0,
         "total_latency_ms": 0,
+        "logging_latency_ms": 0,
         "latency_ms": {},
         "fallback_details": [],
         "title_llm_status": "pending",
@@ -238,27 +251,41 @@ def _spot_type_diversity(places: List[Dict[str, Any]]) -> float:
     return max(0.0, 1.0 - (max_count / len(types)))
 
 
-def _filter_places_by_route_distance(
-    places: List[Dict[str, Any]],
-    decoded_points: List[tuple[float, float]],
-    max_distance_m: float,
-    max_spots: int,
-) -> List[Dict[str, Any]]:
-    if not places or not decoded_points:
-        return places[:max_spots]
-
-    scored: List[tuple[float, Dict[str, Any]]] = []
-    for p in places:
+def _place_latlng_array(places: List[Dict[str, Any]]) -> np.ndarray:
+    """スポットの緯度経度を (M, 2) の配列にする（緯度経度が無いスポットは NaN）。"""
+    latlng = np.full((len(places), 2), np.nan, dtype=np.float64)
+    for i, p in enumerate(places):
         lat = p.get("lat")
         lng = p.get("lng")
         if lat is None or lng is None:
             continue
-        dist_m = polyline.distance_to_path_m(decoded_points, (float(lat), float(lng)))
-        if dist_m <= max_distance_m:
-            scored.append((dist_m, p))
+        latlng[i] = (float(lat), float(lng))
+    return latlng
+
 
-    scored.sort(key=lambda x: x[0])
-    return [p for _, p in scored[:max_spots]]
+def _place_route_distances(
+    geometry: polyline.PathGeometry,
+    places: List[Dict[str, Any]],
+) -> np.ndarray:
+    """各スポットから経路までの距離（メートル、(M,)）を1回で計算する（緯度経度が無いスポットは inf）。"""
+    if not places:
+        return np.zeros(0, dtype=np.float64)
+    return polyline.distances_to_path(geometry, _place_latlng_array(places))
+
+
+def _filter_places_by_route_distance(
+    places: List[Dict[str, Any]],
+    distances: np.ndarray,
+    max_distance_m: float,
+    max_spots: int,
+) -> List[Dict[str, Any]]:
+    """計算済みの経路距離（places と同じ順）を閾値で絞り、近い順に max_spots 件返す。"""
+    if not places:
+        return []
+    within = np.flatnonzero(distances <= max_distance_m)
+    # 距離が同じときは元の順序を保つ（安定ソート）
+    order = within[np.argsort(distances[within], kind="stable")]
+    return [places[i] for i in order[:max_spots].tolist()]
 
 
 def _detour_allowance_m(distance_km: float) -> float:
@@ -280,27 +307,91 @@ def _haversine_m(a: LatLng, b: LatLng) -> float:
     return 2.0 * 6371000.0 * math.asin(min(1.0, math.sqrt(h)))
 
 
-def _ensure_polyline_start(
+def _start_anchor_points(
     decoded_points: List[tuple[float, float]],
     start_lat: float,
     start_lng: float,
     round_trip: bool,
     threshold_m: float = 30.0,
-) -> tuple[List[tuple[float, float]], bool]:
+) -> tuple[Optional[tuple[float, float]], Optional[tuple[float, float]]]:
+    """polyline の先頭（周回時は末尾も）に補う開始地点を (先頭, 末尾) で返す（補う必要がなければ None）。"""
     if not decoded_points:
-        return decoded_points, False
+        return None, None
     start = LatLng(lat=start_lat, lng=start_lng)
     first = LatLng(lat=decoded_points[0][0], lng=decoded_points[0][1])
-    changed = False
-    if _haversine_m(start, first) > threshold_m:
-        decoded_points = [(start_lat, start_lng)] + decoded_points
-        changed = True
+    head = (start_lat, start_lng) if _haversine_m(start, first) > threshold_m else None
+    tail = None
     if round_trip:
-        last = LatLng(lat=decoded_points[-1][0], lng=decoded_points[-1][1])
+        last_point = decoded_points[-1]
+        last = LatLng(lat=last_point[0], lng=last_point[1])
         if _haversine_m(start, last) > threshold_m:
-            decoded_points = decoded_points + [(start_lat, start_lng)]
-            changed = True
-    return decoded_points, changed
+            tail = (start_lat, start_lng)
+    return head, tail
+
+
+def _ensure_polyline_start(
+    decoded_points: List[tuple[float, float]],
+    start_lat: float,
+    start_lng: float,
+    round_trip: bool,
+    threshold_m: float = 30.0,
+) -> tuple[List[tuple[float, float]], bool]:
+    head, tail = _start_anchor_points(decoded_points, start_lat, start_lng, round_trip, threshold_m)
+    if head is None and tail is None:
+        return decoded_points, False
+    return ([head] if head else []) + decoded_points + ([tail] if tail else []), True
+
+
+def _anchor_encoded_polyline(
+    encoded: str,
+    start_lat: float,
+    start_lng: float,
+    round_trip: bool,
+) -> tuple[List[tuple[float, float]], Optional[str]]:
+    """
+    polyline をデコードして開始地点を補う。(補った後の点列, 変更があれば新しい polyline / なければ None) を返す。
+
+    新しい polyline は全点を符号化し直さず、元の文字列の先頭・末尾だけを書き換えて作る（polyline.extend_encoded）。
+    """
+    points_arr = polyline.decode_polyline_array(encoded)
+    decoded_points = polyline.to_point_list(points_arr)
+    head, tail = _start_anchor_points(decoded_points, start_lat, start_lng, round_trip)
+    if head is None and tail is None:
+        return decoded_points, None
+    anchored = ([head] if head else []) + decoded_points + ([tail] if tail else [])
+    return anchored, polyline.extend_encoded(encoded, points_arr, head=head, tail=tail)
+
+
+def reanchor_response_start(response: GenerateRouteResponse, req: GenerateRouteRequest) -> GenerateRouteResponse:
+    """
+    近傍キャッシュで得たレスポンスの開始地点をリクエストの開始地点に合わせる。
+
+    polyline の先頭（周回時は末尾も）を _ensure_polyline_start で補い、nav_waypoints の先頭を差し替える。
+    周回ルートでは nav_waypoints の末尾も出発地点（simplify_polyline_to_waypoints が付け足したもの）なので差し替える。
+    元のレスポンスは変更せずコピーを返す。
+    """
+    route = response.route
+    start = LatLng(lat=float(req.start_location.lat), lng=float(req.start_location.lng))
+    route_update: Dict[str, Any] = {}
+    try:
+        _, anchored = _anchor_encoded_polyline(
+            route.polyline,
+            start_lat=start.lat,
+            start_lng=start.lng,
+            round_trip=bool(req.round_trip),
+        )
+        if anchored is not None:
+            route_update["polyline"] = anchored
+    except Exception as e:
+        logger.warning("[Polyline Reanchor Failed] request_id=%s err=%r", req.request_id, e)
+    if route.nav_waypoints:
+        waypoints = [start] + list(route.nav_waypoints[1:])
+        if req.round_trip and len(waypoints) >= 2:
+            waypoints[-1] = start
+        route_update["nav_waypoints"] = waypoints
+    return response.model_copy(
+        update={"request_id": req.request_id, "route": route.model_copy(update=route_update)}
+    )
 
 
 def _dedupe_nearby_points(points: List[LatLng], threshold_m: float = 10.0) -> List[LatLng]:
@@ -314,6 +405,28 @@ def _dedupe_nearby_points(points: List[LatLng], threshold_m: float = 10.0) -> Li
     return deduped
 
 
+def _places_memo_key(
+    *,
+    lat: float,
+    lng: float,
+    radius_m: int,
+    max_results: int,
+    included_types: Optional[List[str]],
+    keyword: Optional[str],
+    allow_unfiltered_fallback: bool,
+) -> tuple:
+    decimals = int(settings.PLACES_MEMO_ROUND_DECIMALS)
+    return (
+        round(float(lat), decimals),
+        round(float(lng), decimals),
+        int(radius_m),
+        int(max_results),
+        tuple(sorted(included_types)) if included_types else None,
+        keyword or None,
+        bool(allow_unfiltered_fallback),
+    )
+
+
 async def _collect_places_two_phase(
     *,
     request_id: str,
@@ -322,10 +435,14 @@ async def _collect_places_two_phase(
     max_spots: int = 5,
     radius_m: int = 800,
     max_results: int = 3,
+    hidden_keyword: Optional[str] = None,
+    places_memo: Optional[Dict[tuple, List[Dict[str, Any]]]] = None,
+    places_flight: Optional[SingleFlight[List[Dict[str, Any]]]] = None,
 ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     merged: List[Dict[str, Any]] = []
     seen_keys = set()
-    hidden_keyword = places_client.pick_hidden_keyword(theme)
+    if hidden_keyword is None:
+        hidden_keyword = places_client.pick_hidden_keyword(theme)
     classic_types = places_client.get_classic_place_types_for_theme(theme)
     if settings.PLACES_SAMPLE_POINTS_MAX > 0:
         sample_points = sample_points[: settings.PLACES_SAMPLE_POINTS_MAX]
@@ -360,16 +477,55 @@ async def _collect_places_two_phase(
                 theme,
                 phase["keyword"],
             )
-            found = await places_client.search_spots(
-                lat=float(lat),
-                lng=float(lng),
-                theme=theme,
+            memo_key = _places_memo_key(
+                lat=lat,
+                lng=lng,
                 radius_m=radius_m,
                 max_results=max_results,
                 included_types=phase["included_types"],
                 keyword=phase["keyword"],
                 allow_unfiltered_fallback=phase["allow_unfiltered_fallback"],
             )
+            if places_memo is not None and memo_key in places_memo:
+                found = places_memo[memo_key]
+                logger.debug(
+                    "[Places Memo Hit] request_id=%s phase=%s at (%.6f, %.6f)",
+                    request_id,
+                    phase["name"],
+                    lat,
+                    lng,
+                )
+            else:
+                async def _search(
+                    lat: float = lat, lng: float = lng, phase: Dict[str, Any] = phase, memo_key: tuple = memo_key
+                ) -> List[Dict[str, Any]]:
+                    result = await places_client.search_spots(
+                        lat=float(lat),
+                        lng=float(lng),
+                        theme=theme,
+                        radius_m=radius_m,
+                        max_results=max_results,
+                        included_types=phase["included_types"],
+                        keyword=phase["keyword"],
+                        allow_unfiltered_fallback=phase["allow_unfiltered_fallback"],
+                    )
+                    if places_memo is not None:
+                        places_memo[memo_key] = list(result)
+                    return result
+
+                if places_flight is None:
+                    found = await _search()
+                else:
+                    # 並行する候補が同じキーを検索中なら、その結果を待って共有する（Places 呼び出しは1回）
+                    found, shared = await places_flight.run(memo_key, _search)
+                    if shared:
+                        logger.debug(
+                            "[Places Flight Shared] request_id=%s phase=%s at (%.6f, %.6f)",
+                            request_id,
+                            phase["name"],
+                            lat,
+                            lng,
+                        )
             logger.info(
                 "[Places] request_id=%s phase=%s found %d places at (%.6f, %.6f): %s",
                 request_id,
@@ -410,7 +566,7 @@ async def log_request_bq(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     t_start = time.perf_counter()
     try:
-        bq_writer.insert_rows(settings.BQ_TABLE_REQUEST, [{
+        await bq_writer.insert_rows_async(settings.BQ_TABLE_REQUEST, [{
             "event_ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
             "request_id": req.request_id,
             "theme": req.theme,
@@ -439,6 +595,40 @@ async def log_request_bq(state: AgentState) -> Dict[str, Any]:
         }
 
 
+def _anchor_pooled_candidates(pooled: List[Dict[str, Any]], req: GenerateRouteRequest) -> List[Dict[str, Any]]:
+    """
+    プールの候補（タイルの代表地点から生成）の polyline の先頭・末尾をリクエストの出発地点に付け替える。
+
+    付け足した区間の分だけ distance_km / duration_min も伸ばす。
+    """
+    start_lat = float(req.start_location.lat)
+    start_lng = float(req.start_location.lng)
+    anchored: List[Dict[str, Any]] = []
+    for c in pooled:
+        encoded = c.get("polyline")
+        if not encoded or encoded == "xxxx":
+            anchored.append(c)
+            continue
+        points_arr = polyline.decode_polyline_array(encoded)
+        points = polyline.to_point_list(points_arr)
+        head, tail = _start_anchor_points(points, start_lat, start_lng, round_trip=True)
+        if head is None and tail is None:
+            anchored.append(c)
+            continue
+        extra_m = (polyline.haversine_m(head, points[0]) if head else 0.0) + (
+            polyline.haversine_m(points[-1], tail) if tail else 0.0
+        )
+        updated = dict(c)
+        updated["polyline"] = polyline.extend_encoded(encoded, points_arr, head=head, tail=tail)
+        distance_km = float(c.get("distance_km") or 0.0)
+        if distance_km > 0:
+            updated["distance_km"] = distance_km + extra_m / 1000.0
+            if c.get("duration_min"):
+                updated["duration_min"] = float(c["duration_min"]) * updated["distance_km"] / distance_km
+        anchored.append(updated)
+    return anchored
+
+
 async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     tools_used = list(state["tools_used"])
@@ -446,12 +636,41 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
     status = "error"
     error: Optional[str] = None
     t_start = time.perf_counter()
+    if req.round_trip and not state.get("candidate_pool_bypass"):
+        pooled = candidate_pool.lookup(
+            lat=float(req.start_location.lat),
+            lng=float(req.start_location.lng),
+            theme=req.theme,
+            distance_km=float(req.distance_km),
+            limit=int(settings.MAX_ROUTES),
+        )
+        if pooled:
+            pooled = _anchor_pooled_candidates(pooled, req)
+            elapsed_total_ms = int((time.perf_counter() - t_start) * 1000)
+            logger.info(
+                "[Routes Pool Hit] request_id=%s candidates=%d elapsed_ms=%d pool_hits=%d",
+                req.request_id,
+                len(pooled),
+                elapsed_total_ms,
+                candidate_pool.get_stats()["hits"],
+            )
+            return {
+                "candidates": pooled,
+                "routes_api_status": "ok",
+                "routes_error": None,
+                "tools_used": _ensure_tool_used(tools_used, "maps_routes"),
+                "latency_ms": _merge_latency(state, "generate_candidates_routes", elapsed_total_ms),
+            }
     try:
         effective_end_location = None if req.round_trip else req.end_location
         max_routes = max(1, int(settings.MAX_ROUTES))
         min_routes = max(1, int(settings.MIN_ROUTES))
         max_error_ratio = float(settings.ROUTE_DISTANCE_ERROR_RATIO_MAX)
         max_attempts = max(1, int(settings.ROUTE_DISTANCE_RETRY_MAX) + 1)
+        routes_concurrency = int(settings.ROUTES_CONCURRENCY)
+        if routes_concurrency <= 0:
+            routes_concurrency = int(settings.CONCURRENCY)
+        routes_concurrency = max(1, routes_concurrency)
         target_distance_km = float(req.distance_km)
         original_target_km = target_distance_km
         short_max_km = float(getattr(settings, "SHORT_DISTANCE_MAX_KM", 2.0))
@@ -470,6 +689,7 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
                 )
                 target_distance_km = adjusted
 
+        route_errors: List[str] = []
         for attempt in range(1, max_attempts + 1):
             attempt_candidates: List[Dict[str, Any]] = []
             best_score: Optional[float] = None
@@ -489,77 +709,113 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
             dests = dests[:max_routes]
 
             t0 = time.perf_counter()
-            for idx, dest in enumerate(dests, start=1):
-                route = await maps_routes_client.compute_route_candidate(
-                    request_id=req.request_id,
-                    start_lat=float(req.start_location.lat),
-                    start_lng=float(req.start_location.lng),
-                    dest=dest,
-                    idx=idx,
-                    round_trip=bool(req.round_trip),
-                )
-                if not route:
-                    continue
-                
-                # ルートの妥当性チェック
-                route_distance_km = float(route.get("distance_km") or 0.0)
-                route_polyline = route.get("polyline", "").strip()
-                
-                # 距離が0以下、または極端に小さい値（0.01km = 10m以下）の場合は無効
-                if route_distance_km <= 0.01:
-                    filtered_out += 1
-                    logger.warning(
-                        "[Routes Invalid] request_id=%s idx=%d distance too small: %.3fkm",
-                        req.request_id,
-                        idx,
-                        route_distance_km,
-                    )
-                    continue
-                
-                # polylineが空、または無効な値の場合は無効
-                if not route_polyline or route_polyline in ("", "xxxx", "~oia@"):
-                    filtered_out += 1
-                    logger.warning(
-                        "[Routes Invalid] request_id=%s idx=%d invalid polyline: %s",
-                        req.request_id,
-                        idx,
-                        route_polyline[:20] if route_polyline else "empty",
-                    )
-                    continue
-                
-                if target_distance_km > 0 and max_error_ratio >= 0:
-                    error_base_km = original_target_km if original_target_km > 0 else target_distance_km
-                    distance_error_ratio = abs(route_distance_km - error_base_km) / error_base_km
-                    if closest_error_ratio is None or distance_error_ratio < closest_error_ratio:
-                        closest_error_ratio = distance_error_ratio
-                        closest_distance_km = route_distance_km
-                    if distance_error_ratio > max_error_ratio:
+            routes_sem = asyncio.Semaphore(routes_concurrency)
+
+            async def _fetch_route(idx: int, dest: Any) -> tuple[int, Optional[Dict[str, Any]]]:
+                async with routes_sem:
+                    try:
+                        route = await maps_routes_client.compute_route_candidate(
+                            request_id=req.request_id,
+                            start_lat=float(req.start_location.lat),
+                            start_lng=float(req.start_location.lng),
+                            dest=dest,
+                            idx=idx,
+                            round_trip=bool(req.round_trip),
+                        )
+                    except Exception as e:
+                        # 1本の失敗（タイムアウト等）で並行して取得できた他の候補を捨てない
+                        route_errors.append(repr(e))
+                        logger.warning(
+                            "[Routes Candidate Failed] request_id=%s idx=%d err=%r",
+                            req.request_id,
+                            idx,
+                            e,
+                        )
+                        return idx, None
+                    return idx, route
+
+            # 全目的地を並列に投げ、完了順に検証する（早期終了時は残りをキャンセル）
+            route_tasks = [
+                asyncio.create_task(_fetch_route(idx, dest))
+                for idx, dest in enumerate(dests, start=1)
+            ]
+            accepted: List[tuple[int, Dict[str, Any]]] = []
+            try:
+                for next_done in asyncio.as_completed(route_tasks):
+                    idx, route = await next_done
+                    if not route:
+                        continue
+
+                    # ルートの妥当性チェック
+                    route_distance_km = float(route.get("distance_km") or 0.0)
+                    route_polyline = route.get("polyline", "").strip()
+
+                    # 距離が0以下、または極端に小さい値（0.01km = 10m以下）の場合は無効
+                    if route_distance_km <= 0.01:
                         filtered_out += 1
-                        logger.info(
-                            "[Routes Filtered] request_id=%s idx=%d error_ratio=%.3f target=%.3f actual=%.3f threshold=%.3f attempt=%d/%d",
+                        logger.warning(
+                            "[Routes Invalid] request_id=%s idx=%d distance too small: %.3fkm",
                             req.request_id,
                             idx,
-                            distance_error_ratio,
-                            target_distance_km,
                             route_distance_km,
-                            max_error_ratio,
-                            attempt,
-                            max_attempts,
                         )
                         continue
-                attempt_candidates.append(route)
-                score = _heuristic_score({"distance_km": route.get("distance_km")}, req)
-                if best_score is None or score > best_score:
-                    best_score = score
-                if len(attempt_candidates) >= min_routes and best_score >= float(settings.SCORE_THRESHOLD):
-                    logger.info(
-                        "[Routes Early Exit] request_id=%s candidates=%d best_score=%.3f threshold=%.3f",
-                        req.request_id,
-                        len(attempt_candidates),
-                        best_score,
-                        float(settings.SCORE_THRESHOLD),
-                    )
-                    break
+
+                    # polylineが空、または無効な値の場合は無効
+                    if not route_polyline or route_polyline in ("", "xxxx", "~oia@"):
+                        filtered_out += 1
+                        logger.warning(
+                            "[Routes Invalid] request_id=%s idx=%d invalid polyline: %s",
+                            req.request_id,
+                            idx,
+                            route_polyline[:20] if route_polyline else "empty",
+                        )
+                        continue
+
+                    if target_distance_km > 0 and max_error_ratio >= 0:
+                        error_base_km = original_target_km if original_target_km > 0 else target_distance_km
+                        distance_error_ratio = abs(route_distance_km - error_base_km) / error_base_km
+                        if closest_error_ratio is None or distance_error_ratio < closest_error_ratio:
+                            closest_error_ratio = distance_error_ratio
+                            closest_distance_km = route_distance_km
+                        if distance_error_ratio > max_error_ratio:
+                            filtered_out += 1
+                            logger.info(
+                                "[Routes Filtered] request_id=%s idx=%d error_ratio=%.3f target=%.3f actual=%.3f threshold=%.3f attempt=%d/%d",
+                                req.request_id,
+                                idx,
+                                distance_error_ratio,
+                                target_distance_km,
+                                route_distance_km,
+                                max_error_ratio,
+                                attempt,
+                                max_attempts,
+                            )
+                            continue
+                    accepted.append((idx, route))
+                    score = _heuristic_score({"distance_km": route.get("distance_km")}, req)
+                    if best_score is None or score > best_score:
+                        best_score = score
+                    if len(accepted) >= min_routes and best_score >= float(settings.SCORE_THRESHOLD):
+                        cancelled = sum(1 for task in route_tasks if not task.done())
+                        logger.info(
+                            "[Routes Early Exit] request_id=%s candidates=%d best_score=%.3f threshold=%.3f cancelled=%d",
+                            req.request_id,
+                            len(accepted),
+                            best_score,
+                            float(settings.SCORE_THRESHOLD),
+                            cancelled,
+                        )
+                        break
+            finally:
+                for task in route_tasks:
+                    if not task.done():
+                        task.cancel()
+                await asyncio.gather(*route_tasks, return_exceptions=True)
+
+            # 完了順ではなく目的地順に並べ直す（candidate_rank_in_theme を安定させるため）
+            accepted.sort(key=lambda x: x[0])
+            attempt_candidates = [route for _, route in accepted]
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             logger.info(
                 "[Routes Latency] request_id=%s candidates=%d elapsed_ms=%d attempt=%d/%d",
@@ -600,6 +856,8 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
         if candidates:
             tools_used = _ensure_tool_used(tools_used, "maps_routes")
             status = "ok"
+        elif route_errors:
+            error = route_errors[-1]
         else:
             status = "empty"
     except Exception as e:
@@ -670,6 +928,77 @@ async def fallback_candidates(state: AgentState) -> Dict[str, Any]:
     }
 
 
+def _detour_over_ratio(
+    decoded_points: List[tuple[float, float]],
+    place_latlng: np.ndarray,
+    detour_allowance_m: float,
+) -> float:
+    """スポット（(M, 2) の緯度経度）の経路からの距離が許容値を超えた割合の平均を返す（緯度経度が無いスポットは除外）。"""
+    if not decoded_points or place_latlng.size == 0 or detour_allowance_m <= 0:
+        return 0.0
+    detour_m = polyline.distances_to_path(polyline.PathGeometry.from_points(decoded_points), place_latlng)
+    detour_m = detour_m[np.isfinite(detour_m)]
+    if not detour_m.size:
+        return 0.0
+    over_ratios = np.maximum(0.0, detour_m - detour_allowance_m) / detour_allowance_m
+    return float(over_ratios.mean())
+
+
+async def _collect_candidate_places(
+    *,
+    req: GenerateRouteRequest,
+    decoded_points: List[tuple[float, float]],
+    hidden_keyword: Optional[str],
+    places_memo: Dict[tuple, List[Dict[str, Any]]],
+    places_flight: Optional[SingleFlight[List[Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """候補1本分の沿線スポットを検索する（サンプル点は polyline の 25/50/75% 地点）。"""
+    sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75]) if decoded_points else []
+    if not sample_points:
+        sample_points = [(float(req.start_location.lat), float(req.start_location.lng))]
+    merged_places, _ = await _collect_places_two_phase(
+        request_id=req.request_id,
+        theme=req.theme,
+        sample_points=sample_points,
+        max_spots=5,
+        radius_m=settings.PLACES_RADIUS_M,
+        max_results=settings.PLACES_MAX_RESULTS,
+        hidden_keyword=hidden_keyword,
+        places_memo=places_memo,
+        places_flight=places_flight,
+    )
+    return merged_places
+
+
+def _candidate_points(encoded: Optional[str]) -> List[tuple[float, float]]:
+    if encoded and encoded.strip() not in ("", "xxxx"):
+        return polyline.decode_polyline(encoded)
+    return []
+
+
+async def _enrich_candidate_places(
+    *,
+    req: GenerateRouteRequest,
+    cand: Candidate,
+    detour_allowance_m: float,
+    hidden_keyword: Optional[str],
+    places_memo: Dict[tuple, List[Dict[str, Any]]],
+    places_flight: Optional[SingleFlight[List[Dict[str, Any]]]] = None,
+) -> tuple[float, float]:
+    """候補1本分のスポット検索を行い (spot_type_diversity, detour_over_ratio) を返す。"""
+    decoded_points = _candidate_points(cand.polyline)
+    merged_places = await _collect_candidate_places(
+        req=req,
+        decoded_points=decoded_points,
+        hidden_keyword=hidden_keyword,
+        places_memo=places_memo,
+        places_flight=places_flight,
+    )
+    spot_type_diversity = _spot_type_diversity(merged_places)
+    detour_over_ratio = _detour_over_ratio(decoded_points, _place_latlng_array(merged_places), detour_allowance_m)
+    return spot_type_diversity, detour_over_ratio
+
+
 async def compute_features(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     candidates = state["candidates"]
@@ -679,64 +1008,90 @@ async def compute_features(state: AgentState) -> Dict[str, Any]:
     candidate_index_map: Dict[str, int] = {}
     normalized_candidates: List[Dict[str, Any]] = []
     t_start = time.perf_counter()
-
+    detour_allowance_m = _detour_allowance_m(float(req.distance_km))
+    # 穴場キーワードはリクエスト内で固定し、fetch_places でも同じ検索結果を再利用できるようにする
+    hidden_keyword = state.get("places_hidden_keyword") or places_client.pick_hidden_keyword(req.theme)
+    places_memo: Dict[tuple, List[Dict[str, Any]]] = dict(state.get("places_memo") or {})
+    # 並行するスポット検索のうち、メモ未登録の同一キーは1回の Places 呼び出しにまとめる
+    places_flight: SingleFlight[List[Dict[str, Any]]] = SingleFlight()
+
+    prepared: List[tuple[int, Dict[str, Any], Candidate, Optional[Dict[str, Any]]]] = []
     for i, c in enumerate(candidates, start=1):
         normalized = dict(c)
+        # 候補プール由来の候補はスポット検索結果（多様性・スポットの緯度経度）を事前計算済み
+        pooled_features = normalized.pop("pool_features", None)
         normalized["route_id"] = str(uuid.uuid4())
         normalized.setdefault("is_fallback", False)
         normalized.setdefault("theme", req.theme)
+        encoded = normalized.get("polyline", "xxxx")
+        # 形状の特徴量（デコード結果はリクエスト内キャッシュでスポット検索と共有）
+        geometry = candidate_geometry(encoded)
         cand = Candidate(
             route_id=normalized["route_id"],
-            polyline=normalized.get("polyline", "xxxx"),
+            polyline=encoded,
             distance_km=float(normalized.get("distance_km", req.distance_km)),
             duration_min=float(normalized.get("duration_min") or 30.0 + i),
-            loop_closure_m=20.0,
-            bbox_area=0.5,
-            path_length_ratio=1.3,
-            turn_count=10 + i,
+            loop_closure_m=geometry.loop_closure_m,
+            bbox_area=geometry.bbox_area,
+            path_length_ratio=geometry.path_length_ratio,
+            turn_count=geometry.turn_count,
+            self_overlap_ratio=geometry.self_overlap_ratio,
+            straightness=geometry.straightness,
             has_stairs=normalized.get("has_stairs", False),
             elevation_gain_m=float(normalized.get("elevation_gain_m", 0.0)),
         )
+        prepared.append((i, normalized, cand, pooled_features))
+
+    # 候補ごとのスポット検索を並列実行（共有セマフォ + 候補単位のタイムアウト）
+    enrich_sem = asyncio.Semaphore(max(1, int(settings.FEATURES_CONCURRENCY)))
+    enrich_timeout_sec = float(settings.FEATURES_PLACES_TIMEOUT_SEC)
+
+    async def _enrich_with_limit(cand: Candidate, pooled_features: Optional[Dict[str, Any]]) -> tuple[float, float]:
+        if pooled_features:
+            # 寄り道超過は出発地点に付け替えた後の polyline とリクエスト距離の許容値で計算し直す
+            place_latlng = np.asarray(pooled_features.get("place_latlngs") or [], dtype=np.float64).reshape(-1, 2)
+            return (
+                float(pooled_features.get("spot_type_diversity", 0.0)),
+                _detour_over_ratio(_candidate_points(cand.polyline), place_latlng, detour_allowance_m),
+            )
+        async with enrich_sem:
+            return await asyncio.wait_for(
+                _enrich_candidate_places(
+                    req=req,
+                    cand=cand,
+                    detour_allowance_m=detour_allowance_m,
+                    hidden_keyword=hidden_keyword,
+                    places_memo=places_memo,
+                    places_flight=places_flight,
+                ),
+                timeout=enrich_timeout_sec if enrich_timeout_sec > 0 else None,
+            )
+
+    enrich_results = await asyncio.gather(
+        *(_enrich_with_limit(cand, pooled_features) for _, _, cand, pooled_features in prepared),
+        return_exceptions=True,
+    )
+
+    # 結果は元の候補順でマージする（candidate_rank_in_theme / rep_routes_payload を決定的に保つ）
+    for (i, normalized, cand, _), result in zip(prepared, enrich_results):
         spot_type_diversity = 0.0
         detour_over_ratio = 0.0
-        detour_allowance_m = _detour_allowance_m(float(req.distance_km))
-        try:
-            decoded_points: List[tuple[float, float]] = []
-            if cand.polyline and cand.polyline.strip() not in ("", "xxxx"):
-                decoded_points = polyline.decode_polyline(cand.polyline)
-            sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75]) if decoded_points else []
-            if not sample_points:
-                sample_points = [(float(req.start_location.lat), float(req.start_location.lng))]
-            merged_places, _ = await _collect_places_two_phase(
-                request_id=req.request_id,
-                theme=req.theme,
-                sample_points=sample_points,
-                max_spots=5,
-                radius_m=settings.PLACES_RADIUS_M,
-                max_results=settings.PLACES_MAX_RESULTS,
+        if isinstance(result, asyncio.TimeoutError):
+            logger.warning(
+                "[Places Diversity Timeout] request_id=%s route_id=%s timeout_sec=%.1f",
+                req.request_id,
+                cand.route_id,
+                enrich_timeout_sec,
             )
-            spot_type_diversity = _spot_type_diversity(merged_places)
-            if decoded_points and merged_places:
-                over_ratios: List[float] = []
-                for p in merged_places:
-                    lat = p.get("lat")
-                    lng = p.get("lng")
-                    if lat is None or lng is None:
-                        continue
-                    detour_m = polyline.distance_to_path_m(decoded_points, (float(lat), float(lng)))
-                    if detour_allowance_m <= 0:
-                        continue
-                    over = max(0.0, detour_m - detour_allowance_m)
-                    over_ratios.append(over / detour_allowance_m)
-                if over_ratios:
-                    detour_over_ratio = sum(over_ratios) / len(over_ratios)
-        except Exception as e:
+        elif isinstance(result, BaseException):
             logger.warning(
                 "[Places Diversity Failed] request_id=%s route_id=%s err=%r",
                 req.request_id,
                 cand.route_id,
-                e,
+                result,
             )
+        else:
+            spot_type_diversity, detour_over_ratio = result
         feats = calc_features(
             candidate=cand,
             theme=req.theme,
@@ -762,6 +1117,8 @@ async def compute_features(state: AgentState) -> Dict[str, Any]:
         "candidate_features_map": candidate_features_map,
         "candidate_index_map": candidate_index_map,
         "candidates_features": candidate_features_list,
+        "places_hidden_keyword": hidden_keyword,
+        "places_memo": places_memo,
         "latency_ms": _merge_latency(state, "compute_features", elapsed_ms),
     }
 
@@ -990,16 +1347,17 @@ async def sample_points_from_polyline(state: AgentState) -> Dict[str, Any]:
 
     try:
         if encoded and encoded != "xxxx":
-            decoded_points = polyline.decode_polyline(encoded)
-            decoded_points, changed = _ensure_polyline_start(
-                decoded_points=decoded_points,
+            # compute_features でデコード済みの polyline はリクエスト内キャッシュから返る
+            decoded_points, anchored = _anchor_encoded_polyline(
+                encoded,
                 start_lat=float(req.start_location.lat),
                 start_lng=float(req.start_location.lng),
                 round_trip=bool(req.round_trip),
             )
-            if changed:
-                updated_route["polyline"] = polyline_lib.encode(decoded_points)
-            sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75])
+            if anchored is not None:
+                updated_route["polyline"] = anchored
+            # 代表点は補う前の点列から取る（compute_features と同じ点になり、Places のメモがそのまま当たる）
+            sample_points = polyline.sample_points(polyline.decode_polyline(encoded), [0.25, 0.5, 0.75])
     except Exception as e:
         logger.warning("[Polyline Decode Failed] request_id=%s err=%r", req.request_id, e)
 
@@ -1020,6 +1378,7 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
     tools_used = list(state["tools_used"])
     sample_points = state["sample_points"]
     decoded_points = state.get("decoded_points") or []
+    places_memo: Dict[tuple, List[Dict[str, Any]]] = dict(state.get("places_memo") or {})
     status = "error"
     error: Optional[str] = None
     places: List[Dict[str, Any]] = []
@@ -1034,29 +1393,34 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
             max_spots=5,
             radius_m=settings.PLACES_RADIUS_M,
             max_results=settings.PLACES_MAX_RESULTS,
+            hidden_keyword=state.get("places_hidden_keyword"),
+            places_memo=places_memo,
         )
         places = selected
         if decoded_points:
+            # 経路の投影と距離計算は1回だけ行い、緩和段階ごとの絞り込みは閾値の比較だけで済ませる
+            geometry = polyline.PathGeometry.from_points(decoded_points)
             filtered = _filter_places_by_route_distance(
                 places=places,
-                decoded_points=decoded_points,
+                distances=_place_route_distances(geometry, places),
                 max_distance_m=float(settings.SPOT_MAX_DISTANCE_M),
                 max_spots=5,
             )
             if len(filtered) < 3:
+                merged_distances = _place_route_distances(geometry, merged)
                 filtered = _filter_places_by_route_distance(
                     places=merged,
-                    decoded_points=decoded_points,
+                    distances=merged_distances,
                     max_distance_m=float(settings.SPOT_MAX_DISTANCE_M_RELAXED),
                     max_spots=5,
                 )
-            if len(filtered) < 3:
-                filtered = _filter_places_by_route_distance(
-                    places=merged,
-                    decoded_points=decoded_points,
-                    max_distance_m=float(settings.SPOT_MAX_DISTANCE_M_FALLBACK),
-                    max_spots=5,
-                )
+                if len(filtered) < 3:
+                    filtered = _filter_places_by_route_distance(
+                        places=merged,
+                        distances=merged_distances,
+                        max_distance_m=float(settings.SPOT_MAX_DISTANCE_M_FALLBACK),
+                        max_spots=5,
+                    )
             places = filtered
         if places:
             tools_used = _ensure_tool_used(tools_used, "places")
@@ -1064,11 +1428,15 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
         else:
             status = "empty"
         elapsed_ms = int((time.perf_counter() - t0) * 1000)
+        cache_stats = places_cache.get_stats()
         logger.info(
-            "[Places Latency] request_id=%s spots=%d elapsed_ms=%d",
+            "[Places Latency] request_id=%s spots=%d elapsed_ms=%d cache_hits=%d cache_misses=%d cache_entries=%d",
             req.request_id,
             len(places),
             elapsed_ms,
+            cache_stats["hits"],
+            cache_stats["misses"],
+            cache_stats["entries"],
         )
     except Exception as e:
         error = repr(e)
@@ -1079,6 +1447,7 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
         "places": places,
         "places_status": status,
         "places_error": error,
+        "places_memo": places_memo,
         "tools_used": tools_used,
         "latency_ms": _merge_latency(state, "fetch_places", elapsed_total_ms),
     }
@@ -1164,6 +1533,7 @@ async def parallel_postprocess(state: AgentState) -> Dict[str, Any]:
         "places": places_result.get("places", []),
         "places_status": places_result.get("places_status", "error"),
         "places_error": places_result.get("places_error"),
+        "places_memo": places_result.get("places_memo", state.get("places_memo", {})),
         "description": text_result.get("description"),
         "desc_llm_status": text_result.get("desc_llm_status"),
         "desc_fallback_used": text_result.get("desc_fallback_used"),
@@ -1561,6 +1931,8 @@ async def store_candidates_bq(state: AgentState) -> Dict[str, Any]:
             "path_length_ratio": feats.get("path_length_ratio"),
             "turn_count": feats.get("turn_count"),
             "turn_density": feats.get("turn_density"),
+            "self_overlap_ratio": feats.get("self_overlap_ratio"),
+            "straightness": feats.get("straightness"),
             "theme_exercise": feats.get("theme_exercise"),
             "theme_think": feats.get("theme_think"),
             "theme_refresh": feats.get("theme_refresh"),
@@ -1576,7 +1948,7 @@ async def store_candidates_bq(state: AgentState) -> Dict[str, Any]:
             "poi_density": feats.get("poi_density"),
             "park_poi_ratio": feats.get("park_poi_ratio"),
         })
-    bq_writer.insert_rows(settings.BQ_TABLE_CANDIDATE, candidate_rows)
+    await bq_writer.insert_rows_async(settings.BQ_TABLE_CANDIDATE, candidate_rows)
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {"latency_ms": _merge_latency(state, "store_candidates_bq", elapsed_ms)}
 
@@ -1585,7 +1957,7 @@ async def store_proposal_bq(state: AgentState) -> Dict[str, Any]:
     t_start = time.perf_counter()
     req = state["request"]
     best_route = state["best_route"]
-    bq_writer.insert_rows(settings.BQ_TABLE_PROPOSAL, [{
+    await bq_writer.insert_rows_async(settings.BQ_TABLE_PROPOSAL, [{
         "event_ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "request_id": req.request_id,
         "chosen_route_id": best_route["route_id"],
@@ -1594,6 +1966,7 @@ async def store_proposal_bq(state: AgentState) -> Dict[str, Any]:
         "tools_used": state["tools_used"],
         "summary_type": state["summary_type"],
         "total_latency_ms": state["total_latency_ms"],
+        "logging_latency_ms": state.get("logging_latency_ms"),
         "features_version": settings.FEATURES_VERSION,
         "ranker_version": settings.RANKER_VERSION,
     }])
@@ -1684,7 +2057,6 @@ async def build_response(state: AgentState) -> Dict[str, Any]:
 def _build_graph() -> StateGraph:
     graph = StateGraph(AgentState)
     graph.add_node("validate_request", validate_request)
-    graph.add_node("log_request_bq", log_request_bq)
     graph.add_node("generate_candidates_routes", generate_candidates_routes)
     graph.add_node("fallback_candidates", fallback_candidates)
     graph.add_node("compute_features", compute_features)
@@ -1699,13 +2071,10 @@ def _build_graph() -> StateGraph:
     graph.add_node("generate_title_vertex", generate_title_vertex)
     graph.add_node("compute_quality", compute_quality)
     graph.add_node("build_fallback_details", build_fallback_details)
-    graph.add_node("store_candidates_bq", store_candidates_bq)
-    graph.add_node("store_proposal_bq", store_proposal_bq)
     graph.add_node("build_response", build_response)
 
     graph.set_entry_point("validate_request")
-    graph.add_edge("validate_request", "log_request_bq")
-    graph.add_edge("log_request_bq", "generate_candidates_routes")
+    graph.add_edge("validate_request", "generate_candidates_routes")
     graph.add_conditional_edges(
         "generate_candidates_routes",
         lambda state: "fallback_candidates"
@@ -1726,21 +2095,138 @@ def _build_graph() -> StateGraph:
     graph.add_edge("parallel_postprocess", "simplify_polyline_to_waypoints")
     graph.add_edge("simplify_polyline_to_waypoints", "compute_quality")
     graph.add_edge("compute_quality", "build_fallback_details")
-    graph.add_edge("build_fallback_details", "store_candidates_bq")
-    graph.add_edge("store_candidates_bq", "store_proposal_bq")
-    graph.add_edge("store_proposal_bq", "build_response")
+    graph.add_edge("build_fallback_details", "build_response")
     graph.add_edge("build_response", END)
     return graph
 
 
 _route_graph = _build_graph().compile()
 
+# レスポンス返却後の BigQuery ログタスク（GC で消えないよう参照を保持）
+_post_response_tasks: set[asyncio.Task] = set()
+
+
+async def log_bq_after_response(state: AgentState, request_only: bool = False) -> None:
+    """
+    レスポンス返却後に BigQuery へのログ（リクエスト・候補・提案）を書き込む。
+
+    request_only=True の場合（生成が失敗したリクエスト）はリクエスト行のみ。
+    失敗してもレスポンスには影響しないため、例外はログのみ。
+    """
+    req = state["request"]
+    state = dict(state)
+    t_start = time.perf_counter()
+    try:
+        state.update(await log_request_bq(state))
+        if request_only:
+            return
+        state.update(await store_candidates_bq(state))
+        # 提案行には、それまでのログ書き込みにかかった時間を載せる
+        state["logging_latency_ms"] = int((time.perf_counter() - t_start) * 1000)
+        state.update(await store_proposal_bq(state))
+        logger.info(
+            "[BQ Post Response] request_id=%s elapsed_ms=%d steps=%s",
+            req.request_id,
+            int((time.perf_counter() - t_start) * 1000),
+            {k: v for k, v in state["latency_ms"].items() if k.endswith("_bq")},
+        )
+    except Exception as e:
+        logger.warning("[BQ Post Response Failed] request_id=%s err=%r", req.request_id, e)
+
+
+def _schedule_post_response(state: AgentState, request_only: bool = False) -> None:
+    task = asyncio.create_task(log_bq_after_response(state, request_only=request_only))
+    _post_response_tasks.add(task)
+    task.add_done_callback(_post_response_tasks.discard)
+
 
-async def run_generate_graph(req: GenerateRouteRequest) -> GenerateRouteResponse:
+async def drain_post_response_tasks(timeout_sec: float) -> None:
+    """未完了のレスポンス後ログタスクを待つ（lifespan の終了時に呼ぶ）。"""
+    pending = list(_post_response_tasks)
+    if not pending:
+        return
+    _, not_done = await asyncio.wait(pending, timeout=timeout_sec if timeout_sec > 0 else None)
+    if not_done:
+        logger.warning("[BQ Post Response Drain Timeout] pending=%d", len(not_done))
+
+
+async def run_generate_graph(req: GenerateRouteRequest, log_to_bq: bool = True) -> GenerateRouteResponse:
+    """
+    ルート生成グラフを実行する。
+
+    log_to_bq=False の場合（キャッシュの裏での再生成など、ユーザーに見せない生成）は BigQuery に記録しない。
+    """
     state = _init_state(req)
-    result = await _route_graph.ainvoke(state)
+    try:
+        # 同じ polyline のデコードはリクエスト内で1回だけ（ノードのタスクはこのコンテキストを引き継ぐ）
+        with polyline.decode_cache_scope():
+            result = await _route_graph.ainvoke(state)
+    except Exception:
+        # validate_request を通過した後に失敗したリクエストも、従来どおりリクエスト行は残す
+        if log_to_bq and (req.round_trip or req.end_location is not None):
+            _schedule_post_response(state, request_only=True)
+        raise
+    if log_to_bq:
+        _schedule_post_response(result)
     return result["response"]
 
 
 def get_route_graph_mermaid() -> str:
     return _route_graph.get_graph().draw_mermaid()
+
+
+async def warm_candidate_pool() -> Dict[str, int]:
+    """
+    設定された (出発地点, テーマ, 距離) ごとに候補生成 + 特徴量計算を行い、候補プールを更新する。
+
+    ノード generate_candidates_routes / compute_features をそのまま使う（プール参照はバイパス）。
+    """
+    summary = {"targets": 0, "stored": 0, "empty": 0, "failed": 0}
+    rounds = max(1, int(settings.CANDIDATE_POOL_ROUNDS))
+    for target in candidate_pool.warm_targets():
+        summary["targets"] += 1
+        key = candidate_pool.build_key(**target)
+        pooled: List[Dict[str, Any]] = []
+        try:
+            for _ in range(rounds):
+                req = GenerateRouteRequest(
+                    request_id=f"pool-warm-{uuid.uuid4()}",
+                    theme=target["theme"],
+                    distance_km=target["distance_km"],
+                    start_location=LatLng(lat=target["lat"], lng=target["lng"]),
+                    round_trip=True,
+                )
+                state = _init_state(req)
+                state["candidate_pool_bypass"] = True
+                state.update(await generate_candidates_routes(state))
+                if not state["candidates"]:
+                    continue
+                state.update(await compute_features(state))
+                for c in state["candidates"]:
+                    feats = state["candidate_features_map"].get(c["route_id"], {})
+                    # スポットは compute_features のメモから引き直す（Places は呼ばない）。寄り道超過は
+                    # 付け替え後の polyline に依存するため、ヒット時に計算できるよう緯度経度を持たせる
+                    places = await _collect_candidate_places(
+                        req=req,
+                        decoded_points=_candidate_points(c.get("polyline")),
+                        hidden_keyword=state["places_hidden_keyword"],
+                        places_memo=state["places_memo"],
+                    )
+                    place_latlng = _place_latlng_array(places)
+                    place_latlng = place_latlng[np.isfinite(place_latlng).all(axis=1)]
+                    entry = {k: v for k, v in c.items() if k != "route_id"}
+                    entry["pool_features"] = {
+                        "spot_type_diversity": float(feats.get("spot_type_diversity", 0.0)),
+                        "place_latlngs": place_latlng.tolist(),
+                    }
+                    pooled.append(entry)
+        except Exception as e:
+            summary["failed"] += 1
+            logger.warning("[Candidate Pool Warm Failed] key=%s err=%r", key, e)
+            continue
+        if pooled:
+            candidate_pool.store(key, pooled, origin=(target["lat"], target["lng"]))
+            summary["stored"] += 1
+        else:
+            summary["empty"] += 1
+    return summary
@@ -1,11 +1,13 @@
 from __future__ import annotations
+import asyncio
 import time
 import logging
-from typing import Dict
+import uuid
+from typing import Dict, Set
 from contextlib import asynccontextmanager
 import httpx
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.responses import PlainTextResponse
 from app.schemas import (
     GenerateRouteRequest,
@@ -16,14 +18,30 @@ from app.schemas import (
 from app.settings import settings
 from app.services import http_client
 from app.services import bq_writer
+from app.services import candidate_pool
+from app.services import ranker_embedded
 from app.services.ttl_cache import (
+    CacheEntry,
+    acquire_lease,
     build_cache_key,
     cache_get,
+    cache_get_entry,
     cache_key_prefix,
     cache_set,
-    _get_key_lock,
+    cache_set_negative,
+    generate_flight,
+    proximity_index,
+    record,
+    release_lease,
+    wait_for_leader,
+)
+from app.graph import (
+    drain_post_response_tasks,
+    get_route_graph_mermaid,
+    reanchor_response_start,
+    run_generate_graph,
+    warm_candidate_pool,
 )
-from app.graph import get_route_graph_mermaid, run_generate_graph
 
 
 def _configure_logging() -> None:
@@ -32,13 +50,52 @@ def _configure_logging() -> None:
 
 
 _configure_logging()
+
+
+async def _candidate_pool_loop() -> None:
+    """候補プールを CANDIDATE_POOL_REFRESH_SEC ごとに再生成する（失敗しても次の周期で再試行）。"""
+    interval_sec = max(1.0, float(settings.CANDIDATE_POOL_REFRESH_SEC))
+    while True:
+        t0 = time.perf_counter()
+        try:
+            summary = await warm_candidate_pool()
+            logger.info(
+                "candidate_pool_warm targets=%d stored=%d empty=%d failed=%d elapsed_ms=%d pools=%d hit_ratio=%.3f",
+                summary["targets"],
+                summary["stored"],
+                summary["empty"],
+                summary["failed"],
+                int((time.perf_counter() - t0) * 1000),
+                candidate_pool.get_stats()["pools"],
+                candidate_pool.get_stats()["hit_ratio"],
+            )
+        except Exception as e:
+            logger.warning("candidate_pool_warm_failed err=%r", e)
+        await asyncio.sleep(interval_sec)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     timeout = httpx.Timeout(settings.REQUEST_TIMEOUT_SEC)
     limits = httpx.Limits(max_connections=50, max_keepalive_connections=10)
     client = httpx.AsyncClient(timeout=timeout, limits=limits)
     http_client.set_client(client)
+    if settings.BQ_WRITER_ENABLED:
+        bq_writer.writer.start()
+    if settings.RANKER_MODE == "embedded":
+        # モデルのロードと Ranker のバックグラウンド処理の開始を起動時に済ませる（初回リクエストで待たせない）
+        await asyncio.to_thread(ranker_embedded.start)
+    warmer_task = None
+    if settings.CANDIDATE_POOL_ENABLED:
+        warmer_task = asyncio.create_task(_candidate_pool_loop())
     yield
+    if warmer_task is not None:
+        warmer_task.cancel()
+        await asyncio.gather(warmer_task, return_exceptions=True)
+    # レスポンス後のログタスクを待ち、キューに残ったログ行を書き切ってから終了
+    await drain_post_response_tasks(float(settings.BQ_SHUTDOWN_FLUSH_TIMEOUT_SEC))
+    await bq_writer.writer.stop()
+    await asyncio.to_thread(ranker_embedded.shutdown)
     await client.aclose()
     http_client.set_client(None)
 
@@ -59,9 +116,9 @@ def get_route_graph() -> str:
 
 
 @app.post("/route/feedback", response_model=FeedbackResponse)
-def post_feedback(req: FeedbackRequest) -> FeedbackResponse:
-    # Best-effort store
-    bq_writer.insert_rows(settings.BQ_TABLE_FEEDBACK, [{
+async def post_feedback(req: FeedbackRequest) -> FeedbackResponse:
+    # Best-effort store（バックグラウンドライターのキューに積むだけ。未起動時の同期書き込みはスレッドで実行）
+    await bq_writer.insert_rows_async(settings.BQ_TABLE_FEEDBACK, [{
         "event_ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "request_id": req.request_id,
         "route_id": req.route_id,
@@ -71,6 +128,122 @@ def post_feedback(req: FeedbackRequest) -> FeedbackResponse:
     return FeedbackResponse(request_id=req.request_id)
 
 
+# stale 応答後のバックグラウンド再生成タスク（GC で消えないよう参照を保持）
+_refresh_tasks: Set[asyncio.Task] = set()
+
+
+def _response_from_entry(entry: CacheEntry, req: GenerateRouteRequest) -> GenerateRouteResponse:
+    """キャッシュエントリをレスポンスにする。negative の場合は保存時と同じ 422 を送出する。"""
+    if entry.negative:
+        raise HTTPException(status_code=422, detail=entry.detail or "No viable route found")
+    resp = GenerateRouteResponse(**entry.response)
+    resp.request_id = req.request_id
+    return resp
+
+
+async def _generate_and_cache(
+    req: GenerateRouteRequest,
+    key: str,
+    key_pre: str,
+    log_to_bq: bool = True,
+) -> GenerateRouteResponse:
+    """
+    生成を実行してキャッシュに保存する（同一キーでは generate_flight 経由で1本化される）。
+
+    log_to_bq=False は裏での再生成用（ユーザーに返さないルートを BigQuery に記録しない）。
+    """
+    # 集約開始までに他の生成が完了していた場合はその結果を使う
+    cached = await cache_get(key)
+    if cached is not None:
+        logger.info("cache_hit generate key=%s req=%s (in flight)", key_pre, req.request_id)
+        return GenerateRouteResponse(**cached)
+
+    # インスタンス間の集約: 他インスタンスが生成中なら結果を待つ
+    # （裏での再生成は別のリースを使い、ユーザーの生成が BigQuery に記録されない再生成の結果を待たないようにする）
+    lease_key = key if log_to_bq else _refresh_key(key)
+    lease_token = await acquire_lease(lease_key)
+    if lease_token is None:
+        entry = await wait_for_leader(key)
+        if entry is not None:
+            logger.info("cache_hit generate key=%s req=%s (after lease wait)", key_pre, req.request_id)
+            return _response_from_entry(entry, req)
+        logger.info("cache_lease_timeout generate key=%s req=%s", key_pre, req.request_id)
+
+    # 生成実行（422 は短時間 negative キャッシュ、それ以外のエラーはキャッシュせず伝播）
+    try:
+        response = await run_generate_graph(req, log_to_bq=log_to_bq)
+        await cache_set(key, response.model_dump(mode="json"))
+        if settings.GENERATE_CACHE_PROXIMITY_ENABLED:
+            proximity_index.add(key, req)
+        return response
+    except HTTPException as e:
+        if e.status_code == 422:
+            metrics = record("negative_set")
+            await cache_set_negative(key, str(e.detail))
+            logger.info(
+                "cache_negative_set generate key=%s req=%s detail=%s negative_set_total=%d",
+                key_pre,
+                req.request_id,
+                e.detail,
+                metrics["negative_set"],
+            )
+        raise
+    finally:
+        await release_lease(lease_key, lease_token)
+
+
+def _refresh_key(key: str) -> str:
+    """裏での再生成の集約キー（ユーザーの生成とは generate_flight・リースを共有しない）"""
+    return f"{key}:refresh"
+
+
+async def _refresh_in_background(req: GenerateRouteRequest, key: str, key_pre: str) -> None:
+    t0 = time.perf_counter()
+    try:
+        await generate_flight.run(_refresh_key(key), lambda: _generate_and_cache(req, key, key_pre, log_to_bq=False))
+        metrics = record("refresh_ok")
+        logger.info(
+            "cache_refresh_done generate key=%s req=%s elapsed_ms=%d refresh_ok_total=%d",
+            key_pre,
+            req.request_id,
+            int((time.perf_counter() - t0) * 1000),
+            metrics["refresh_ok"],
+        )
+    except Exception as e:
+        metrics = record("refresh_failed")
+        logger.warning(
+            "cache_refresh_failed generate key=%s req=%s err=%r refresh_failed_total=%d",
+            key_pre,
+            req.request_id,
+            e,
+            metrics["refresh_failed"],
+        )
+
+
+def _schedule_refresh(req: GenerateRouteRequest, key: str, key_pre: str) -> None:
+    """
+    stale エントリの再生成をバックグラウンドで起動する（既に生成中なら何もしない）。
+
+    再生成したルートは stale を受け取ったユーザーには見せないため、別の request_id で実行し BigQuery には記録しない
+    （フィードバックと表示ルートの結合を崩さない）。集約キーも別にし、キャッシュミスしたユーザーのリクエストが
+    記録されない再生成に相乗りしないようにする。ユーザーの生成が進行中ならその結果でキャッシュが更新されるので何もしない。
+    """
+    if generate_flight.in_flight(_refresh_key(key)) or generate_flight.in_flight(key):
+        return
+    refresh_req = req.model_copy(update={"request_id": f"cache-refresh-{uuid.uuid4()}"})
+    metrics = record("refresh_start")
+    logger.info(
+        "cache_refresh_start generate key=%s req=%s refresh_req=%s refresh_start_total=%d",
+        key_pre,
+        req.request_id,
+        refresh_req.request_id,
+        metrics["refresh_start"],
+    )
+    task = asyncio.create_task(_refresh_in_background(refresh_req, key, key_pre))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
 @app.post("/route/generate", response_model=GenerateRouteResponse)
 async def generate(req: GenerateRouteRequest) -> GenerateRouteResponse:
     # debug 時はキャッシュを使わず毎回生成（レスポンスメタに影響しうるため）
@@ -84,28 +257,64 @@ async def generate(req: GenerateRouteRequest) -> GenerateRouteResponse:
     key = build_cache_key(req)
     key_pre = cache_key_prefix(key)
 
-    # 1) キャッシュ参照
-    cached = cache_get(key)
-    if cached is not None:
-        resp = GenerateRouteResponse(**cached)
-        resp.request_id = req.request_id
-        logger.info("cache_hit generate key=%s req=%s", key_pre, req.request_id)
-        return resp
+    # 1) キャッシュ参照（fresh はそのまま、stale は即時返却 + 裏で再生成、negative は 422）
+    entry = await cache_get_entry(key)
+    if entry is not None:
+        if entry.negative:
+            metrics = record("negative_hit")
+            logger.info(
+                "cache_negative_hit generate key=%s req=%s age_ms=%d negative_hit_total=%d",
+                key_pre,
+                req.request_id,
+                int(entry.age_sec * 1000),
+                metrics["negative_hit"],
+            )
+            return _response_from_entry(entry, req)
+        if entry.fresh:
+            metrics = record("hit")
+            logger.info("cache_hit generate key=%s req=%s hit_total=%d", key_pre, req.request_id, metrics["hit"])
+            return _response_from_entry(entry, req)
+        metrics = record("stale")
+        logger.info(
+            "cache_stale generate key=%s req=%s age_ms=%d stale_total=%d",
+            key_pre,
+            req.request_id,
+            int(entry.age_sec * 1000),
+            metrics["stale"],
+        )
+        _schedule_refresh(req, key, key_pre)
+        return _response_from_entry(entry, req)
+
+    # 1b) 近傍一致（開始/終了地点が半径内・テーマ/周回/距離が同じ fresh エントリ）
+    if settings.GENERATE_CACHE_PROXIMITY_ENABLED:
+        near_key = proximity_index.find(req, exclude_key=key)
+        if near_key is not None:
+            near_entry = await cache_get_entry(near_key)
+            if near_entry is not None and near_entry.fresh:
+                metrics = record("proximity_hit")
+                logger.info(
+                    "cache_proximity_hit generate key=%s near_key=%s req=%s proximity_hit_total=%d",
+                    key_pre,
+                    cache_key_prefix(near_key),
+                    req.request_id,
+                    metrics["proximity_hit"],
+                )
+                return reanchor_response_start(GenerateRouteResponse(**near_entry.response), req)
 
-    logger.info("cache_miss generate key=%s req=%s", key_pre, req.request_id)
+    metrics = record("miss")
+    logger.info("cache_miss generate key=%s req=%s miss_total=%d", key_pre, req.request_id, metrics["miss"])
 
     # 2) 同一キーの並行リクエストを1本に集約（スタンピード防止）
-    key_lock = await _get_key_lock(key)
-    async with key_lock:
-        # 二重チェック（ロック取得中に他リクエストがキャッシュした可能性）
-        cached = cache_get(key)
-        if cached is not None:
-            resp = GenerateRouteResponse(**cached)
-            resp.request_id = req.request_id
-            logger.info("cache_hit generate key=%s req=%s (after lock)", key_pre, req.request_id)
-            return resp
-
-        # 3) 生成実行（エラー時はキャッシュせず例外はそのまま伝播）
-        response = await run_generate_graph(req)
-        cache_set(key, response.model_dump())
-        return response
+    response, shared = await generate_flight.run(key, lambda: _generate_and_cache(req, key, key_pre))
+    if shared:
+        flight_stats = generate_flight.stats()
+        logger.info(
+            "cache_coalesced generate key=%s req=%s in_flight=%d coalesced_total=%d",
+            key_pre,
+            req.request_id,
+            flight_stats["in_flight"],
+            flight_stats["coalesced"],
+        )
+    if response.request_id != req.request_id:
+        response = response.model_copy(update={"request_id": req.request_id})
+    return response
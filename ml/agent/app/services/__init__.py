@@ -1,2 +1,2 @@
-from . import bq_writer, fallback, feature_calc, ranker_client, maps_routes_client, places_client, vertex_llm, ttl_cache  # noqa: F401
+from . import bq_writer, fallback, feature_calc, ranker_client, maps_routes_client, places_client, vertex_llm, ttl_cache, places_cache, candidate_pool, ranker_embedded  # noqa: F401
 
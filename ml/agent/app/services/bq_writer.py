@@ -1,9 +1,16 @@
 from __future__ import annotations
-from typing import Any, Dict, Iterable, Optional
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
 from google.cloud import bigquery
 
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
 
 _client: Optional[bigquery.Client] = None  # BigQueryクライアントのシングルトン
 
@@ -11,7 +18,7 @@ _client: Optional[bigquery.Client] = None  # BigQueryクライアントのシン
 def _bq() -> bigquery.Client:
     """
     BigQueryクライアントを取得（シングルトンパターン）
-    
+
     Returns:
         BigQueryクライアントインスタンス
     """
@@ -21,12 +28,190 @@ def _bq() -> bigquery.Client:
     return _client
 
 
+def _insert_rows_sync(table: str, rows: List[Dict[str, Any]], row_ids: Optional[List[str]] = None) -> int:
+    """
+    insert_rows_json を同期的に呼び出し、エラーになった行数を返す（例外はそのまま送出）。
+
+    row_ids を渡すと、再試行時に BigQuery 側のベストエフォート重複排除が効く。
+    """
+    # テーブルIDを構築: project.dataset.table
+    table_id = f"{_bq().project}.{settings.BQ_DATASET}.{table}"
+    if row_ids is None:
+        errors = _bq().insert_rows_json(table_id, rows)
+    else:
+        errors = _bq().insert_rows_json(table_id, rows, row_ids=row_ids)
+    return len(errors or [])
+
+
+class BatchWriter:
+    """
+    テーブルごとの上限付きキューに行を溜め、バックグラウンドでバッチ書き込みする。
+
+    - BQ_BATCH_SIZE 行溜まるか BQ_FLUSH_INTERVAL_SEC 経過でフラッシュ
+    - insert_rows_json はスレッドで実行（イベントループをブロックしない）
+    - 例外時は BQ_RETRY_MAX 回まで指数バックオフで再試行
+    - キューが満杯のときは行を破棄して dropped をカウント
+    """
+
+    def __init__(self) -> None:
+        self._queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stats: Dict[str, int] = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "failed_rows": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed_batches": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """フラッシュループを起動する（lifespan の起動時に呼ぶ）。"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout_sec: Optional[float] = None) -> None:
+        """フラッシュループに停止を伝え、キューに残った行を書き切ってから戻る（lifespan の終了時に呼ぶ）。"""
+        if self._task is None:
+            return
+        timeout_sec = float(settings.BQ_SHUTDOWN_FLUSH_TIMEOUT_SEC) if timeout_sec is None else timeout_sec
+        self._stopping = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout_sec if timeout_sec > 0 else None)
+        except asyncio.TimeoutError:
+            logger.warning("bq_writer shutdown flush timeout pending=%d", self.pending())
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def enqueue(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        maxsize = max(1, int(settings.BQ_QUEUE_MAXSIZE))
+        batch_size = max(1, int(settings.BQ_BATCH_SIZE))
+        with self._lock:
+            queue = self._queues.setdefault(table, deque())
+            accepted = max(0, min(len(rows), maxsize - len(queue)))
+            queue.extend(rows[:accepted])
+            depth = len(queue)
+            self._stats["enqueued"] += accepted
+            self._stats["dropped"] += len(rows) - accepted
+        if accepted < len(rows):
+            logger.warning(
+                "bq_writer queue full table=%s dropped=%d dropped_total=%d",
+                table,
+                len(rows) - accepted,
+                self._stats["dropped"],
+            )
+        if depth >= batch_size and self._loop is not None and self._wake is not None:
+            # 同期ハンドラ（スレッドプール）から呼ばれても安全に起こす
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depths = {table: len(q) for table, q in self._queues.items()}
+        return {**self._stats, "queue_depth": depths}
+
+    def _take(self, table: str, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            queue = self._queues.get(table)
+            if not queue:
+                return []
+            return [queue.popleft() for _ in range(min(limit, len(queue)))]
+
+    async def _write_batch(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        row_ids = [str(uuid.uuid4()) for _ in rows]
+        retry_max = max(0, int(settings.BQ_RETRY_MAX))
+        backoff_sec = float(settings.BQ_RETRY_BACKOFF_SEC)
+        t0 = time.perf_counter()
+        for attempt in range(retry_max + 1):
+            try:
+                failed = await asyncio.to_thread(_insert_rows_sync, table, rows, row_ids)
+            except Exception as e:
+                if attempt < retry_max:
+                    self._stats["retries"] += 1
+                    await asyncio.sleep(backoff_sec * (2 ** attempt))
+                    continue
+                self._stats["failed_batches"] += 1
+                self._stats["failed_rows"] += len(rows)
+                logger.warning(
+                    "bq_writer batch failed table=%s rows=%d attempts=%d err=%r",
+                    table,
+                    len(rows),
+                    attempt + 1,
+                    e,
+                )
+                return
+            self._stats["batches"] += 1
+            self._stats["written"] += len(rows) - failed
+            self._stats["failed_rows"] += failed
+            logger.debug(
+                "bq_writer batch table=%s rows=%d row_errors=%d elapsed_ms=%d",
+                table,
+                len(rows),
+                failed,
+                int((time.perf_counter() - t0) * 1000),
+            )
+            if failed:
+                # 行単位のエラー（スキーマ不一致など）は再試行しても直らないためログのみ
+                logger.warning("bq_writer row errors table=%s failed=%d", table, failed)
+            return
+
+    async def flush_all(self) -> None:
+        """全テーブルのキューを空になるまで書き込む。"""
+        batch_size = max(1, int(settings.BQ_BATCH_SIZE))
+        with self._lock:
+            tables = list(self._queues)
+        for table in tables:
+            while True:
+                rows = self._take(table, batch_size)
+                if not rows:
+                    break
+                await self._write_batch(table, rows)
+
+    async def _run(self) -> None:
+        interval_sec = max(0.01, float(settings.BQ_FLUSH_INTERVAL_SEC))
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush_all()
+            except Exception as e:
+                logger.warning("bq_writer flush error err=%r", e)
+            if self._stopping:
+                return
+
+
+# プロセス共通のバックグラウンドライター（lifespan で start / stop）
+writer = BatchWriter()
+
+
 def insert_rows(table: str, rows: Iterable[Dict[str, Any]]) -> None:
     """
     BigQueryにデータを挿入する（ベストエフォート方式）
-    
-    失敗してもユーザーフローを中断しない。MVPではエラーを無視する。
-    
+
+    失敗してもユーザーフローを中断しない。バックグラウンドライターが起動していればキューに積んで即座に戻り、
+    起動していなければ（スクリプト実行など）従来どおり同期的に書き込む。
+
     Args:
         table: テーブル名（データセット名は除く、例: "route_request"）
         rows: 挿入する行のイテレータ（辞書のリスト）
@@ -34,10 +219,24 @@ def insert_rows(table: str, rows: Iterable[Dict[str, Any]]) -> None:
     rows = list(rows)
     if not rows:
         return
-    # テーブルIDを構築: project.dataset.table
-    table_id = f"{_bq().project}.{settings.BQ_DATASET}.{table}"
-    errors = _bq().insert_rows_json(table_id, rows)
-    # ベストエフォート: MVPではエラーを無視（必要に応じてログ出力可能）
-    if errors:
-        # ここで構造化ログを出力可能
-        pass
+    if settings.BQ_WRITER_ENABLED and writer.running:
+        writer.enqueue(table, rows)
+        return
+    # ベストエフォート: 行単位のエラーは無視
+    _insert_rows_sync(table, rows)
+
+
+async def insert_rows_async(table: str, rows: Iterable[Dict[str, Any]]) -> None:
+    """
+    insert_rows の非同期版（async ハンドラ・グラフのノードから呼ぶ）
+
+    バックグラウンドライターが起動していればキューに積むだけ。起動していない場合の同期書き込みは
+    asyncio.to_thread で実行し、イベントループ（他のリクエスト）をブロックしない。
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    if settings.BQ_WRITER_ENABLED and writer.running:
+        writer.enqueue(table, rows)
+        return
+    await asyncio.to_thread(_insert_rows_sync, table, rows)
@@ -0,0 +1,135 @@
+"""
+人気の出発地点タイルごとのルート候補プール（プロセス内）。
+バックグラウンドのウォーマーが (出発タイル, テーマ, 距離バケット) ごとに候補生成 + 特徴量計算を事前に行い、
+generate_candidates_routes はヒット時にプールから候補を返す（ミス時のみ Routes API を呼ぶ）。
+対象は周回ルート（round_trip=true）のみ。
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from app.services.places_cache import snap_to_tile
+from app.services.polyline import haversine_m
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# key -> {"stored_at": float, "origin": (lat, lng) | None, "candidates": [...]}
+_pool: Dict[tuple, Dict[str, Any]] = {}
+# ヒット/ミス等のカウンタ
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "far_origin": 0}
+
+
+def _split_csv(value: str) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def _distance_bucket(distance_km: float) -> float:
+    return round(float(distance_km), 1)
+
+
+def parse_origins(value: str) -> List[tuple[float, float]]:
+    """"lat,lng;lat,lng" 形式の出発地点リストを解析する（不正な要素はスキップ）。"""
+    origins: List[tuple[float, float]] = []
+    for item in (value or "").split(";"):
+        parts = _split_csv(item)
+        if len(parts) != 2:
+            continue
+        try:
+            origins.append((float(parts[0]), float(parts[1])))
+        except ValueError:
+            logger.warning("candidate pool origin ignored value=%s", item)
+    return origins
+
+
+def warm_targets() -> List[Dict[str, Any]]:
+    """設定から (出発地点, テーマ, 距離) の組み合わせを列挙する。"""
+    targets: List[Dict[str, Any]] = []
+    distances: List[float] = []
+    for d in _split_csv(settings.CANDIDATE_POOL_DISTANCES_KM):
+        try:
+            distances.append(float(d))
+        except ValueError:
+            logger.warning("candidate pool distance ignored value=%s", d)
+    for lat, lng in parse_origins(settings.CANDIDATE_POOL_ORIGINS):
+        for theme in _split_csv(settings.CANDIDATE_POOL_THEMES):
+            for distance_km in distances:
+                targets.append({"lat": lat, "lng": lng, "theme": theme, "distance_km": distance_km})
+    return targets
+
+
+def build_key(*, lat: float, lng: float, theme: str, distance_km: float) -> tuple:
+    tile_m = float(settings.CANDIDATE_POOL_TILE_M)
+    lat_idx, lng_idx = snap_to_tile(lat, lng, tile_m)
+    return (int(tile_m), lat_idx, lng_idx, theme, _distance_bucket(distance_km))
+
+
+def _pick_seed(*, lat: float, lng: float, theme: str, distance_km: float) -> int:
+    """同じ入力条件なら同じ値になる選択用のシード（キャッシュキーと同じく lat/lng は丸める）。"""
+    decimals = int(settings.GENERATE_CACHE_ROUND_LATLNG_DECIMALS)
+    payload = f"{round(float(lat), decimals)}:{round(float(lng), decimals)}:{theme}:{_distance_bucket(distance_km)}"
+    return int.from_bytes(hashlib.sha256(payload.encode("utf-8")).digest()[:8], "big")
+
+
+def lookup(*, lat: float, lng: float, theme: str, distance_km: float, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    プール済みの候補を返す。ヒットしなければ None。
+
+    同じタイルの出発地点でも毎回同じルートにならないよう、入力条件から決めたシードで最大 limit 本を選ぶ
+    （同じ入力なら同じ候補・同じ順序になる。順序はプール内の順）。
+    プールの出発地点から CANDIDATE_POOL_MAX_ORIGIN_M より離れたリクエストはミス扱いにする。
+    """
+    if not settings.CANDIDATE_POOL_ENABLED:
+        return None
+    key = build_key(lat=lat, lng=lng, theme=theme, distance_km=distance_km)
+    entry = _pool.get(key)
+    if entry is not None and (time.time() - entry["stored_at"]) > float(settings.CANDIDATE_POOL_TTL_SEC):
+        _pool.pop(key, None)
+        _stats["expired"] += 1
+        entry = None
+    if entry is None or not entry["candidates"]:
+        _stats["misses"] += 1
+        return None
+    origin = entry.get("origin")
+    if origin is not None and haversine_m(origin, (float(lat), float(lng))) > float(settings.CANDIDATE_POOL_MAX_ORIGIN_M):
+        _stats["far_origin"] += 1
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    pooled = entry["candidates"]
+    rng = random.Random(_pick_seed(lat=lat, lng=lng, theme=theme, distance_km=distance_km))
+    picked = sorted(rng.sample(range(len(pooled)), min(max(1, int(limit)), len(pooled))))
+    return [dict(pooled[i]) for i in picked]
+
+
+def store(key: tuple, candidates: List[Dict[str, Any]], origin: Optional[tuple[float, float]] = None) -> None:
+    """候補プールを置き換える（origin は候補を生成した出発地点）。空の場合は既存のプールを残す。"""
+    if not candidates:
+        return
+    _pool[key] = {
+        "stored_at": time.time(),
+        "origin": (float(origin[0]), float(origin[1])) if origin is not None else None,
+        "candidates": [dict(c) for c in candidates],
+    }
+    _stats["stores"] += 1
+
+
+def get_stats() -> Dict[str, Any]:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_ratio": (_stats["hits"] / lookups) if lookups else 0.0,
+        "pools": len(_pool),
+        "candidates": sum(len(e["candidates"]) for e in _pool.values()),
+    }
+
+
+def clear() -> None:
+    """プールとカウンタを初期化する（テスト・設定変更用）。"""
+    _pool.clear()
+    for k in _stats:
+        _stats[k] = 0
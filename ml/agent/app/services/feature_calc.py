@@ -1,6 +1,23 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import math
+
+import numpy as np
+
+from app.services.polyline import decode_polyline_array, to_local_xy
+
+# 曲がり角とみなす進行方向の変化（度）
+TURN_ANGLE_DEG = 45.0
+# これ未満の進行方向の変化は「直進」とみなす（度、straightness 用）
+STRAIGHT_ANGLE_DEG = 15.0
+# これより短い線分は進行方向が不安定なため、曲がり角・直進の判定に使わない（m）
+TURN_MIN_SEGMENT_M = 5.0
+# 重複区間の判定: 経路をこの間隔で再サンプリングし、このサイズの格子で同じマスへの再訪を調べる（m）
+OVERLAP_SAMPLE_M = 10.0
+OVERLAP_CELL_M = 20.0
+# 同じマスでも、最初と最後に通った経路上の距離の差がこれ以下なら2回目の通過とみなさない（m、マスの境界沿いの往復を除く）
+OVERLAP_GAP_M = 60.0
 
 
 @dataclass
@@ -15,11 +32,111 @@ class Candidate:
     bbox_area: float  # バウンディングボックスの面積
     path_length_ratio: float  # パス長比率（実際の距離/直線距離）
     turn_count: int  # 曲がり角の数
+    self_overlap_ratio: float = 0.0  # 同じ道を2回以上通る区間の割合（0〜1、行きと帰りの両方を数える）
+    straightness: float = 1.0  # 直進区間の長さの割合（0〜1）
     # 運動関連の特徴量
     has_stairs: bool = False  # 階段を含むかどうか
     elevation_gain_m: float = 0.0  # 累積標高差（m、上り方向のみ）
 
 
+@dataclass(frozen=True)
+class RouteGeometry:
+    """polyline の形状から求めた特徴量"""
+    loop_closure_m: float  # 始点と終点の距離（m）
+    bbox_area: float  # バウンディングボックスの面積（km²）
+    path_length_ratio: float  # 経路長 / 始点→最遠点→終点の直線距離
+    turn_count: int  # 進行方向が TURN_ANGLE_DEG 以上変わる箇所の数
+    self_overlap_ratio: float  # 同じ道を2回以上通る区間の割合（0〜1、行きと帰りの両方を数える）
+    straightness: float  # 直進区間の長さの割合（0〜1）
+
+
+# 形状が無い候補（polyline なし・1点のみ）の値
+EMPTY_GEOMETRY = RouteGeometry(
+    loop_closure_m=0.0,
+    bbox_area=0.0,
+    path_length_ratio=1.0,
+    turn_count=0,
+    self_overlap_ratio=0.0,
+    straightness=1.0,
+)
+
+
+def route_geometry(latlng: np.ndarray) -> RouteGeometry:
+    """
+    デコード済みの経路 (N, 2)（緯度, 経度）から形状の特徴量を計算する
+
+    経路を局所平面座標に1回だけ投影し、線分の長さ・進行方向から全特徴量を NumPy でまとめて求める
+    （数千点でも1ミリ秒前後）。
+    path_length_ratio の分母は始点→最遠点→終点の直線距離で、往復ルートでも 1.0 以上の有限値になる
+    （同じ道の往復なら 1.0、円形の周回なら約 1.57）。
+    """
+    latlng = np.asarray(latlng, dtype=np.float64).reshape(-1, 2)
+    if latlng.shape[0] < 2:
+        return EMPTY_GEOMETRY
+    lat0 = float((latlng[:, 0].min() + latlng[:, 0].max()) / 2.0)
+    xy = to_local_xy(latlng, lat0)
+    seg = np.diff(xy, axis=0)
+    seg_len = np.hypot(seg[:, 0], seg[:, 1])
+    path_len = float(seg_len.sum())
+
+    extent = xy.max(axis=0) - xy.min(axis=0)
+    from_start = np.hypot(xy[:, 0] - xy[0, 0], xy[:, 1] - xy[0, 1])
+    far = int(np.argmax(from_start))
+    loop_closure_m = float(from_start[-1])
+    reference_m = float(from_start[far] + math.hypot(*(xy[-1] - xy[far])))
+
+    # 進行方向の変化（短い線分は除外し、-π〜π に正規化）
+    kept = seg_len >= TURN_MIN_SEGMENT_M
+    kept_len = seg_len[kept]
+    heading = np.arctan2(seg[kept, 1], seg[kept, 0])
+    turn = np.abs((np.diff(heading) + math.pi) % (2.0 * math.pi) - math.pi)
+    turn_count = int(np.count_nonzero(turn >= math.radians(TURN_ANGLE_DEG)))
+    if kept_len.size:
+        straight_m = float(kept_len[0] + kept_len[1:][turn < math.radians(STRAIGHT_ANGLE_DEG)].sum())
+        straightness = straight_m / float(kept_len.sum())
+    else:
+        straightness = 1.0
+
+    return RouteGeometry(
+        loop_closure_m=loop_closure_m,
+        bbox_area=float(extent[0] * extent[1]) / 1e6,
+        path_length_ratio=path_len / reference_m if reference_m > 1.0 else 1.0,
+        turn_count=turn_count,
+        self_overlap_ratio=_self_overlap_ratio(xy[np.concatenate(([True], seg_len > 0))], seg_len[seg_len > 0]),
+        straightness=straightness,
+    )
+
+
+def _self_overlap_ratio(xy: np.ndarray, seg_len: np.ndarray) -> float:
+    """
+    経路を OVERLAP_SAMPLE_M 間隔で再サンプリングし、OVERLAP_CELL_M の格子で2回以上通ったマスにある点の割合を返す
+
+    行きと帰りの両方を数える（同じ道の往復なら約1、重ならない周回なら約0）。
+    同じマスでも、最初と最後に通った経路上の距離の差が OVERLAP_GAP_M 以下なら1回の通過とみなす。
+    xy は同じ点の連続を除いた投影済み座標、seg_len はその線分長（すべて正）。
+    """
+    if seg_len.size == 0:
+        return 0.0
+    cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+    s = np.linspace(0.0, cum[-1], max(2, int(cum[-1] / OVERLAP_SAMPLE_M) + 1))
+    cx = np.floor((np.interp(s, cum, xy[:, 0]) - xy[:, 0].min()) / OVERLAP_CELL_M).astype(np.int64)
+    cy = np.floor((np.interp(s, cum, xy[:, 1]) - xy[:, 1].min()) / OVERLAP_CELL_M).astype(np.int64)
+    _, first, inverse = np.unique(cx * (int(cy.max()) + 1) + cy, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # s は昇順なので、マスごとの最後の通過は最大値で求まる
+    last = np.zeros(first.size, dtype=np.float64)
+    np.maximum.at(last, inverse, s)
+    shared = (last - s[first])[inverse] > OVERLAP_GAP_M
+    return float(np.count_nonzero(shared)) / float(s.size)
+
+
+def candidate_geometry(encoded: Optional[str]) -> RouteGeometry:
+    """エンコード済み polyline から RouteGeometry を求める（空・ダミーの polyline は EMPTY_GEOMETRY）"""
+    if not encoded or encoded.strip() in ("", "xxxx"):
+        return EMPTY_GEOMETRY
+    return route_geometry(decode_polyline_array(encoded))
+
+
 def calc_features(
     *,
     candidate: Candidate,
@@ -76,6 +193,8 @@ def calc_features(
         "path_length_ratio": float(candidate.path_length_ratio),  # パス長比率
         "turn_count": int(candidate.turn_count),  # 曲がり角の数
         "turn_density": float(turn_density),  # 曲がり角密度（回/km）
+        "self_overlap_ratio": float(candidate.self_overlap_ratio),  # 重複区間の割合
+        "straightness": float(candidate.straightness),  # 直進区間の割合
 
         # テーマ特徴量（ワンホットエンコーディング）
         "theme_exercise": theme_exercise,  # 運動テーマ
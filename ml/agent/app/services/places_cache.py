@@ -0,0 +1,145 @@
+"""
+Places API 検索結果のプロセス内キャッシュ（リクエスト横断）。
+検索中心をグリッドタイルにスナップし、(タイル, 半径バケット, タイプ, キーワード) 単位で
+フィルタ済みのスポット一覧を保持する。TTL + LRU で追い出し、サイズはバイト数で上限管理する。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_METERS_PER_DEG_LAT = 111320.0
+
+# キャッシュ本体（遅延初期化）
+_places_cache: Optional[TTLCache[tuple, List[Dict[str, Any]]]] = None
+# ヒット/ミス等のカウンタ
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "skipped_empty": 0}
+
+
+def _entry_size(value: List[Dict[str, Any]]) -> int:
+    """メモリ予算計算用のエントリサイズ（JSONバイト数で近似）。"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False).encode("utf-8")) + 64
+    except Exception:
+        return 1024
+
+
+def _get_cache() -> TTLCache[tuple, List[Dict[str, Any]]]:
+    global _places_cache
+    if _places_cache is None:
+        _places_cache = TTLCache(
+            maxsize=max(1, int(settings.PLACES_CACHE_MAX_BYTES)),
+            ttl=float(settings.PLACES_CACHE_TTL_SEC),
+            getsizeof=_entry_size,
+        )
+    return _places_cache
+
+
+def snap_to_tile(lat: float, lng: float, tile_m: float) -> tuple[int, int]:
+    """
+    緯度経度をタイル番号にスナップする。
+
+    緯度方向は一定幅、経度方向はタイル行の中心緯度で幅を補正する（高緯度でもタイルがほぼ正方形になる）。
+    """
+    tile_m = max(1.0, float(tile_m))
+    dlat = tile_m / _METERS_PER_DEG_LAT
+    lat_idx = math.floor(lat / dlat)
+    row_center_lat = (lat_idx + 0.5) * dlat
+    cos_lat = max(math.cos(math.radians(row_center_lat)), 1e-6)
+    dlng = tile_m / (_METERS_PER_DEG_LAT * cos_lat)
+    lng_idx = math.floor(lng / dlng)
+    return lat_idx, lng_idx
+
+
+def _radius_bucket(radius_m: int) -> int:
+    bucket = max(1, int(settings.PLACES_CACHE_RADIUS_BUCKET_M))
+    return int(math.ceil(max(0, int(radius_m)) / bucket)) * bucket
+
+
+def build_key(
+    *,
+    lat: float,
+    lng: float,
+    theme: Optional[str],
+    radius_m: int,
+    max_results: int,
+    included_types: Optional[List[str]],
+    keyword: Optional[str],
+    allow_unfiltered_fallback: bool,
+) -> tuple:
+    """search_spots の引数からキャッシュキーを生成する。"""
+    tile_m = float(settings.PLACES_CACHE_TILE_M)
+    lat_idx, lng_idx = snap_to_tile(lat, lng, tile_m)
+    return (
+        int(tile_m),
+        lat_idx,
+        lng_idx,
+        _radius_bucket(radius_m),
+        int(max_results),
+        # included_types 未指定時はテーマからタイプが決まるため theme をキーに含める
+        tuple(sorted(included_types)) if included_types else ("theme", theme or ""),
+        keyword or None,
+        bool(allow_unfiltered_fallback),
+    )
+
+
+def cache_get(key: tuple) -> Optional[List[Dict[str, Any]]]:
+    """キャッシュ済みのスポット一覧を返す。ヒットしなければ None。"""
+    if not settings.PLACES_CACHE_ENABLED:
+        return None
+    try:
+        value = _get_cache().get(key)
+    except Exception as e:
+        logger.warning("places cache get error err=%s", e)
+        return None
+    if value is None:
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    return [dict(p) for p in value]
+
+
+def cache_set(key: tuple, places: List[Dict[str, Any]]) -> None:
+    """スポット一覧を保存する。空結果は API エラーと区別できないため保存しない。best-effort。"""
+    if not settings.PLACES_CACHE_ENABLED:
+        return
+    if not places:
+        _stats["skipped_empty"] += 1
+        return
+    try:
+        _get_cache()[key] = [dict(p) for p in places]
+        _stats["stores"] += 1
+    except ValueError:
+        # 1件で予算を超える場合（cachetools は ValueError を送出）
+        logger.debug("places cache entry too large, skipped")
+    except Exception as e:
+        logger.warning("places cache set error err=%s", e)
+
+
+def get_stats() -> Dict[str, Any]:
+    """ヒット/ミス数と現在のサイズを返す。"""
+    cache = _places_cache
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_ratio": (_stats["hits"] / lookups) if lookups else 0.0,
+        "entries": len(cache) if cache is not None else 0,
+        "bytes": int(cache.currsize) if cache is not None else 0,
+        "max_bytes": int(settings.PLACES_CACHE_MAX_BYTES),
+    }
+
+
+def clear() -> None:
+    """キャッシュとカウンタを初期化する（テスト・設定変更用）。"""
+    global _places_cache
+    _places_cache = None
+    for k in _stats:
+        _stats[k] = 0
@@ -7,6 +7,7 @@ import random
 import httpx
 
 from app.settings import settings
+from app.services import places_cache
 from app.services.http_client import get_client
 
 logger = logging.getLogger(__name__)
@@ -135,6 +136,58 @@ async def search_spots(
     """
     Fetch nearby places filtered by theme. Returns a small list of {name, type, place_id}.
     Optionally applies included types and a keyword for discovery-focused search.
+
+    検索中心をタイルにスナップしたプロセス内キャッシュ（places_cache）を先に参照し、
+    ミス時のみ Places API を呼び出す。引数は _search_spots_uncached を参照。
+    """
+    cache_key = places_cache.build_key(
+        lat=lat,
+        lng=lng,
+        theme=theme,
+        radius_m=radius_m,
+        max_results=max_results,
+        included_types=included_types,
+        keyword=keyword,
+        allow_unfiltered_fallback=allow_unfiltered_fallback,
+    )
+    cached = places_cache.cache_get(cache_key)
+    if cached is not None:
+        logger.debug(
+            "[Places Cache] hit lat=%.6f lng=%.6f theme=%s keyword=%s places=%d",
+            lat,
+            lng,
+            theme,
+            keyword,
+            len(cached),
+        )
+        return cached
+    out = await _search_spots_uncached(
+        lat=lat,
+        lng=lng,
+        theme=theme,
+        radius_m=radius_m,
+        max_results=max_results,
+        included_types=included_types,
+        keyword=keyword,
+        allow_unfiltered_fallback=allow_unfiltered_fallback,
+    )
+    places_cache.cache_set(cache_key, out)
+    return out
+
+
+async def _search_spots_uncached(
+    *,
+    lat: float,
+    lng: float,
+    theme: Optional[str] = None,
+    radius_m: int = 1500,
+    max_results: int = 5,
+    included_types: Optional[List[str]] = None,
+    keyword: Optional[str] = None,
+    allow_unfiltered_fallback: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Places API を直接呼び出してスポットを検索する（キャッシュなし）。
     
     Args:
         lat: 緯度
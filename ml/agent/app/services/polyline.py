@@ -1,14 +1,36 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
 import math
 
+import numpy as np
+
+_EARTH_RADIUS_M = 6371000.0
+# 点×線分の距離行列を一度に作る要素数の上限（メモリ使用量を抑える）
+_MAX_PAIRWISE_ELEMENTS = 1_000_000
+# Douglas–Peucker でこの点数以下の区間は NumPy を使わずに計算する
+_DP_SCALAR_SPAN = 32
+# この点数以上の経路は線分インデックス（SegmentIndex）で距離計算の対象線分を絞る
+SEGMENT_INDEX_MIN_POINTS = 200
+# 点数×線分数がこれ未満の問い合わせは、インデックスを作るより総当たりの方が速い（作成済みなら使う）
+SEGMENT_INDEX_MIN_PAIRS = 10000
+# SegmentIndex の1バケットにまとめる連続線分の本数
+SEGMENT_INDEX_CHUNK = 16
+# decode_cache_scope の既定の保持件数（1リクエストの候補数より十分大きく）
+DECODE_CACHE_SIZE = 32
+# これより長い可変長整数は int64 に収まらないため Python の整数で読む（正常な polyline は最大7文字）
+_MAX_VARINT_CHARS = 12
+
 
 def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
     """
     Google Mapsのエンコードされたpolylineを緯度経度のリストにデコードする
     
     Google Mapsで使用される標準のEncoded Polyline Algorithm Formatを実装。
+    decode_polyline_array の結果をタプルのリストにした互換ラッパー。
     
     Args:
         encoded: エンコードされたpolyline文字列
@@ -16,23 +38,104 @@ def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
     Returns:
         (緯度, 経度)のタプルのリスト
     """
-    if not encoded:
+    return to_point_list(decode_polyline_array(encoded))
+
+
+def to_point_list(latlng: np.ndarray) -> List[Tuple[float, float]]:
+    """(N, 2) の配列を (緯度, 経度) タプルのリストにする（ndarray.tolist の入れ子リストより GC の負荷が小さい）"""
+    if latlng.shape[0] == 0:
         return []
+    return list(zip(latlng[:, 0].tolist(), latlng[:, 1].tolist()))
 
-    index = 0  # 文字列のインデックス
-    lat = 0  # 緯度の累積値
-    lng = 0  # 経度の累積値
-    coordinates: List[Tuple[float, float]] = []  # 結果を格納するリスト
 
-    length = len(encoded)
+def decode_polyline_array(encoded: str) -> np.ndarray:
+    """
+    エンコードされたpolylineを (N, 2) の float64 配列（緯度, 経度）にデコードする
+
+    可変長整数の読み取りも含めて NumPy でまとめて行う（_decode_deltas_vectorized）。
+    decode_cache_scope の中では同じ文字列のデコード結果を使い回す（返す配列は読み取り専用）。
+    途中で切れた文字列は、そこまでに読めた点だけを返す（decode_polyline と同じ）。
+    """
+    if not encoded:
+        return np.zeros((0, 2), dtype=np.float64)
+    cache = _decode_cache.get()
+    if cache is not None:
+        hit = cache.get(encoded)
+        if hit is not None:
+            cache.move_to_end(encoded)
+            return hit
+    deltas = _decode_deltas_vectorized(encoded)
+    points = _deltas_to_points(_decode_deltas_scalar(encoded) if deltas is None else deltas)
+    if cache is not None:
+        points.flags.writeable = False
+        cache[encoded] = points
+        if len(cache) > _decode_cache_size.get():
+            cache.popitem(last=False)
+    return points
+
+
+_decode_cache: ContextVar[Optional["OrderedDict[str, np.ndarray]"]] = ContextVar("polyline_decode_cache", default=None)
+_decode_cache_size: ContextVar[int] = ContextVar("polyline_decode_cache_size", default=DECODE_CACHE_SIZE)
+
+
+@contextmanager
+def decode_cache_scope(maxsize: int = DECODE_CACHE_SIZE) -> Iterator[None]:
+    """
+    この中（と、ここから作られたタスク）での decode_polyline / decode_polyline_array の結果を LRU で使い回す
+
+    1リクエスト分のグラフ実行を囲む想定。候補生成・特徴量計算・代表点抽出で同じ polyline を何度デコードしても
+    実際のデコードは1回になる。スコープを抜けるとキャッシュは捨てられる。
+    """
+    token = _decode_cache.set(OrderedDict())
+    size_token = _decode_cache_size.set(max(1, int(maxsize)))
+    try:
+        yield
+    finally:
+        _decode_cache_size.reset(size_token)
+        _decode_cache.reset(token)
+
+
+def _decode_deltas_vectorized(encoded: str) -> Optional[np.ndarray]:
+    """
+    文字列全体の可変長整数（5ビット単位・zigzag符号）を NumPy でまとめて差分列に戻す
+
+    1. 各文字から63を引き、0x20未満の文字を値の終端とする
+    2. 値ごとに文字の位置（0, 1, 2, ...）を求め、下位5ビットを 5*位置 だけシフトして値ごとに足す（ビットは重ならない）
+    3. 最下位ビットで符号を戻す
+    ASCII 以外の文字や異常に長い値を含む場合は None（_decode_deltas_scalar で読む）。
+    """
+    try:
+        raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+    b = raw.astype(np.int64) - 63
+    ends = np.flatnonzero(b < 0x20)
+    if ends.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    # 最後の終端より後ろ（途中で切れた値）は読まない
+    b = b[: ends[-1] + 1]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    if int((ends - starts).max()) >= _MAX_VARINT_CHARS:
+        return None
+    value_id = np.repeat(np.arange(ends.size), ends - starts + 1)
+    pos = np.arange(b.size) - starts[value_id]
+    result = np.add.reduceat((b & 0x1F) << (5 * pos), starts)
+    return np.where(result & 1, ~(result >> 1), result >> 1)
+
 
+def _decode_deltas_scalar(encoded: str) -> List[int]:
+    """_decode_deltas_vectorized の1文字ずつ読む版（ASCII 以外を含む文字列など用）"""
+    index = 0  # 文字列のインデックス
+    deltas: List[int] = []  # 緯度・経度の差分を交互に格納
+    length = len(encoded)
     while index < length:
-        # 緯度をデコード
         shift = 0  # ビットシフト量
         result = 0  # デコード結果
         while True:
             if index >= length:
-                return coordinates
+                return deltas
             b = ord(encoded[index]) - 63  # ASCII文字を数値に変換（63を引く）
             index += 1
             result |= (b & 0x1F) << shift  # 下位5ビットを取得してシフト
@@ -40,27 +143,94 @@ def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
             if b < 0x20:  # 最上位ビットが0なら終了
                 break
         # 符号付き数値に変換（最下位ビットが1なら負数）
-        dlat = ~(result >> 1) if (result & 1) else (result >> 1)
-        lat += dlat  # 緯度の差分を累積
+        deltas.append(~(result >> 1) if (result & 1) else (result >> 1))
+    return deltas
+
+
+def _deltas_to_points(deltas: List[int] | np.ndarray) -> np.ndarray:
+    """緯度・経度が交互に並んだ差分列を累積して (N, 2) の緯度経度配列にする（端数の緯度だけの値は捨てる）。"""
+    n = len(deltas) // 2
+    if n == 0:
+        return np.zeros((0, 2), dtype=np.float64)
+    # 1e5で割って実際の緯度経度に変換（エンコード時は1e5倍している）
+    return np.cumsum(np.asarray(deltas[: 2 * n], dtype=np.int64).reshape(n, 2), axis=0) / 1e5
 
-        # 経度をデコード（緯度と同じアルゴリズム）
-        shift = 0
-        result = 0
-        while True:
-            if index >= length:
-                return coordinates
-            b = ord(encoded[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if (result & 1) else (result >> 1)
-        lng += dlng  # 経度の差分を累積
 
-        # 1e5で割って実際の緯度経度に変換（エンコード時は1e5倍している）
-        coordinates.append((lat / 1e5, lng / 1e5))
-    return coordinates
+def _e5(value: float) -> int:
+    """座標を 1e5 倍した整数にする（polyline ライブラリの encode と同じ四捨五入）"""
+    return int(math.copysign(math.floor(math.fabs(value * 1e5) + 0.5), value * 1e5))
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else (value << 1)
+    chars: List[str] = []
+    while value >= 0x20:
+        chars.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def extend_encoded(
+    encoded: str,
+    points: np.ndarray,
+    head: Optional[Tuple[float, float]] = None,
+    tail: Optional[Tuple[float, float]] = None,
+) -> str:
+    """
+    デコード済みの points（encoded をデコードしたもの）の先頭に head、末尾に tail を足した polyline を返す
+
+    polyline は差分で符号化されているため、全体を符号化し直さずに
+    先頭は「head の絶対値 + 元の先頭点への差分」に置き換え、末尾は差分を1つ足すだけで済む。
+    結果は polyline ライブラリで全点を encode した場合と同じ文字列になる。
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ends = _value_ends(encoded)
+    if ends is None or ends.size != 2 * points.shape[0] or (ends.size and ends[-1] != len(encoded) - 1):
+        # 途中で切れた文字列など、points と文字列が対応しない場合は全点を符号化し直す
+        all_points = ([head] if head is not None else []) + [tuple(p) for p in points.tolist()]
+        all_points += [tail] if tail is not None else []
+        return "".join(_encode_value(v) for d in _with_deltas(all_points) for v in d)
+    if points.shape[0] == 0:
+        extra = [p for p in (head, tail) if p is not None]
+        return "".join(_encode_value(v) for d in _with_deltas(extra) for v in d)
+    first = (_e5(points[0, 0]), _e5(points[0, 1]))
+    last = (_e5(points[-1, 0]), _e5(points[-1, 1]))
+    body = encoded
+    if head is not None:
+        h = (_e5(head[0]), _e5(head[1]))
+        body = (
+            _encode_value(h[0])
+            + _encode_value(h[1])
+            + _encode_value(first[0] - h[0])
+            + _encode_value(first[1] - h[1])
+            # 元の先頭点（緯度・経度の2値）の後ろはそのまま使える
+            + encoded[int(ends[1]) + 1 :]
+        )
+    if tail is not None:
+        t = (_e5(tail[0]), _e5(tail[1]))
+        body += _encode_value(t[0] - last[0]) + _encode_value(t[1] - last[1])
+    return body
+
+
+def _value_ends(encoded: str) -> Optional[np.ndarray]:
+    """各値の終端文字の位置（ASCII 以外を含む場合は None）"""
+    try:
+        raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+    return np.flatnonzero(raw.astype(np.int64) - 63 < 0x20)
+
+
+def _with_deltas(points: List[Tuple[float, float]]) -> List[Tuple[int, int]]:
+    """点列を 1e5 倍した整数の差分列にする（先頭は絶対値）"""
+    out: List[Tuple[int, int]] = []
+    prev = (0, 0)
+    for lat, lng in points:
+        cur = (_e5(lat), _e5(lng))
+        out.append((cur[0] - prev[0], cur[1] - prev[1]))
+        prev = cur
+    return out
 
 
 def sample_points(points: List[Tuple[float, float]], ratios: List[float]) -> List[Tuple[float, float]]:
@@ -111,7 +281,7 @@ def sample_points(points: List[Tuple[float, float]], ratios: List[float]) -> Lis
     return uniq
 
 
-def _haversine_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+def haversine_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     """
     2点間の距離をメートルで計算する（haversine）
     """
@@ -135,7 +305,7 @@ def _point_segment_distance_m(
     点pと線分abの最短距離（メートル、平面近似）
     """
     if a == b:
-        return _haversine_m(p, a)
+        return haversine_m(p, a)
 
     lat0 = math.radians((a[0] + b[0]) / 2.0)
     r = 6371000.0
@@ -159,20 +329,177 @@ def _point_segment_distance_m(
     return math.hypot(px - cx, py - cy)
 
 
+def to_local_xy(latlng: np.ndarray, lat0: float) -> np.ndarray:
+    """
+    緯度経度 (N, 2) を基準緯度 lat0 の正距円筒図法で局所平面座標 (N, 2)（x=東, y=北、メートル）に投影する
+
+    数km規模の経路なら、基準緯度を経路内に取れば距離の誤差は 0.1% 未満。
+    """
+    latlng = np.asarray(latlng, dtype=np.float64).reshape(-1, 2)
+    rad = np.radians(latlng)
+    xy = np.empty_like(rad)
+    xy[:, 0] = rad[:, 1] * (math.cos(math.radians(lat0)) * _EARTH_RADIUS_M)
+    xy[:, 1] = rad[:, 0] * _EARTH_RADIUS_M
+    return xy
+
+
+class PathGeometry:
+    """
+    折れ線を局所平面座標に1回だけ投影して保持し、点との距離計算をまとめて行う
+
+    基準緯度は経路の緯度の中央（最小と最大の平均）。距離計算の対象点も同じ基準で投影する。
+    """
+
+    def __init__(self, latlng: np.ndarray, lat0: Optional[float] = None) -> None:
+        self.latlng = np.asarray(latlng, dtype=np.float64).reshape(-1, 2)
+        if lat0 is None:
+            lat0 = float((self.latlng[:, 0].min() + self.latlng[:, 0].max()) / 2.0) if len(self.latlng) else 0.0
+        self.lat0 = lat0
+        self.xy = to_local_xy(self.latlng, lat0)
+        # 線分の始点と方向ベクトル（(S, 2)、S = N - 1）
+        self.seg_a = self.xy[:-1]
+        self.seg_ab = self.xy[1:] - self.xy[:-1]
+        self.seg_len2 = np.einsum("ij,ij->i", self.seg_ab, self.seg_ab)
+        self._segment_index: Optional[SegmentIndex] = None
+
+    @classmethod
+    def from_points(cls, points: List[Tuple[float, float]]) -> "PathGeometry":
+        return cls(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+
+    @classmethod
+    def from_encoded(cls, encoded: str) -> "PathGeometry":
+        return cls(decode_polyline_array(encoded))
+
+    def __len__(self) -> int:
+        return int(self.latlng.shape[0])
+
+    def distances_to(self, points: np.ndarray) -> np.ndarray:
+        """
+        各点 (M, 2)（緯度, 経度）から折れ線までの最短距離（メートル、(M,)）を返す
+
+        点×線分の行列をブロードキャストで作り、線分ごとに射影パラメータ t を [0, 1] にクランプして最短点を求める。
+        SEGMENT_INDEX_MIN_POINTS 点以上の経路は SegmentIndex で近くの線分だけを調べる（結果は同じ）。
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        m = pts.shape[0]
+        if m == 0:
+            return np.zeros(0, dtype=np.float64)
+        if len(self) == 0:
+            return np.full(m, np.inf)
+        if len(self) == 1:
+            return haversine_m_array(pts, self.latlng[0])
+
+        pxy = to_local_xy(pts, self.lat0)
+        n_seg = self.seg_a.shape[0]
+        if len(self) >= SEGMENT_INDEX_MIN_POINTS and (
+            self._segment_index is not None or m * n_seg >= SEGMENT_INDEX_MIN_PAIRS
+        ):
+            return np.sqrt(self.segment_index().nearest_dist2(pxy))
+        out = np.empty(m, dtype=np.float64)
+        step = max(1, _MAX_PAIRWISE_ELEMENTS // n_seg)
+        for lo in range(0, m, step):
+            ap = pxy[lo : lo + step, None, :] - self.seg_a[None, :, :]  # (m', S, 2)
+            out[lo : lo + step] = np.sqrt(_segment_dist2(ap, self.seg_ab, self.seg_len2).min(axis=1))
+        return out
+
+    def segment_index(self) -> "SegmentIndex":
+        """線分インデックス（初回呼び出し時に1回だけ作る）"""
+        if self._segment_index is None:
+            self._segment_index = SegmentIndex(self.seg_a, self.seg_ab, self.seg_len2)
+        return self._segment_index
+
+
+class SegmentIndex:
+    """
+    連続する線分を SEGMENT_INDEX_CHUNK 本ずつのバケットにまとめ、バケットの外接矩形で距離計算の対象を絞る
+
+    経路の連続する線分は空間的にもまとまっているため、1段の STR-tree と同じように矩形が小さく重なりも少ない。
+    各点について「矩形までの距離（下界）」が最小のバケットで上界を求め、下界が上界より小さいバケットだけ線分を調べる。
+    結果は全線分を総当たりした場合と一致する。
+    """
+
+    def __init__(self, seg_a: np.ndarray, seg_ab: np.ndarray, seg_len2: np.ndarray, chunk: int = SEGMENT_INDEX_CHUNK) -> None:
+        n_seg = seg_a.shape[0]
+        n_chunk = -(-n_seg // chunk)
+        # 端数は最後の線分を重複させて埋める（最小値は変わらない）
+        idx = np.minimum(np.arange(n_chunk * chunk), n_seg - 1)
+        self.a = seg_a[idx].reshape(n_chunk, chunk, 2)
+        self.ab = seg_ab[idx].reshape(n_chunk, chunk, 2)
+        self.len2 = seg_len2[idx].reshape(n_chunk, chunk)
+        ends = self.a + self.ab
+        self.lo = np.minimum(self.a, ends).min(axis=1)  # (C, 2)
+        self.hi = np.maximum(self.a, ends).max(axis=1)  # (C, 2)
+
+    def __len__(self) -> int:
+        return int(self.a.shape[0])
+
+    def nearest_dist2(self, pxy: np.ndarray) -> np.ndarray:
+        """局所平面座標の各点 (M, 2) から最も近い線分までの距離の2乗（(M,)）"""
+        # 点と各バケットの外接矩形の距離（下界、(M, C)）
+        gap = np.maximum(self.lo[None, :, :] - pxy[:, None, :], 0.0) + np.maximum(pxy[:, None, :] - self.hi[None, :, :], 0.0)
+        lb2 = np.einsum("mck,mck->mc", gap, gap)
+        # 下界が最小のバケットの実距離を上界にする
+        best = np.argmin(lb2, axis=1)
+        out = _segment_dist2(pxy[:, None, :] - self.a[best], self.ab[best], self.len2[best]).min(axis=1)
+        # 下界が上界より小さいバケットだけ調べる（等しいバケットでは上界より近くならない）
+        pi, ci = np.nonzero(lb2 < out[:, None])
+        chunk = self.a.shape[1]
+        step = max(1, _MAX_PAIRWISE_ELEMENTS // chunk)
+        for lo in range(0, pi.shape[0], step):
+            p_idx, c_idx = pi[lo : lo + step], ci[lo : lo + step]
+            d2 = _segment_dist2(pxy[p_idx, None, :] - self.a[c_idx], self.ab[c_idx], self.len2[c_idx]).min(axis=1)
+            np.minimum.at(out, p_idx, d2)
+        return out
+
+
+def _segment_dist2(ap: np.ndarray, ab: np.ndarray, len2: np.ndarray) -> np.ndarray:
+    """
+    点と線分の距離の2乗（ap: 点 - 線分の始点 (..., 2)、ab: 線分の方向ベクトル (..., 2)、len2: |ab|^2）
+
+    射影パラメータ t を [0, 1] にクランプして最短点を求める。零長の線分は t=0（始点までの距離）。
+    """
+    t = np.einsum("...k,...k->...", ap, ab) / np.where(len2 > 0.0, len2, 1.0)
+    t = np.where(len2 > 0.0, np.clip(t, 0.0, 1.0), 0.0)
+    diff = ap - t[..., None] * ab
+    return np.einsum("...k,...k->...", diff, diff)
+
+
+def haversine_m_array(points: np.ndarray, ref: Tuple[float, float] | np.ndarray) -> np.ndarray:
+    """各点 (M, 2) と基準点 ref の距離（メートル、haversine）"""
+    pts = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    lat2, lng2 = np.radians(np.asarray(ref, dtype=np.float64))
+    dphi = lat2 - pts[:, 0]
+    dlambda = lng2 - pts[:, 1]
+    h = np.sin(dphi / 2.0) ** 2 + np.cos(pts[:, 0]) * math.cos(lat2) * np.sin(dlambda / 2.0) ** 2
+    return 2.0 * _EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+
+def distances_to_path(
+    path: PathGeometry | np.ndarray | List[Tuple[float, float]],
+    places: np.ndarray | List[Tuple[float, float]],
+) -> np.ndarray:
+    """
+    複数地点 (M, 2)（緯度, 経度）から経路までの最短距離（メートル、(M,)）を1回でまとめて計算する
+
+    path には点列か、投影済みの PathGeometry（同じ経路に何度も当てる場合）を渡す。
+    緯度経度が NaN の地点と、空の経路に対する距離は inf。
+    """
+    geometry = path if isinstance(path, PathGeometry) else PathGeometry(np.asarray(path, dtype=np.float64))
+    dist = geometry.distances_to(np.asarray(places, dtype=np.float64))
+    return np.where(np.isnan(dist), np.inf, dist)
+
+
 def distance_to_path_m(points: List[Tuple[float, float]], point: Tuple[float, float]) -> float:
     """
     点から経路（折れ線）までの最短距離（メートル）
+
+    PathGeometry.distances_to の1点版の互換ラッパー。同じ経路に複数点を当てる場合は PathGeometry を使う。
     """
     if not points:
         return float("inf")
     if len(points) == 1:
-        return _haversine_m(points[0], point)
-    min_dist = float("inf")
-    for i in range(len(points) - 1):
-        d = _point_segment_distance_m(point, points[i], points[i + 1])
-        if d < min_dist:
-            min_dist = d
-    return min_dist
+        return haversine_m(points[0], point)
+    return float(PathGeometry.from_points(points).distances_to(np.asarray([point], dtype=np.float64))[0])
 
 
 def simplify_douglas_peucker(
@@ -181,32 +508,83 @@ def simplify_douglas_peucker(
 ) -> List[Tuple[float, float]]:
     """
     Douglas–Peuckerで折れ線を簡略化する（メートル基準）
+
+    simplify_mask の結果で点を残す互換ラッパー。
     """
     if len(points) <= 2:
         return points
+    keep = simplify_mask(np.asarray(points, dtype=np.float64), epsilon_m=epsilon_m)
+    return [p for p, k in zip(points, keep.tolist()) if k]
+
 
-    keep = [False] * len(points)
+def simplify_mask(latlng: np.ndarray, epsilon_m: float = 20.0) -> np.ndarray:
+    """
+    Douglas–Peuckerで残す点のマスク（(N,) bool）を返す
+
+    局所平面座標に1回だけ投影し、区間ごとの「区間内の点と両端を結ぶ線分の距離」を NumPy でまとめて計算する。
+    """
+    latlng = np.asarray(latlng, dtype=np.float64).reshape(-1, 2)
+    n = latlng.shape[0]
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
     keep[0] = True
     keep[-1] = True
+    if n <= 2:
+        return keep
 
-    stack: List[Tuple[int, int]] = [(0, len(points) - 1)]
+    xy = PathGeometry(latlng).xy
+    xs = xy[:, 0].tolist()
+    ys = xy[:, 1].tolist()
+    eps2 = epsilon_m * epsilon_m
+    stack: List[Tuple[int, int]] = [(0, n - 1)]
     while stack:
         start, end = stack.pop()
-        max_dist = -1.0
-        index = None
-        a = points[start]
-        b = points[end]
-        for i in range(start + 1, end):
-            d = _point_segment_distance_m(points[i], a, b)
-            if d > max_dist:
-                max_dist = d
-                index = i
-        if index is not None and max_dist > epsilon_m:
+        if end - start < 2:
+            continue
+        if end - start <= _DP_SCALAR_SPAN:
+            index, max_dist2 = _farthest_scalar(xs, ys, start, end)
+        else:
+            index, max_dist2 = _farthest_vectorized(xy, start, end)
+        if max_dist2 > eps2:
             keep[index] = True
             stack.append((start, index))
             stack.append((index, end))
+    return keep
+
+
+def _farthest_vectorized(xy: np.ndarray, start: int, end: int) -> Tuple[int, float]:
+    """区間 (start, end) の内側で線分 start-end から最も遠い点（index, 距離の2乗）"""
+    a = xy[start]
+    ab = xy[end] - a
+    ap = xy[start + 1 : end] - a
+    ab_len2 = float(ab @ ab)
+    if ab_len2 > 0.0:
+        t = np.clip(ap @ ab / ab_len2, 0.0, 1.0)
+        diff = ap - t[:, None] * ab
+    else:
+        diff = ap
+    dist2 = np.einsum("ij,ij->i", diff, diff)
+    offset = int(np.argmax(dist2))
+    return start + 1 + offset, float(dist2[offset])
 
-    return [p for i, p in enumerate(points) if keep[i]]
+
+def _farthest_scalar(xs: List[float], ys: List[float], start: int, end: int) -> Tuple[int, float]:
+    """_farthest_vectorized の短い区間向け（NumPy の呼び出しコストの方が大きい区間用）"""
+    ax, ay = xs[start], ys[start]
+    abx, aby = xs[end] - ax, ys[end] - ay
+    ab_len2 = abx * abx + aby * aby
+    index, max_dist2 = start + 1, -1.0
+    for i in range(start + 1, end):
+        apx, apy = xs[i] - ax, ys[i] - ay
+        t = 0.0
+        if ab_len2 > 0.0:
+            t = max(0.0, min(1.0, (apx * abx + apy * aby) / ab_len2))
+        dx, dy = apx - t * abx, apy - t * aby
+        d2 = dx * dx + dy * dy
+        if d2 > max_dist2:
+            index, max_dist2 = i, d2
+    return index, max_dist2
 
 
 def pick_waypoints(points: List[Tuple[float, float]], max_points: int = 10) -> List[Tuple[float, float]]:
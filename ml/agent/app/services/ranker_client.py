@@ -3,6 +3,7 @@ import logging
 import httpx
 
 from app.settings import settings
+from app.services import ranker_embedded
 from app.services.http_client import get_client
 
 logger = logging.getLogger(__name__)
@@ -16,6 +17,7 @@ async def rank_routes(
     内部Ranker APIを呼び出してルートをスコアリングする
     
     部分的な成功を許可（一部のルートが失敗してもOK）
+    RANKER_MODE=embedded の場合は HTTP を介さずプロセス内の Ranker で同じ処理を行う。
     
     Args:
         request_id: リクエストID
@@ -24,6 +26,9 @@ async def rank_routes(
     Returns:
         (スコアリスト, 失敗したルートIDのリスト) のタプル
     """
+    if settings.RANKER_MODE == "embedded":
+        return await ranker_embedded.rank_routes(request_id, routes)
+
     payload = {"request_id": request_id, "routes": routes}
 
     try:
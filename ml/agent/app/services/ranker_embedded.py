@@ -0,0 +1,134 @@
+"""
+Ranker をエージェント内でライブラリとして読み込み、HTTP を介さずにスコアリングする（RANKER_MODE=embedded）。
+
+ml/ranker/app パッケージを別名（firstdown_ranker）で読み込み、Ranker の /rank ハンドラ（ルールスコア +
+ModelScorer + rank_result ログ）をそのまま呼ぶ。戻り値は ranker_client.rank_routes と同じ形。
+Ranker の lifespan は動かないため、start / shutdown（Agent の lifespan から呼ぶ）で Ranker の
+start / stop（rank_result 書き込み・モデルレジストリの監視）を明示的に呼ぶ。
+Ranker の設定は RANKER_EMBEDDED_ENV_PREFIX 付きの環境変数から読み込む（Agent の設定と名前が衝突しないように）。
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib
+import importlib.util
+import logging
+import sys
+import threading
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_PACKAGE_NAME = "firstdown_ranker"
+_ranker_main: Optional[ModuleType] = None
+_started = False
+_load_lock = threading.Lock()
+
+
+def _ranker_dir() -> Path:
+    if settings.RANKER_EMBEDDED_PATH:
+        return Path(settings.RANKER_EMBEDDED_PATH)
+    # リポジトリ内の配置（ml/agent/app/services -> ml/ranker）
+    return Path(__file__).resolve().parents[3] / "ranker"
+
+
+def _resolve_model_paths(ranker_settings: Any, ranker_dir: Path) -> None:
+    """MODEL_PATH 等の相対パスは Ranker ディレクトリ基準で解決する（エージェントの作業ディレクトリではなく）。"""
+    for name in ("MODEL_PATH", "MODEL_FEATURES_PATH"):
+        raw = getattr(ranker_settings, name, "")
+        if raw and not Path(raw).is_absolute() and not Path(raw).exists():
+            setattr(ranker_settings, name, str(ranker_dir / raw))
+
+
+def load() -> ModuleType:
+    """Ranker パッケージを読み込む（モデルのロードを含むため初回は時間がかかる）。"""
+    global _ranker_main
+    if _ranker_main is not None:
+        return _ranker_main
+    with _load_lock:
+        if _ranker_main is not None:
+            return _ranker_main
+        ranker_dir = _ranker_dir()
+        package_dir = ranker_dir / "app"
+        spec = importlib.util.spec_from_file_location(
+            _PACKAGE_NAME,
+            package_dir / "__init__.py",
+            submodule_search_locations=[str(package_dir)],
+        )
+        if spec is None or spec.loader is None:
+            raise ImportError(f"Ranker package not found: {package_dir}")
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[_PACKAGE_NAME] = package
+        spec.loader.exec_module(package)
+        # 他のモジュールが `from .settings import settings` する前に、接頭辞付きの環境変数から読んだ設定に差し替える
+        # （プロセスの環境変数は変更しない）
+        settings_module = importlib.import_module(f"{_PACKAGE_NAME}.settings")
+        ranker_settings = settings_module.Settings(_env_prefix=settings.RANKER_EMBEDDED_ENV_PREFIX)
+        _resolve_model_paths(ranker_settings, ranker_dir)
+        settings_module.settings = ranker_settings
+        # main の import 時に ModelScorer が生成されモデルがロードされる
+        _ranker_main = importlib.import_module(f"{_PACKAGE_NAME}.main")
+        logger.info(
+            "[Ranker Embedded] loaded path=%s mode=%s model_version=%s",
+            ranker_dir,
+            _ranker_main.model_registry.primary.mode,
+            _ranker_main.model_registry.primary.model_version,
+        )
+        return _ranker_main
+
+
+def start() -> ModuleType:
+    """Ranker を読み込み、バックグラウンド処理（rank_result 書き込み・モデルレジストリの監視）を開始する。"""
+    global _started
+    ranker_main = load()
+    with _load_lock:
+        if not _started:
+            ranker_main.start()
+            _started = True
+    return ranker_main
+
+
+async def rank_routes(
+    request_id: str,
+    routes: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    プロセス内の Ranker でルートをスコアリングする（ranker_client.rank_routes と同じ戻り値）。
+
+    Returns:
+        (スコアリスト, 失敗したルートIDのリスト) のタプル
+    """
+    ranker_main = _ranker_main if _started else await asyncio.to_thread(start)
+    rank_req = ranker_main.RankRequest(request_id=request_id, routes=routes)
+    try:
+        resp = await asyncio.wait_for(ranker_main.rank(rank_req), timeout=settings.RANKER_TIMEOUT_SEC)
+    except HTTPException as e:
+        if e.status_code == 422:
+            # 422: Rankerがどのルートもスコアリングできなかった（リモート時と同じ扱い）
+            logger.warning("[Ranker Embedded] request_id=%s status=422 detail=%s", request_id, e.detail)
+            return [], [x.get("route_id") for x in routes if "route_id" in x]
+        raise
+    except asyncio.TimeoutError:
+        logger.error(
+            "[Ranker Timeout] request_id=%s timeout_sec=%.1f mode=embedded",
+            request_id,
+            settings.RANKER_TIMEOUT_SEC,
+        )
+        raise
+    return [s.model_dump() for s in resp.scores], list(resp.failed_route_ids)
+
+
+def shutdown() -> None:
+    """Ranker のバックグラウンド処理を止め、rank_result の残りを書き切る（lifespan の終了時に呼ぶ）。"""
+    global _started
+    with _load_lock:
+        if _ranker_main is None or not _started:
+            return
+        _started = False
+    _ranker_main.stop()
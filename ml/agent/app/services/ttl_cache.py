@@ -1,6 +1,20 @@
 """
-/route/generate 用のインプロセスTTLキャッシュ。
+/route/generate 用のTTLキャッシュ。
 同一条件の連続リクエスト時に Maps/Ranker/LLM を呼ばず即時レスポンスする。
+
+バックエンドは GENERATE_CACHE_BACKEND で切り替える。
+- memory: インプロセスの TTLCache（インスタンスごと）
+- redis: Redis プロトコル互換の外部ストア（インスタンス間で共有）
+- tiered: L1=memory / L2=redis の二段構成
+外部ストアにはレスポンス辞書を JSON で保存し、リースキーでインスタンス間の生成を1本化する。
+
+エントリは {"kind", "stored_at", "response"/"detail"} の封筒形式で保存する。
+- GENERATE_CACHE_TTL_SEC 以内: fresh（そのまま返す）
+- さらに GENERATE_CACHE_STALE_TTL_SEC 以内: stale（即時に返し、裏で再生成）
+- 422 で終わったリクエストは GENERATE_CACHE_NEGATIVE_TTL_SEC の間 negative として保存
+
+GENERATE_CACHE_PROXIMITY_ENABLED 時は、完全一致キーが無くても開始（・終了）地点が
+GENERATE_CACHE_PROXIMITY_RADIUS_M 以内で条件が同じキャッシュ済みレスポンスを探す（インスタンス内インデックス）。
 """
 from __future__ import annotations
 
@@ -8,31 +22,179 @@ import asyncio
 import hashlib
 import json
 import logging
-from typing import Any, Dict, Optional
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
 
 from cachetools import TTLCache
 
 from app.schemas import GenerateRouteRequest
+from app.services.places_cache import snap_to_tile
+from app.services.polyline import haversine_m
 from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
-# キャッシュ本体（設定で有効時のみ使用、遅延初期化）
-_ttl_cache: Optional[TTLCache[str, Dict[str, Any]]] = None
-# key ごとの Lock（同一キーの並行リクエストで生成を1回に集約）
-_key_locks: Dict[str, asyncio.Lock] = {}
-_lock_for_locks: asyncio.Lock = asyncio.Lock()
+T = TypeVar("T")
+
+
+def serialize_response(response_dict: Dict[str, Any]) -> str:
+    """GenerateRouteResponse の辞書を外部ストア用の JSON 文字列にする。"""
+    return json.dumps(response_dict, ensure_ascii=False, separators=(",", ":"))
+
+
+def deserialize_response(raw: Any) -> Optional[Dict[str, Any]]:
+    """外部ストアの値をレスポンス辞書に戻す。壊れた値は None。"""
+    if raw is None:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class CacheBackend:
+    """キャッシュバックエンドのインターフェース。"""
+
+    name = "base"
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_sec: float) -> None:
+        raise NotImplementedError
+
+    async def acquire_lease(self, key: str, ttl_sec: float) -> Optional[str]:
+        """生成権（リース）を取得する。取得できればトークン、他者が保持中なら None。"""
+        return uuid.uuid4().hex
+
+    async def release_lease(self, key: str, token: str) -> None:
+        return None
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """インプロセス TTLCache。リースはプロセス内ロックで足りるため常に取得成功とする。"""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int, ttl_sec: float) -> None:
+        self._cache: TTLCache[str, Dict[str, Any]] = TTLCache(maxsize=max(1, int(maxsize)), ttl=float(ttl_sec))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_sec: float) -> None:
+        self._cache[key] = value
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis プロトコル互換ストア。
+
+    client には redis.asyncio.Redis 互換オブジェクト（get/set/delete を持つもの）を渡せる。
+    未指定時は url から redis.asyncio クライアントを生成する（redis パッケージは遅延 import）。
+    """
+
+    name = "redis"
+    def __init__(self, url: str = "", client: Any = None, lease_prefix: str = "lease:") -> None:
+        if client is None:
+            import redis.asyncio as redis_asyncio
+
+            client = redis_asyncio.from_url(url)
+        self._client = client
+        self._lease_prefix = lease_prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return deserialize_response(await self._client.get(key))
 
+    async def set(self, key: str, value: Dict[str, Any], ttl_sec: float) -> None:
+        await self._client.set(key, serialize_response(value), px=max(1, int(ttl_sec * 1000)))
 
-def _get_cache() -> TTLCache[str, Dict[str, Any]]:
-    """設定に従いキャッシュを返す。無効時は None を返さず maxsize=0 相当にしないため、呼び出し元で GENERATE_CACHE_ENABLED を確認する。"""
-    global _ttl_cache
-    if _ttl_cache is None:
-        _ttl_cache = TTLCache(
-            maxsize=max(1, settings.GENERATE_CACHE_MAXSIZE),
-            ttl=settings.GENERATE_CACHE_TTL_SEC,
+    async def acquire_lease(self, key: str, ttl_sec: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        ok = await self._client.set(
+            self._lease_prefix + key,
+            token,
+            nx=True,
+            px=max(1, int(ttl_sec * 1000)),
         )
-    return _ttl_cache
+        return token if ok else None
+
+    async def release_lease(self, key: str, token: str) -> None:
+        # 自分のトークンのときだけ削除（期限切れ後に他者が取ったリースを消さない）。
+        # Lua 非対応の互換ストアでも動くよう GET → DEL で行う（競合時は重複生成になるだけ）
+        lease_key = self._lease_prefix + key
+        current = await self._client.get(lease_key)
+        if isinstance(current, bytes):
+            current = current.decode("utf-8")
+        if current == token:
+            await self._client.delete(lease_key)
+
+
+class TwoTierCacheBackend(CacheBackend):
+    """L1（インプロセス）+ L2（外部ストア）。L2 ヒット時は L1 に書き戻す。"""
+
+    name = "tiered"
+
+    def __init__(self, l1: CacheBackend, l2: CacheBackend, l1_ttl_sec: float) -> None:
+        self._l1 = l1
+        self._l2 = l2
+        self._l1_ttl_sec = float(l1_ttl_sec)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await self._l1.get(key)
+        if value is not None:
+            return value
+        value = await self._l2.get(key)
+        if value is not None:
+            await self._l1.set(key, value, self._l1_ttl_sec)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_sec: float) -> None:
+        await self._l1.set(key, value, min(ttl_sec, self._l1_ttl_sec))
+        await self._l2.set(key, value, ttl_sec)
+
+    async def acquire_lease(self, key: str, ttl_sec: float) -> Optional[str]:
+        return await self._l2.acquire_lease(key, ttl_sec)
+
+    async def release_lease(self, key: str, token: str) -> None:
+        await self._l2.release_lease(key, token)
+
+
+# バックエンド本体（設定で有効時のみ使用、遅延初期化）
+_backend: Optional[CacheBackend] = None
+
+
+def _build_backend() -> CacheBackend:
+    kind = str(getattr(settings, "GENERATE_CACHE_BACKEND", "memory") or "memory").lower()
+    ttl = _retention_sec()
+    if kind == "redis":
+        return RedisCacheBackend(url=settings.GENERATE_CACHE_REDIS_URL)
+    if kind == "tiered":
+        l1 = InMemoryCacheBackend(maxsize=settings.GENERATE_CACHE_MAXSIZE, ttl_sec=ttl)
+        l2 = RedisCacheBackend(url=settings.GENERATE_CACHE_REDIS_URL)
+        return TwoTierCacheBackend(l1=l1, l2=l2, l1_ttl_sec=ttl)
+    if kind != "memory":
+        logger.warning("unknown GENERATE_CACHE_BACKEND=%s, using memory", kind)
+    return InMemoryCacheBackend(maxsize=settings.GENERATE_CACHE_MAXSIZE, ttl_sec=ttl)
+
+
+def get_backend() -> CacheBackend:
+    """設定に従いバックエンドを返す。呼び出し元で GENERATE_CACHE_ENABLED を確認する。"""
+    global _backend
+    if _backend is None:
+        _backend = _build_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[CacheBackend]) -> None:
+    """バックエンドを差し替える（テストでローカルの Redis 互換スタブを使う場合など）。"""
+    global _backend
+    _backend = backend
 
 
 def build_cache_key(req: GenerateRouteRequest) -> str:
@@ -65,37 +227,327 @@ def build_cache_key(req: GenerateRouteRequest) -> str:
     return "gen:v1:" + h
 
 
-async def _get_key_lock(key: str) -> asyncio.Lock:
-    """key 用の Lock を取得する（同一キーで並行リクエストを1本化するため）。"""
-    async with _lock_for_locks:
-        if key not in _key_locks:
-            _key_locks[key] = asyncio.Lock()
-        return _key_locks[key]
+class _Flight(Generic[T]):
+    """実行中の1本の生成。refs は結果を待っている呼び出し元の数。"""
+
+    __slots__ = ("task", "refs")
+
+    def __init__(self, task: "asyncio.Task[T]") -> None:
+        self.task = task
+        self.refs = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    同一キーの並行呼び出しを1本の実行に集約する。
+
+    最初の呼び出しが生成タスクを起動し、後続は同じタスクの結果（例外含む）を共有する。
+    エントリは参照カウントで管理し、タスク完了時に削除する。待ち手が全員キャンセルされた場合は
+    タスクもキャンセルする（1人でも待っていれば継続）。
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, _Flight[T]] = {}
+        self._started = 0
+        self._coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """fn を key 単位で1本化して実行する。戻り値は (結果, 他の呼び出しの結果を共有したか)。"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            self._started += 1
+            flight.task.add_done_callback(lambda _t, k=key, f=flight: self._forget(k, f))
+        else:
+            self._coalesced += 1
+        flight.refs += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.refs -= 1
+            if flight.refs <= 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _forget(self, key: Hashable, flight: _Flight[T]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        """実行中の本数・待ち手数・累計の起動数/集約数を返す。"""
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(f.refs for f in self._flights.values()),
+            "started": self._started,
+            "coalesced": self._coalesced,
+        }
+
+
+# /route/generate の生成集約（同一キーの並行リクエストを1本化）
+generate_flight: SingleFlight[Any] = SingleFlight()
 
 
-def cache_get(key: str) -> Optional[Dict[str, Any]]:
-    """キャッシュからレスポンス辞書を取得する。ヒットしなければ None。"""
+@dataclass
+class CacheEntry:
+    """キャッシュから取り出したエントリ。negative の場合 response は None。"""
+    kind: str  # "ok" / "negative"
+    stored_at: float  # 保存時刻（epoch秒）
+    response: Optional[Dict[str, Any]] = None
+    detail: Optional[str] = None
+
+    @property
+    def age_sec(self) -> float:
+        return max(0.0, time.time() - self.stored_at)
+
+    @property
+    def negative(self) -> bool:
+        return self.kind == "negative"
+
+    @property
+    def fresh(self) -> bool:
+        return not self.negative and self.age_sec <= float(settings.GENERATE_CACHE_TTL_SEC)
+
+
+# ヒット/ミス/stale/再生成などの累計カウンタ
+_metrics: Dict[str, int] = {
+    "hit": 0,
+    "miss": 0,
+    "stale": 0,
+    "negative_hit": 0,
+    "negative_set": 0,
+    "refresh_start": 0,
+    "refresh_ok": 0,
+    "refresh_failed": 0,
+    "proximity_hit": 0,
+}
+
+
+def record(event: str) -> Dict[str, int]:
+    """カウンタを1つ進めて現在値のコピーを返す（ログ出力用）。"""
+    _metrics[event] = _metrics.get(event, 0) + 1
+    return dict(_metrics)
+
+
+def get_metrics() -> Dict[str, int]:
+    return dict(_metrics)
+
+
+def _retention_sec() -> float:
+    """バックエンドに保持する期間（fresh + stale）。"""
+    return float(settings.GENERATE_CACHE_TTL_SEC) + max(0.0, float(settings.GENERATE_CACHE_STALE_TTL_SEC))
+
+
+def _unwrap(raw: Optional[Dict[str, Any]]) -> Optional[CacheEntry]:
+    """封筒形式の値を CacheEntry にし、期限切れなら None を返す。"""
+    if not raw or "kind" not in raw:
+        return None
+    entry = CacheEntry(
+        kind=str(raw.get("kind")),
+        stored_at=float(raw.get("stored_at") or 0.0),
+        response=raw.get("response"),
+        detail=raw.get("detail"),
+    )
+    if entry.negative:
+        if entry.age_sec > float(settings.GENERATE_CACHE_NEGATIVE_TTL_SEC):
+            return None
+        return entry
+    if entry.response is None or entry.age_sec > _retention_sec():
+        return None
+    return entry
+
+
+async def cache_get_entry(key: str) -> Optional[CacheEntry]:
+    """fresh / stale / negative を含むエントリを取得する。ヒットしなければ None。"""
     if not getattr(settings, "GENERATE_CACHE_ENABLED", True):
         return None
     try:
-        cache = _get_cache()
-        return cache.get(key)
+        return _unwrap(await get_backend().get(key))
     except Exception as e:
         logger.warning("generate cache get error key=%s err=%s", key[:16], e)
         return None
 
 
-def cache_set(key: str, response_dict: Dict[str, Any]) -> None:
+async def cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """fresh なレスポンス辞書のみを取得する。ヒットしなければ None。"""
+    entry = await cache_get_entry(key)
+    if entry is None or not entry.fresh:
+        return None
+    return entry.response
+
+
+async def cache_set(key: str, response_dict: Dict[str, Any]) -> None:
     """レスポンス辞書をキャッシュに保存する。best-effort。"""
     if not getattr(settings, "GENERATE_CACHE_ENABLED", True):
         return
     try:
-        cache = _get_cache()
-        cache[key] = response_dict
+        await get_backend().set(
+            key,
+            {"kind": "ok", "stored_at": time.time(), "response": response_dict},
+            _retention_sec(),
+        )
     except Exception as e:
         logger.warning("generate cache set error key=%s err=%s", key[:16], e)
 
 
+async def cache_set_negative(key: str, detail: str) -> None:
+    """生成に失敗した（422）条件を短時間キャッシュする。best-effort。"""
+    ttl = float(settings.GENERATE_CACHE_NEGATIVE_TTL_SEC)
+    if not getattr(settings, "GENERATE_CACHE_ENABLED", True) or ttl <= 0:
+        return
+    try:
+        await get_backend().set(
+            key,
+            {"kind": "negative", "stored_at": time.time(), "detail": detail},
+            ttl,
+        )
+    except Exception as e:
+        logger.warning("generate cache negative set error key=%s err=%s", key[:16], e)
+
+
+@dataclass
+class _IndexedRequest:
+    key: str
+    group: tuple  # (theme, round_trip, distance bucket)
+    cell: tuple[int, int]
+    start: tuple[float, float]
+    end: Optional[tuple[float, float]]
+
+
+class ProximityIndex:
+    """
+    キャッシュ済みレスポンスを開始地点のグリッドセルで索引する。
+
+    セルの一辺は検索半径と同じにし、検索時は周囲 3x3 セルだけを調べる。
+    登録は GENERATE_CACHE_MAXSIZE 件・保持期間で打ち切り、値そのものはバックエンドから取得する。
+    """
+
+    def __init__(self) -> None:
+        self._entries: Optional[TTLCache[str, _IndexedRequest]] = None
+        self._cells: Dict[tuple, set] = {}
+
+    def _get_entries(self) -> TTLCache[str, _IndexedRequest]:
+        if self._entries is None:
+            self._entries = TTLCache(maxsize=max(1, int(settings.GENERATE_CACHE_MAXSIZE)), ttl=_retention_sec())
+        return self._entries
+
+    @staticmethod
+    def _radius_m() -> float:
+        return max(1.0, float(settings.GENERATE_CACHE_PROXIMITY_RADIUS_M))
+
+    @staticmethod
+    def _group(req: GenerateRouteRequest) -> tuple:
+        dist_dec = getattr(settings, "GENERATE_CACHE_ROUND_DISTANCE_DECIMALS", 1)
+        return (req.theme, bool(req.round_trip), round(req.distance_km, dist_dec))
+
+    @staticmethod
+    def _end(req: GenerateRouteRequest) -> Optional[tuple[float, float]]:
+        if req.end_location is None:
+            return None
+        return (float(req.end_location.lat), float(req.end_location.lng))
+
+    def add(self, key: str, req: GenerateRouteRequest) -> None:
+        start = (float(req.start_location.lat), float(req.start_location.lng))
+        item = _IndexedRequest(
+            key=key,
+            group=self._group(req),
+            cell=snap_to_tile(start[0], start[1], self._radius_m()),
+            start=start,
+            end=self._end(req),
+        )
+        self._get_entries()[key] = item
+        self._cells.setdefault(item.group + item.cell, set()).add(key)
+
+    def find(self, req: GenerateRouteRequest, exclude_key: Optional[str] = None) -> Optional[str]:
+        """半径内で最も開始地点が近いキャッシュキーを返す。無ければ None。"""
+        entries = self._get_entries()
+        radius_m = self._radius_m()
+        group = self._group(req)
+        start = (float(req.start_location.lat), float(req.start_location.lng))
+        end = self._end(req)
+        lat_idx, lng_idx = snap_to_tile(start[0], start[1], radius_m)
+        best_key: Optional[str] = None
+        best_dist = float("inf")
+        for dlat in (-1, 0, 1):
+            for dlng in (-1, 0, 1):
+                cell_key = group + (lat_idx + dlat, lng_idx + dlng)
+                keys = self._cells.get(cell_key)
+                if not keys:
+                    continue
+                for key in list(keys):
+                    item = entries.get(key)
+                    if item is None or item.group + item.cell != cell_key:
+                        # 期限切れ・追い出し済み（または別セルで再登録済み）
+                        keys.discard(key)
+                        continue
+                    if key == exclude_key:
+                        continue
+                    if (item.end is None) != (end is None):
+                        continue
+                    if end is not None and haversine_m(item.end, end) > radius_m:
+                        continue
+                    dist = haversine_m(item.start, start)
+                    if dist <= radius_m and dist < best_dist:
+                        best_key = key
+                        best_dist = dist
+                if not keys:
+                    del self._cells[cell_key]
+        return best_key
+
+    def clear(self) -> None:
+        self._entries = None
+        self._cells = {}
+
+
+# 近傍一致用のインデックス（GENERATE_CACHE_PROXIMITY_ENABLED 時のみ使用）
+proximity_index = ProximityIndex()
+
+
+async def acquire_lease(key: str) -> Optional[str]:
+    """
+    インスタンス間の生成リースを取得する。
+
+    取得できればトークンを返す。他インスタンスが生成中なら None。
+    ストア障害時は生成を止めないよう、ダミートークンを返して自分で生成させる。
+    """
+    try:
+        return await get_backend().acquire_lease(key, float(settings.GENERATE_CACHE_LEASE_TTL_SEC))
+    except Exception as e:
+        logger.warning("generate cache lease error key=%s err=%s", key[:16], e)
+        return ""
+
+
+async def release_lease(key: str, token: Optional[str]) -> None:
+    """リースを解放する。best-effort。"""
+    if not token:
+        return
+    try:
+        await get_backend().release_lease(key, token)
+    except Exception as e:
+        logger.warning("generate cache lease release error key=%s err=%s", key[:16], e)
+
+
+async def wait_for_leader(key: str) -> Optional[CacheEntry]:
+    """
+    他インスタンスが生成中のキーについて、結果（fresh または negative）がキャッシュに入るのを待つ。
+
+    GENERATE_CACHE_LEASE_WAIT_SEC 以内に入らなければ None（呼び出し元で自分で生成する）。
+    """
+    wait_sec = float(settings.GENERATE_CACHE_LEASE_WAIT_SEC)
+    poll_sec = max(0.01, float(settings.GENERATE_CACHE_LEASE_POLL_SEC))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_sec
+    while loop.time() < deadline:
+        await asyncio.sleep(poll_sec)
+        entry = await cache_get_entry(key)
+        if entry is not None and (entry.fresh or entry.negative):
+            return entry
+    return None
+
+
 def cache_key_prefix(key: str, length: int = 8) -> str:
     """ログ用にキーの先頭を返す（gen:v1: を除いたハッシュ部分）。"""
     prefix = "gen:v1:"
@@ -9,6 +9,9 @@ class Settings(BaseSettings):
     RANKER_URL: str = "http://ranker:8080"  # RankerサービスのURL
     REQUEST_TIMEOUT_SEC: float = 10.0  # 一般的なリクエストのタイムアウト（秒）
     RANKER_TIMEOUT_SEC: float = 10.0  # Ranker APIのタイムアウト（秒）
+    RANKER_MODE: str = "remote"  # remote（Ranker APIをHTTPで呼ぶ）/ embedded（Rankerをプロセス内で実行）
+    RANKER_EMBEDDED_PATH: str = ""  # embedded 時の Ranker ディレクトリ（app/ と models/ を含む。空なら ../ranker）
+    RANKER_EMBEDDED_ENV_PREFIX: str = "RANKER_EMBEDDED_"  # embedded 時の Ranker 設定の環境変数の接頭辞（例: RANKER_EMBEDDED_MODEL_PATH）
     LOG_LEVEL: str = "INFO"  # ログレベル（INFO/DEBUG/WARNING）
 
     # Google Maps Platform
@@ -37,26 +40,53 @@ class Settings(BaseSettings):
         "すき家,吉野家,松屋,なか卯,丸亀製麺,はなまるうどん,日高屋,サイゼリヤ,ガスト"
     )
     PLACES_TYPE_BLOCKLIST: str = "convenience_store,fast_food_restaurant"
+    PLACES_CACHE_ENABLED: bool = True  # リクエスト横断のPlaces検索結果キャッシュ
+    PLACES_CACHE_TTL_SEC: float = 1800.0  # キャッシュのTTL（秒）
+    PLACES_CACHE_TILE_M: float = 150.0  # 検索中心をスナップするタイルの一辺（m）
+    PLACES_CACHE_RADIUS_BUCKET_M: int = 100  # 検索半径の丸め単位（m、切り上げ）
+    PLACES_CACHE_MAX_BYTES: int = 8_000_000  # キャッシュのメモリ予算（JSONバイト数で近似）
+    PLACES_MEMO_ROUND_DECIMALS: int = 5  # リクエスト内のPlaces検索結果メモのキー丸め桁数（緯度経度）
 
     # ルート生成（逐次生成/早期終了）
     MAX_ROUTES: int = 5  # 最大生成本数
     MIN_ROUTES: int = 2  # 最低生成本数
     SCORE_THRESHOLD: float = 0.6  # 早期終了の閾値（暫定）
     CONCURRENCY: int = 2  # 外部APIの並列数
+    ROUTES_CONCURRENCY: int = 5  # Routes APIの並列数（0以下ならCONCURRENCYを使用）
+    FEATURES_CONCURRENCY: int = 3  # 特徴量計算時のスポット検索の並列数（候補単位）
+    FEATURES_PLACES_TIMEOUT_SEC: float = 3.0  # 候補1本あたりのスポット検索タイムアウト（秒、0以下で無制限）
     ROUTE_DISTANCE_ERROR_RATIO_MAX: float = 0.3  # 目標距離の許容誤差比率
     ROUTE_DISTANCE_RETRY_MAX: int = 1  # 距離フィルタ後の再生成回数
     SHORT_DISTANCE_TARGET_RATIO: float = 0.7  # 短距離時の事前距離補正比率（配布確認用コメント）
     SHORT_DISTANCE_MAX_KM: float = 3.0  # 短距離補正の上限距離（km）
 
+    # ルート候補プール（人気の出発地点の事前生成）
+    CANDIDATE_POOL_ENABLED: bool = False  # 事前生成した候補プールを使う（バックグラウンドで定期生成）
+    CANDIDATE_POOL_ORIGINS: str = ""  # 対象の出発地点（"lat,lng;lat,lng" 形式）
+    CANDIDATE_POOL_THEMES: str = "exercise,think,refresh,nature"  # 対象テーマ（カンマ区切り）
+    CANDIDATE_POOL_DISTANCES_KM: str = "2,3,5"  # 対象距離（km、カンマ区切り。0.1km単位で一致判定）
+    CANDIDATE_POOL_TILE_M: float = 150.0  # 出発地点をスナップするタイルの一辺（m）
+    CANDIDATE_POOL_REFRESH_SEC: float = 3600.0  # プールの再生成間隔（秒）
+    CANDIDATE_POOL_TTL_SEC: float = 7200.0  # プールの有効期限（秒）
+    CANDIDATE_POOL_ROUNDS: int = 2  # 1組み合わせあたりの候補生成回数（多いほどプールが多様になる）
+    CANDIDATE_POOL_MAX_ORIGIN_M: float = 100.0  # プールの出発地点からこれ以上離れたリクエストにはプールを使わない（m）
+
     # BigQuery
     BQ_DATASET: str = "firstdown_mvp"  # BigQueryデータセット名
     BQ_TABLE_REQUEST: str = "route_request"  # リクエストテーブル名
     BQ_TABLE_CANDIDATE: str = "route_candidate"  # 候補テーブル名
     BQ_TABLE_PROPOSAL: str = "route_proposal"  # 提案テーブル名
     BQ_TABLE_FEEDBACK: str = "route_feedback"  # フィードバックテーブル名
+    BQ_WRITER_ENABLED: bool = True  # バックグラウンドのバッチ書き込みを使う（false で同期書き込み）
+    BQ_QUEUE_MAXSIZE: int = 5000  # テーブルごとのキュー上限（超過分は破棄してカウント）
+    BQ_BATCH_SIZE: int = 200  # 1回の insert_rows_json で送る最大行数
+    BQ_FLUSH_INTERVAL_SEC: float = 1.0  # 定期フラッシュ間隔（秒）
+    BQ_RETRY_MAX: int = 3  # 書き込み失敗時の再試行回数
+    BQ_RETRY_BACKOFF_SEC: float = 0.5  # 再試行の初回待ち時間（秒、指数バックオフ）
+    BQ_SHUTDOWN_FLUSH_TIMEOUT_SEC: float = 10.0  # 終了時に残りの行を書き切る最大時間（秒）
 
     # 特徴量/バージョニング
-    FEATURES_VERSION: str = "mvp_v1"  # 特徴量のバージョン（モデルの互換性管理用）
+    FEATURES_VERSION: str = "mvp_v2"  # 特徴量のバージョン（モデルの互換性管理用。mvp_v2: 形状特徴量を polyline から計算）
     RANKER_VERSION: str = "rule_v1"  # Rankerのバージョン（モデル/ロジックの追跡用）
 
     # ルート近傍の見どころ抽出
@@ -70,6 +100,15 @@ class Settings(BaseSettings):
     GENERATE_CACHE_MAXSIZE: int = 256
     GENERATE_CACHE_ROUND_LATLNG_DECIMALS: int = 5
     GENERATE_CACHE_ROUND_DISTANCE_DECIMALS: int = 1
+    GENERATE_CACHE_STALE_TTL_SEC: float = 0.0  # TTL切れ後も即時返却しつつ裏で再生成する猶予（秒、0で無効。例: 600）
+    GENERATE_CACHE_NEGATIVE_TTL_SEC: float = 30.0  # 422（ルートなし）を再試行せず返す期間（秒、0で無効）
+    GENERATE_CACHE_BACKEND: str = "memory"  # memory / redis / tiered（L1=memory, L2=redis）
+    GENERATE_CACHE_REDIS_URL: str = "redis://localhost:6379/0"  # Redis互換ストアのURL
+    GENERATE_CACHE_LEASE_TTL_SEC: float = 30.0  # インスタンス間の生成リースの有効期限（秒）
+    GENERATE_CACHE_LEASE_WAIT_SEC: float = 10.0  # 他インスタンスの生成結果を待つ最大時間（秒）
+    GENERATE_CACHE_LEASE_POLL_SEC: float = 0.2  # 生成結果待ちのポーリング間隔（秒）
+    GENERATE_CACHE_PROXIMITY_ENABLED: bool = False  # 完全一致しない場合に近傍の開始/終了地点のキャッシュを使う
+    GENERATE_CACHE_PROXIMITY_RADIUS_M: float = 50.0  # 近傍とみなす開始/終了地点の距離（m）
 
 
 settings = Settings()  # グローバル設定インスタンス
@@ -0,0 +1,131 @@
+"""
+polyline 処理のマイクロベンチマーク（外部APIは使わない）
+
+実行例:
+    cd ml/agent
+    PYTHONPATH=. python bench_polyline.py
+
+経路は東京駅付近からのランダムウォーク（1点あたり約50m）。スポットは経路の周囲 ±2km に置く。
+"""
+from __future__ import annotations
+
+import random
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+import polyline as polyline_lib
+
+from app.services import polyline
+from app.services.feature_calc import route_geometry
+
+# 経路の点数（約50m/点: 100点 ≒ 5km、1000点 ≒ 50km。Routes API の polyline は市街地でこれより密）
+ROUTE_POINTS = (100, 300, 1000, 3000, 10000)
+PLACES = (1, 40)
+SEED = 42
+
+
+def _random_route(n: int, rng: random.Random) -> List[Tuple[float, float]]:
+    lat, lng = 35.681, 139.767
+    heading = rng.uniform(0, 2 * np.pi)
+    points = [(lat, lng)]
+    for _ in range(n - 1):
+        heading += rng.gauss(0.0, 0.4)
+        lat += 0.00036 * np.sin(heading)
+        lng += 0.00044 * np.cos(heading)
+        points.append((round(lat, 5), round(lng, 5)))
+    return points
+
+
+def _places_around(route: List[Tuple[float, float]], rng: random.Random, count: int) -> np.ndarray:
+    out = []
+    for _ in range(count):
+        lat, lng = route[rng.randrange(len(route))]
+        out.append((lat + rng.uniform(-0.018, 0.018), lng + rng.uniform(-0.022, 0.022)))
+    return np.asarray(out)
+
+
+def _timeit(fn: Callable[[], object], min_time_s: float = 0.2) -> float:
+    """1回あたりの平均時間（ミリ秒）"""
+    fn()
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time_s:
+            return elapsed / n * 1000
+
+
+def bench_distances() -> None:
+    print("## 経路との距離（経路の投影・インデックス作成込み）")
+    print("| 点数 | スポット数 | 総当たり (ms) | 線分インデックス (ms) | 倍率 | 既定の判定 |")
+    print("|---:|---:|---:|---:|---:|---|")
+    rng = random.Random(SEED)
+    defaults = (polyline.SEGMENT_INDEX_MIN_POINTS, polyline.SEGMENT_INDEX_MIN_PAIRS)
+    try:
+        for n in ROUTE_POINTS:
+            route = _random_route(n, rng)
+            for count in PLACES:
+                places = _places_around(route, rng, count)
+                uses_index = n >= defaults[0] and count * (n - 1) >= defaults[1]
+
+                def run() -> np.ndarray:
+                    return polyline.PathGeometry.from_points(route).distances_to(places)
+
+                polyline.SEGMENT_INDEX_MIN_POINTS = 10**9
+                brute_ms = _timeit(run)
+                expected = run()
+                polyline.SEGMENT_INDEX_MIN_POINTS, polyline.SEGMENT_INDEX_MIN_PAIRS = 0, 0
+                index_ms = _timeit(run)
+                assert np.allclose(run(), expected), "インデックスの結果が総当たりと一致しない"
+                print(
+                    f"| {n} | {count} | {brute_ms:.3f} | {index_ms:.3f} | {brute_ms / index_ms:.1f}x | "
+                    f"{'インデックス' if uses_index else '総当たり'} |"
+                )
+    finally:
+        polyline.SEGMENT_INDEX_MIN_POINTS, polyline.SEGMENT_INDEX_MIN_PAIRS = defaults
+
+
+def bench_decode() -> None:
+    print("## polyline のデコード")
+    print("| 点数 | 文字数 | 1文字ずつ (ms) | NumPy 一括 (ms) | 倍率 | キャッシュ命中 (ms) |")
+    print("|---:|---:|---:|---:|---:|---:|")
+    rng = random.Random(SEED)
+    for n in ROUTE_POINTS:
+        encoded = polyline_lib.encode(_random_route(n, rng))
+        expected = polyline._deltas_to_points(polyline._decode_deltas_scalar(encoded))
+        assert np.array_equal(polyline.decode_polyline_array(encoded), expected), "デコード結果が一致しない"
+        # 1文字ずつ読む従来の実装との比較（どちらもタプルのリスト化まで）
+        scalar_ms = _timeit(lambda: polyline.to_point_list(polyline._deltas_to_points(polyline._decode_deltas_scalar(encoded))))
+        vector_ms = _timeit(lambda: polyline.decode_polyline(encoded))
+        with polyline.decode_cache_scope():
+            cached_ms = _timeit(lambda: polyline.decode_polyline(encoded))
+        print(
+            f"| {n} | {len(encoded)} | {scalar_ms:.3f} | {vector_ms:.3f} | "
+            f"{scalar_ms / vector_ms:.1f}x | {cached_ms:.3f} |"
+        )
+
+
+def bench_route_geometry() -> None:
+    print("## ルート形状の特徴量（route_geometry）")
+    print("| 点数 | 経路長（約 km） | 時間 (ms) | turn_count | self_overlap_ratio | straightness |")
+    print("|---:|---:|---:|---:|---:|---:|")
+    rng = random.Random(SEED)
+    for n in ROUTE_POINTS:
+        latlng = np.asarray(_random_route(n, rng))
+        geometry = route_geometry(latlng)
+        elapsed_ms = _timeit(lambda: route_geometry(latlng))
+        print(
+            f"| {n} | {n * 0.05:.0f} | {elapsed_ms:.3f} | {geometry.turn_count} | "
+            f"{geometry.self_overlap_ratio:.3f} | {geometry.straightness:.3f} |"
+        )
+
+
+if __name__ == "__main__":
+    bench_decode()
+    print()
+    bench_route_geometry()
+    print()
+    bench_distances()
@@ -2,6 +2,9 @@
 -- 実行例:
 --   bq query --use_legacy_sql=false < route_candidate.sql
 -- ※ データセット名を変更する場合は下記のテーブル参照を修正してください。
+-- ※ 既存テーブルには self_overlap_ratio / straightness を追加してください（FEATURES_VERSION=mvp_v2 以降で記録）:
+--   ALTER TABLE `firstdown_mvp.route_candidate` ADD COLUMN IF NOT EXISTS self_overlap_ratio FLOAT64;
+--   ALTER TABLE `firstdown_mvp.route_candidate` ADD COLUMN IF NOT EXISTS straightness FLOAT64;
 
 CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_candidate` (
   event_ts TIMESTAMP,
@@ -23,6 +26,8 @@ CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_candidate` (
   path_length_ratio FLOAT64,
   turn_count INT64,
   turn_density FLOAT64,
+  self_overlap_ratio FLOAT64,  -- 同じ道を2回以上通る区間の割合（行きと帰りの両方を数える、mvp_v2 以降）
+  straightness FLOAT64,  -- 直進区間の長さの割合（mvp_v2 以降）
   theme_exercise INT64,
   theme_think INT64,
   theme_refresh INT64,
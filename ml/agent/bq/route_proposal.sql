@@ -2,6 +2,8 @@
 -- 実行例:
 --   bq query --use_legacy_sql=false < route_proposal.sql
 -- ※ データセット名を変更する場合は下記のテーブル参照を修正してください。
+-- ※ 既存テーブルには logging_latency_ms を追加してください:
+--   ALTER TABLE `firstdown_mvp.route_proposal` ADD COLUMN IF NOT EXISTS logging_latency_ms INT64;
 
 CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_proposal` (
   event_ts TIMESTAMP,
@@ -12,6 +14,7 @@ CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_proposal` (
   tools_used ARRAY<STRING>,
   summary_type STRING,
   total_latency_ms INT64,
+  logging_latency_ms INT64,  -- レスポンス返却後のログ書き込み（request/candidate）にかかった時間
   features_version STRING,
   ranker_version STRING
 );
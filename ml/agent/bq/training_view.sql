@@ -93,6 +93,8 @@ SELECT
   path_length_ratio,
   turn_count,
   turn_density,
+  self_overlap_ratio,
+  straightness,
   theme_exercise,
   theme_think,
   theme_refresh,
@@ -131,6 +133,8 @@ SELECT
   path_length_ratio,
   turn_count,
   turn_density,
+  self_overlap_ratio,
+  straightness,
   theme_exercise,
   theme_think,
   theme_refresh,
@@ -0,0 +1,1386 @@
+"""
+Agent 単体テスト: 外部API（Maps / Places / Redis）を使わずに確認できる部分
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import pytest
+
+from app.services import ttl_cache
+from app.services.ttl_cache import InMemoryCacheBackend, RedisCacheBackend, TwoTierCacheBackend
+from app.settings import settings
+
+
+class FakeRedis:
+    """redis.asyncio.Redis の get/set(nx, px)/delete だけを持つローカルの代替（時刻は clock で進める）"""
+
+    def __init__(self) -> None:
+        self.clock = 0.0
+        self._data: Dict[str, tuple[bytes, Optional[float]]] = {}
+
+    def _alive(self, key: str) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[1] is not None and item[1] <= self.clock:
+            del self._data[key]
+            return False
+        return True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._data[key][0] if self._alive(key) else None
+
+    async def set(self, key: str, value: Any, nx: bool = False, px: Optional[int] = None) -> Optional[bool]:
+        if nx and self._alive(key):
+            return None
+        raw = value.encode("utf-8") if isinstance(value, str) else value
+        self._data[key] = (raw, self.clock + px / 1000.0 if px else None)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+
+@pytest.fixture
+def fake_redis():
+    client = FakeRedis()
+    ttl_cache.set_backend(RedisCacheBackend(client=client))
+    yield client
+    ttl_cache.set_backend(None)
+
+
+def test_redis_backend_roundtrip_and_ttl():
+    """Redis バックエンドは JSON で保存し、TTL を過ぎた値は返さない"""
+    client = FakeRedis()
+    backend = RedisCacheBackend(client=client)
+    value = {"request_id": "r1", "route": {"polyline": "abc", "distance_km": 2.0}}
+
+    async def scenario():
+        await backend.set("k", value, ttl_sec=10.0)
+        assert await backend.get("k") == value
+        client.clock = 10.5
+        assert await backend.get("k") is None
+
+    asyncio.run(scenario())
+
+
+def test_redis_lease_is_exclusive_until_release():
+    """リースは1人だけが取得でき、他人のトークンでは解放されない"""
+    backend = RedisCacheBackend(client=FakeRedis())
+
+    async def scenario():
+        token = await backend.acquire_lease("k", ttl_sec=30.0)
+        assert token
+        assert await backend.acquire_lease("k", ttl_sec=30.0) is None
+        await backend.release_lease("k", "someone-else")
+        assert await backend.acquire_lease("k", ttl_sec=30.0) is None
+        await backend.release_lease("k", token)
+        assert await backend.acquire_lease("k", ttl_sec=30.0)
+
+    asyncio.run(scenario())
+
+
+def test_redis_lease_expires():
+    """保持者が落ちてもリースは TTL で失効し、期限切れ後の旧トークンでは新しいリースを消さない"""
+    client = FakeRedis()
+    backend = RedisCacheBackend(client=client)
+
+    async def scenario():
+        stale_token = await backend.acquire_lease("k", ttl_sec=5.0)
+        client.clock = 5.1
+        new_token = await backend.acquire_lease("k", ttl_sec=5.0)
+        assert new_token and new_token != stale_token
+        await backend.release_lease("k", stale_token)
+        assert await backend.acquire_lease("k", ttl_sec=5.0) is None
+
+    asyncio.run(scenario())
+
+
+def test_two_tier_fills_l1_from_l2_and_leases_on_l2():
+    """L2 ヒットは L1 に書き戻し、リースは L2（共有ストア）で取る"""
+    l2_client = FakeRedis()
+    l2 = RedisCacheBackend(client=l2_client)
+    l1 = InMemoryCacheBackend(maxsize=8, ttl_sec=60.0)
+    tiered = TwoTierCacheBackend(l1=l1, l2=l2, l1_ttl_sec=60.0)
+    value = {"kind": "ok", "stored_at": 1.0, "response": {"request_id": "r1"}}
+
+    async def scenario():
+        await l2.set("k", value, ttl_sec=60.0)
+        assert await l1.get("k") is None
+        assert await tiered.get("k") == value
+        assert await l1.get("k") == value
+
+        token = await tiered.acquire_lease("k", ttl_sec=30.0)
+        assert token
+        # 別インスタンス（L1 は別、L2 は共有）からはリースを取れない
+        other = TwoTierCacheBackend(l1=InMemoryCacheBackend(maxsize=8, ttl_sec=60.0), l2=l2, l1_ttl_sec=60.0)
+        assert await other.acquire_lease("k", ttl_sec=30.0) is None
+        await tiered.release_lease("k", token)
+        assert await other.acquire_lease("k", ttl_sec=30.0)
+
+    asyncio.run(scenario())
+
+
+def test_wait_for_leader_returns_leader_result(fake_redis, monkeypatch):
+    """リース保持者が結果を保存すれば、待機側はそれを受け取る"""
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_WAIT_SEC", 2.0)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_POLL_SEC", 0.01)
+    response = {"request_id": "leader", "route": {"polyline": "abc"}}
+
+    async def leader():
+        token = await ttl_cache.acquire_lease("k")
+        assert token
+        await asyncio.sleep(0.05)
+        await ttl_cache.cache_set("k", response)
+        await ttl_cache.release_lease("k", token)
+
+    async def scenario():
+        task = asyncio.create_task(leader())
+        await asyncio.sleep(0)
+        assert await ttl_cache.acquire_lease("k") is None
+        entry = await ttl_cache.wait_for_leader("k")
+        await task
+        return entry
+
+    entry = asyncio.run(scenario())
+    assert entry is not None and entry.fresh
+    assert entry.response == response
+
+
+def test_wait_for_leader_gives_up_after_wait(fake_redis, monkeypatch):
+    """結果が入らなければ GENERATE_CACHE_LEASE_WAIT_SEC で諦めて None を返す"""
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_WAIT_SEC", 0.1)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_POLL_SEC", 0.02)
+
+    t0 = time.perf_counter()
+    assert asyncio.run(ttl_cache.wait_for_leader("missing")) is None
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_stale_refresh_uses_synthetic_request_id_without_bq(monkeypatch):
+    """stale の裏での再生成は別の request_id で行い、BigQuery には記録しない"""
+    from app import main
+    from app.schemas import GenerateRouteRequest, LatLng
+
+    calls = []
+
+    async def fake_run_generate_graph(req, log_to_bq=True):
+        calls.append((req.request_id, log_to_bq))
+        raise RuntimeError("upstream unavailable")
+
+    monkeypatch.setattr(main, "run_generate_graph", fake_run_generate_graph)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", False)
+    req = GenerateRouteRequest(
+        request_id="served-request",
+        theme="think",
+        distance_km=3.0,
+        start_location=LatLng(lat=35.681, lng=139.767),
+        round_trip=True,
+    )
+
+    async def scenario():
+        main._schedule_refresh(req, "gen:v1:test", "test")
+        await asyncio.gather(*main._refresh_tasks)
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    request_id, log_to_bq = calls[0]
+    assert request_id.startswith("cache-refresh-") and request_id != req.request_id
+    assert log_to_bq is False
+
+
+def _cached_round_trip_response(origin, waypoints):
+    import polyline as polyline_lib
+
+    from app.schemas import GenerateRouteResponse
+
+    points = [origin] + waypoints + [origin]
+    return GenerateRouteResponse(
+        request_id="original-request",
+        route={
+            "route_id": "route-1",
+            "polyline": polyline_lib.encode(points),
+            "distance_km": 3.0,
+            "duration_min": 45,
+            "title": "散歩ルート",
+            "summary": "近所を一周するルートです。",
+            "nav_waypoints": [{"lat": lat, "lng": lng} for lat, lng in points],
+        },
+        meta={
+            "fallback_used": False,
+            "tools_used": [],
+            "route_quality": {"is_fallback": False, "distance_match": 1.0, "distance_error_km": 0.0},
+        },
+    )
+
+
+def test_reanchor_round_trip_replaces_first_and_last_waypoint():
+    """近傍キャッシュの周回ルートは、nav_waypoints の先頭と末尾の両方を呼び出し側の出発地点にする"""
+    from app.graph import reanchor_response_start
+    from app.schemas import GenerateRouteRequest, LatLng
+    from app.services import polyline
+
+    origin = (35.68100, 139.76700)
+    cached = _cached_round_trip_response(origin, [(35.68500, 139.77000), (35.68300, 139.77400)])
+    req = GenerateRouteRequest(
+        request_id="nearby-request",
+        theme="think",
+        distance_km=3.0,
+        start_location=LatLng(lat=35.68130, lng=139.76650),
+        round_trip=True,
+    )
+
+    out = reanchor_response_start(cached, req)
+    start = (req.start_location.lat, req.start_location.lng)
+    assert out.request_id == "nearby-request"
+    assert (out.route.nav_waypoints[0].lat, out.route.nav_waypoints[0].lng) == start
+    assert (out.route.nav_waypoints[-1].lat, out.route.nav_waypoints[-1].lng) == start
+    assert [(p.lat, p.lng) for p in out.route.nav_waypoints[1:-1]] == [
+        (p.lat, p.lng) for p in cached.route.nav_waypoints[1:-1]
+    ]
+    decoded = polyline.decode_polyline(out.route.polyline)
+    assert decoded[0] == start and decoded[-1] == start
+    # 元のキャッシュ済みレスポンスは変更しない
+    assert (cached.route.nav_waypoints[-1].lat, cached.route.nav_waypoints[-1].lng) == origin
+
+
+def test_reanchor_one_way_keeps_last_waypoint():
+    """片道ルートでは nav_waypoints の末尾（目的地）は差し替えない"""
+    from app.graph import reanchor_response_start
+    from app.schemas import GenerateRouteRequest, LatLng
+
+    origin = (35.68100, 139.76700)
+    cached = _cached_round_trip_response(origin, [(35.68500, 139.77000)])
+    req = GenerateRouteRequest(
+        request_id="nearby-request",
+        theme="think",
+        distance_km=3.0,
+        start_location=LatLng(lat=35.68130, lng=139.76650),
+        end_location=LatLng(lat=origin[0], lng=origin[1]),
+        round_trip=False,
+    )
+
+    out = reanchor_response_start(cached, req)
+    assert (out.route.nav_waypoints[0].lat, out.route.nav_waypoints[0].lng) == (35.68130, 139.76650)
+    assert (out.route.nav_waypoints[-1].lat, out.route.nav_waypoints[-1].lng) == origin
+
+
+def test_candidate_pool_lookup_is_deterministic_and_checks_origin(monkeypatch):
+    """同じ入力には同じ候補を同じ順序で返し、プールの出発地点から遠いリクエストにはプールを使わない"""
+    from app.services import candidate_pool
+
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_ENABLED", True)
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_MAX_ORIGIN_M", 100.0)
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_TILE_M", 1000.0)
+    candidate_pool.clear()
+    origin = (35.68100, 139.76700)
+    key = candidate_pool.build_key(lat=origin[0], lng=origin[1], theme="think", distance_km=3.0)
+    candidate_pool.store(key, [{"polyline": f"route-{i}"} for i in range(10)], origin=origin)
+    try:
+        picks = [
+            candidate_pool.lookup(lat=origin[0], lng=origin[1], theme="think", distance_km=3.0, limit=4)
+            for _ in range(5)
+        ]
+        assert all(p == picks[0] for p in picks)
+        assert len(picks[0]) == 4
+        names = [c["polyline"] for c in picks[0]]
+        assert names == sorted(names, key=lambda n: int(n.split("-")[1]))
+
+        # 同じタイル内でも 100m 以上離れていればミス（約110m東）
+        far_lng = origin[1] + 0.0012
+        assert candidate_pool.build_key(lat=origin[0], lng=far_lng, theme="think", distance_km=3.0) == key
+        assert candidate_pool.lookup(lat=origin[0], lng=far_lng, theme="think", distance_km=3.0, limit=4) is None
+        assert candidate_pool.get_stats()["far_origin"] == 1
+    finally:
+        candidate_pool.clear()
+
+
+def test_pooled_candidates_start_at_request_origin():
+    """プールの候補は polyline の先頭・末尾をリクエストの出発地点に付け替え、距離を伸ばす"""
+    import polyline as polyline_lib
+
+    from app.graph import _anchor_pooled_candidates
+    from app.schemas import GenerateRouteRequest, LatLng
+    from app.services import polyline
+
+    pool_origin = (35.68100, 139.76700)
+    route = [pool_origin, (35.68500, 139.77000), (35.68300, 139.77400), pool_origin]
+    pooled = [{"polyline": polyline_lib.encode(route), "distance_km": 2.0, "duration_min": 30.0}]
+    req = GenerateRouteRequest(
+        request_id="pool-request",
+        theme="think",
+        distance_km=2.0,
+        start_location=LatLng(lat=35.68150, lng=139.76650),
+        round_trip=True,
+    )
+
+    out = _anchor_pooled_candidates(pooled, req)[0]
+    decoded = polyline.decode_polyline(out["polyline"])
+    assert decoded[0] == (35.6815, 139.7665) and decoded[-1] == (35.6815, 139.7665)
+    assert decoded[1:-1] == route
+    assert out["distance_km"] > 2.0 and out["duration_min"] > 30.0
+    assert pooled[0]["distance_km"] == 2.0
+
+
+def test_pooled_candidates_rank_like_live_generation(monkeypatch):
+    """プールのヒット時の寄り道超過は付け替え後の polyline で計算し、同じルートを生成した場合と一致する"""
+    import polyline as polyline_lib
+
+    from app import graph
+    from app.schemas import GenerateRouteRequest, LatLng
+    from app.services import candidate_pool, places_client
+
+    pool_origin = (35.68100, 139.76700)
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_ENABLED", True)
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_ORIGINS", f"{pool_origin[0]},{pool_origin[1]}")
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_THEMES", "nature")
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_DISTANCES_KM", "3")
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_TILE_M", 1000.0)
+    monkeypatch.setattr(settings, "CANDIDATE_POOL_ROUNDS", 1)
+    # 周回ルートはプールの出発地点から始まり、西側に円を描く
+    points = _loop_points((pool_origin[0], pool_origin[1] - 0.004), 0.004, 40)
+    points.append(points[0])
+    loop = {"polyline": polyline_lib.encode(points), "distance_km": 3.0, "duration_min": 45.0}
+    # 出発地点の東（約270m）と円の西端のスポット
+    spots = [
+        {"name": "east", "type": "park", "lat": pool_origin[0], "lng": pool_origin[1] + 0.003},
+        {"name": "west", "type": "cafe", "lat": pool_origin[0], "lng": pool_origin[1] - 0.008},
+    ]
+    calls = []
+
+    async def fake_search_spots(**kwargs):
+        calls.append(kwargs)
+        return [dict(p) for p in spots]
+
+    async def fake_generate(state):
+        return {"candidates": [dict(loop)]}
+
+    real_generate = graph.generate_candidates_routes
+    monkeypatch.setattr(places_client, "search_spots", fake_search_spots)
+    monkeypatch.setattr(graph, "generate_candidates_routes", fake_generate)
+    candidate_pool.clear()
+    try:
+        assert asyncio.run(graph.warm_candidate_pool())["stored"] == 1
+        searched = len(calls)
+
+        # プールの出発地点から約80m東のリクエスト
+        req = GenerateRouteRequest(
+            request_id="pool-hit",
+            theme="nature",
+            distance_km=3.0,
+            start_location=LatLng(lat=pool_origin[0], lng=pool_origin[1] + 0.0009),
+            round_trip=True,
+        )
+
+        async def features_for(candidates):
+            state = graph._init_state(req)
+            state["candidates"] = candidates
+            out = await graph.compute_features(state)
+            return out["candidates_features"][0]["features"]
+
+        async def scenario():
+            state = graph._init_state(req)
+            hit = await real_generate(state)
+            assert "pool_features" in hit["candidates"][0]
+            pooled = await features_for(hit["candidates"])
+            assert len(calls) == searched
+            anchored = {k: v for k, v in hit["candidates"][0].items() if k != "pool_features"}
+            return pooled, await features_for([anchored]), await features_for([dict(loop)])
+
+        pooled, live, unanchored = asyncio.run(scenario())
+    finally:
+        candidate_pool.clear()
+
+    assert pooled["detour_over_ratio"] == pytest.approx(live["detour_over_ratio"])
+    assert pooled["detour_over_ratio"] < unanchored["detour_over_ratio"]
+    assert pooled["spot_type_diversity"] == pytest.approx(live["spot_type_diversity"])
+    assert pooled["distance_km"] == pytest.approx(live["distance_km"])
+    assert pooled["loop_closure_m"] == pytest.approx(live["loop_closure_m"])
+
+
+def test_feedback_sync_fallback_runs_off_the_event_loop(monkeypatch):
+    """ライター未起動時の同期書き込みはスレッドで行い、イベントループをブロックしない"""
+    import threading
+
+    from app import main
+    from app.schemas import FeedbackRequest
+    from app.services import bq_writer
+
+    written = []
+
+    def fake_insert_rows_sync(table, rows, row_ids=None):
+        written.append((table, len(rows), threading.current_thread() is threading.main_thread()))
+        return 0
+
+    monkeypatch.setattr(bq_writer, "_insert_rows_sync", fake_insert_rows_sync)
+    monkeypatch.setattr(settings, "BQ_WRITER_ENABLED", False)
+
+    resp = asyncio.run(main.post_feedback(FeedbackRequest(request_id="r1", route_id="route-1", rating=5)))
+    assert resp.request_id == "r1"
+    assert written == [(settings.BQ_TABLE_FEEDBACK, 1, False)]
+
+
+def test_embedded_ranker_start_stop_and_prefixed_settings(monkeypatch):
+    """embedded の Ranker は接頭辞付きの環境変数で設定し、lifespan 相当の start / shutdown で開始・停止する"""
+    import os
+    import sys
+
+    from app.services import ranker_embedded
+
+    monkeypatch.setenv("BQ_DATASET", "agent_dataset")
+    monkeypatch.setenv("RANKER_EMBEDDED_BQ_DATASET", "ranker_dataset")
+    monkeypatch.setattr(ranker_embedded, "_ranker_main", None)
+    monkeypatch.setattr(ranker_embedded, "_started", False)
+    ranker_env_before = {k: v for k, v in os.environ.items() if k.startswith("RANKER")}
+    try:
+        ranker_main = ranker_embedded.start()
+        assert ranker_main.settings.BQ_DATASET == "ranker_dataset"
+        # Ranker の各モジュールが同じ（接頭辞付きの）設定を参照し、プロセスの環境変数は変えない
+        assert sys.modules["firstdown_ranker.model_scoring"].settings is ranker_main.settings
+        assert sys.modules["firstdown_ranker.settings"].settings is ranker_main.settings
+        assert {k: v for k, v in os.environ.items() if k.startswith("RANKER")} == ranker_env_before
+        assert ranker_embedded.start() is ranker_main
+
+        calls = []
+        original_stop = ranker_main.stop
+        monkeypatch.setattr(ranker_main, "stop", lambda: (calls.append("stop"), original_stop()))
+        ranker_embedded.shutdown()
+        ranker_embedded.shutdown()
+        assert calls == ["stop"]
+    finally:
+        for name in [m for m in sys.modules if m == "firstdown_ranker" or m.startswith("firstdown_ranker.")]:
+            del sys.modules[name]
+
+
+def _loop_points(center, radius_deg, n):
+    import math
+
+    return [
+        (round(center[0] + radius_deg * math.sin(2 * math.pi * i / n), 5), round(center[1] + radius_deg * math.cos(2 * math.pi * i / n), 5))
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("start_offset_deg", [0.0, 0.001])
+def test_fetch_places_reuses_compute_features_searches(monkeypatch, start_offset_deg):
+    """選ばれたルートの fetch_places は compute_features の検索結果を使い回す（開始地点を補った周回ルートも）"""
+    import polyline as polyline_lib
+
+    from app import graph
+    from app.schemas import GenerateRouteRequest, LatLng
+    from app.services import places_client
+
+    calls = []
+
+    async def fake_search_spots(*, lat, lng, **kwargs):
+        calls.append((lat, lng, kwargs.get("keyword"), tuple(kwargs.get("included_types") or ())))
+        return [{"name": f"spot-{lat:.5f}-{lng:.5f}", "type": "park", "lat": lat, "lng": lng}]
+
+    monkeypatch.setattr(places_client, "search_spots", fake_search_spots)
+    points = _loop_points((35.68100, 139.76700), 0.004, 40)
+    points.append(points[0])
+    start = (round(points[0][0] + start_offset_deg, 5), round(points[0][1] - start_offset_deg, 5))
+    req = GenerateRouteRequest(
+        request_id="memo-request",
+        theme="nature",
+        distance_km=3.0,
+        start_location=LatLng(lat=start[0], lng=start[1]),
+        round_trip=True,
+    )
+    state = graph._init_state(req)
+    state["candidates"] = [{"polyline": polyline_lib.encode(points), "distance_km": 3.0, "duration_min": 45.0}]
+
+    async def scenario():
+        state.update(await graph.compute_features(state))
+        searched = len(calls)
+        assert searched > 0
+        state["best_route"] = state["candidates"][0]
+        state.update(await graph.sample_points_from_polyline(state))
+        if start_offset_deg:
+            assert polyline_lib.decode(state["best_route"]["polyline"])[0] == start
+        state.update(await graph.fetch_places(state))
+        assert len(calls) == searched
+
+    asyncio.run(scenario())
+
+
+def _reference_decode(encoded: str):
+    """ベクトル化前の decode_polyline（1文字ずつ読み、途中で切れた点は捨てる）"""
+    index = lat = lng = 0
+    coordinates = []
+    length = len(encoded)
+    while index < length:
+        values = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    return coordinates
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            values.append(~(result >> 1) if (result & 1) else (result >> 1))
+        lat += values[0]
+        lng += values[1]
+        coordinates.append((lat / 1e5, lng / 1e5))
+    return coordinates
+
+
+def _random_walk(rng, n, start=(35.681, 139.767), step_deg=0.0005):
+    lat, lng = start
+    points = [(lat, lng)]
+    for _ in range(n - 1):
+        lat += rng.uniform(-step_deg, step_deg)
+        lng += rng.uniform(-step_deg, step_deg)
+        points.append((round(lat, 5), round(lng, 5)))
+    return points
+
+
+def test_decode_matches_reference_on_random_and_extreme_paths():
+    """ベクトル化したデコードは polyline ライブラリ・従来の実装と一致する（負の差分・大きな差分を含む）"""
+    import random
+
+    import polyline as polyline_lib
+
+    from app.services import polyline
+
+    rng = random.Random(7)
+    paths = [_random_walk(rng, n) for n in (1, 2, 3, 50, 500)]
+    paths.append([(-89.99999, -179.99999), (89.99999, 179.99999), (0.0, 0.0), (-0.00001, 0.00001), (45.5, -120.25)])
+    paths.append([(round(rng.uniform(-90, 90), 5), round(rng.uniform(-180, 180), 5)) for _ in range(200)])
+    for points in paths:
+        encoded = polyline_lib.encode(points)
+        decoded = polyline.decode_polyline(encoded)
+        assert decoded == _reference_decode(encoded)
+        assert decoded == pytest.approx(polyline_lib.decode(encoded), abs=1e-9)
+        arr = polyline.decode_polyline_array(encoded)
+        assert arr.shape == (len(points), 2)
+        assert polyline.to_point_list(arr) == decoded
+    assert polyline.decode_polyline("") == []
+
+
+def test_decode_truncated_and_non_ascii_strings_match_reference():
+    """途中で切れた文字列・ASCII 以外を含む文字列は、従来どおり読めた点までを返す"""
+    import random
+
+    import polyline as polyline_lib
+
+    from app.services import polyline
+
+    encoded = polyline_lib.encode(_random_walk(random.Random(3), 20) + [(-33.86882, 151.20929)])
+    for cut in range(len(encoded) + 1):
+        assert polyline.decode_polyline(encoded[:cut]) == _reference_decode(encoded[:cut])
+    for broken in (encoded[:10] + "é" + encoded[10:], "ü" * 3, "_p~iF~ps|U_ulLnnqC_mqNvxq`@" + "\x7f" * 15):
+        assert polyline.decode_polyline(broken) == _reference_decode(broken)
+
+
+def test_extend_encoded_matches_full_encode():
+    """先頭・末尾を書き換えた polyline は、全点を polyline.encode した場合と同じ文字列になる"""
+    import random
+
+    import polyline as polyline_lib
+
+    from app.services import polyline
+
+    rng = random.Random(11)
+    head = (35.67912, 139.76543)
+    tail = (-35.67912, -139.76543)
+    for n in (1, 2, 30):
+        points = _random_walk(rng, n)
+        encoded = polyline_lib.encode(points)
+        arr = polyline.decode_polyline_array(encoded)
+        for h, t in ((head, None), (None, tail), (head, tail), (None, None)):
+            expected = ([h] if h else []) + points + ([t] if t else [])
+            assert polyline.extend_encoded(encoded, arr, head=h, tail=t) == polyline_lib.encode(expected)
+    # 途中で切れた文字列は、読めた点に head / tail を足して符号化し直す
+    encoded = polyline_lib.encode(_random_walk(rng, 5))[:-1]
+    arr = polyline.decode_polyline_array(encoded)
+    expected = [head] + polyline.to_point_list(arr) + [tail]
+    assert polyline.extend_encoded(encoded, arr, head=head, tail=tail) == polyline_lib.encode(expected)
+    assert polyline.extend_encoded("", polyline.decode_polyline_array(""), head=head, tail=tail) == polyline_lib.encode([head, tail])
+
+
+def test_decode_cache_is_scoped_per_request():
+    """デコード結果のキャッシュは decode_cache_scope の中（リクエスト単位）だけで共有される"""
+    import random
+
+    import polyline as polyline_lib
+
+    from app.services import polyline
+
+    encoded = polyline_lib.encode(_random_walk(random.Random(5), 40))
+    assert polyline.decode_polyline_array(encoded) is not polyline.decode_polyline_array(encoded)
+
+    async def decode_in_task():
+        return polyline.decode_polyline_array(encoded)
+
+    async def request_scope():
+        with polyline.decode_cache_scope():
+            first = polyline.decode_polyline_array(encoded)
+            assert polyline.decode_polyline_array(encoded) is first
+            # リクエストの中から作ったタスクでも共有される
+            assert await asyncio.create_task(decode_in_task()) is first
+            assert not first.flags.writeable
+            return first
+
+    async def scenario():
+        return await asyncio.gather(request_scope(), request_scope())
+
+    a, b = asyncio.run(scenario())
+    # 並行する別リクエストとは共有しない
+    assert a is not b and polyline.to_point_list(a) == polyline.to_point_list(b)
+    assert polyline.decode_polyline_array(encoded) is not a
+
+    with polyline.decode_cache_scope(maxsize=1):
+        other = polyline_lib.encode([(35.0, 139.0), (35.1, 139.1)])
+        first = polyline.decode_polyline_array(encoded)
+        polyline.decode_polyline_array(other)
+        # 保持件数を超えると古いものから捨てる
+        assert polyline.decode_polyline_array(encoded) is not first
+
+
+def _reference_haversine_m(a, b):
+    """配列化前の haversine（1組ずつ）"""
+    import math
+
+    phi1, phi2 = math.radians(a[0]), math.radians(b[0])
+    dphi = math.radians(b[0] - a[0])
+    dlambda = math.radians(b[1] - a[1])
+    h = math.sin(dphi / 2.0) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2.0) ** 2
+    return 2.0 * 6371000.0 * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _reference_point_segment_distance_m(p, a, b):
+    """配列化前の点と線分の距離（線分ごとに基準緯度を取る平面近似）"""
+    import math
+
+    if a == b:
+        return _reference_haversine_m(p, a)
+    lat0 = math.radians((a[0] + b[0]) / 2.0)
+    r = 6371000.0
+    ax, ay = math.radians(a[1]) * math.cos(lat0) * r, math.radians(a[0]) * r
+    bx, by = math.radians(b[1]) * math.cos(lat0) * r, math.radians(b[0]) * r
+    px, py = math.radians(p[1]) * math.cos(lat0) * r, math.radians(p[0]) * r
+    abx, aby, apx, apy = bx - ax, by - ay, px - ax, py - ay
+    ab_len2 = abx * abx + aby * aby
+    if ab_len2 <= 0.0:
+        return math.hypot(apx, apy)
+    t = max(0.0, min(1.0, (apx * abx + apy * aby) / ab_len2))
+    return math.hypot(px - (ax + t * abx), py - (ay + t * aby))
+
+
+def _reference_distance_to_path_m(points, point):
+    if not points:
+        return float("inf")
+    if len(points) == 1:
+        return _reference_haversine_m(points[0], point)
+    return min(_reference_point_segment_distance_m(point, points[i], points[i + 1]) for i in range(len(points) - 1))
+
+
+def _reference_simplify(points, epsilon_m=20.0):
+    """配列化前の Douglas–Peucker（区間ごとに全点を1つずつ測る）"""
+    if len(points) <= 2:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        max_dist, index = -1.0, None
+        for i in range(start + 1, end):
+            d = _reference_point_segment_distance_m(points[i], points[start], points[end])
+            if d > max_dist:
+                max_dist, index = d, i
+        if index is not None and max_dist > epsilon_m:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [p for i, p in enumerate(points) if keep[i]]
+
+
+def _fixed_polylines():
+    import random
+
+    rng = random.Random(21)
+    zigzag = [(35.681 + 0.0004 * (i % 2), 139.767 + 0.0003 * i) for i in range(40)]
+    return [
+        _random_walk(rng, 300),
+        _random_walk(rng, 1200, start=(43.06, 141.35), step_deg=0.0003),
+        zigzag,
+        _loop_points((35.68100, 139.76700), 0.004, 60),
+    ]
+
+
+def test_array_haversine_and_path_length_match_scalar():
+    """配列版の haversine・累積距離は従来の1組ずつの計算と一致する"""
+    import numpy as np
+
+    from app.services import polyline
+
+    for points in _fixed_polylines():
+        arr = np.asarray(points)
+        ref = points[len(points) // 3]
+        expected = [_reference_haversine_m(p, ref) for p in points]
+        assert polyline.haversine_m_array(arr, ref).tolist() == pytest.approx(expected, rel=1e-9, abs=1e-6)
+        assert [polyline.haversine_m(p, ref) for p in points] == pytest.approx(expected, rel=1e-9, abs=1e-6)
+
+        # 投影済み座標の線分長の累積は、haversine の累積と 0.1% 以内で一致する
+        seg_len = np.sqrt(polyline.PathGeometry(arr).seg_len2)
+        scalar_cum = np.cumsum([_reference_haversine_m(a, b) for a, b in zip(points, points[1:])])
+        np.testing.assert_allclose(np.cumsum(seg_len), scalar_cum, rtol=1e-3)
+
+
+def test_array_distance_and_simplify_match_scalar():
+    """点と経路の距離・Douglas–Peucker の結果は従来の実装と一致する"""
+    import random
+
+    import numpy as np
+
+    from app.services import polyline
+
+    rng = random.Random(4)
+    for points in _fixed_polylines():
+        spots = [(p[0] + rng.uniform(-0.003, 0.003), p[1] + rng.uniform(-0.003, 0.003)) for p in rng.sample(points, 20)]
+        expected = [_reference_distance_to_path_m(points, s) for s in spots]
+        assert polyline.distances_to_path(points, np.asarray(spots)).tolist() == pytest.approx(expected, abs=0.05)
+        assert [polyline.distance_to_path_m(points, s) for s in spots] == pytest.approx(expected, abs=0.05)
+        for epsilon_m in (5.0, 20.0, 60.0):
+            assert polyline.simplify_douglas_peucker(points, epsilon_m=epsilon_m) == _reference_simplify(points, epsilon_m)
+    assert polyline.simplify_douglas_peucker([(35.0, 139.0), (35.1, 139.1)]) == [(35.0, 139.0), (35.1, 139.1)]
+
+
+def _brute_force_distances(geometry, spots):
+    """全線分との距離を総当たりで測る（SegmentIndex を使わない）"""
+    import numpy as np
+
+    from app.services import polyline
+
+    pxy = polyline.to_local_xy(np.asarray(spots), geometry.lat0)
+    ap = pxy[:, None, :] - geometry.seg_a[None, :, :]
+    t = np.clip(np.einsum("msk,sk->ms", ap, geometry.seg_ab) / np.where(geometry.seg_len2 > 0, geometry.seg_len2, 1.0), 0.0, 1.0)
+    t = np.where(geometry.seg_len2 > 0, t, 0.0)
+    diff = ap - t[..., None] * geometry.seg_ab[None, :, :]
+    return np.sqrt(np.einsum("msk,msk->ms", diff, diff).min(axis=1))
+
+
+@pytest.mark.parametrize("n_points", [199, 200, 201, 1000])
+def test_segment_index_matches_brute_force(n_points):
+    """線分インデックスの距離は総当たりと一致する（バケット境界付近・経路から遠い点・閾値前後の点数）"""
+    import random
+
+    import numpy as np
+
+    from app.services import polyline
+
+    assert polyline.SEGMENT_INDEX_MIN_POINTS == 200
+    rng = random.Random(n_points)
+    points = _random_walk(rng, n_points, step_deg=0.0004)
+    geometry = polyline.PathGeometry.from_points(points)
+    chunk = polyline.SEGMENT_INDEX_CHUNK
+    spots = []
+    # バケット境界の頂点（前後のバケットの外接矩形が接する点）の周辺
+    for i in range(0, n_points, chunk):
+        lat, lng = points[i]
+        spots += [(lat, lng), (lat + 0.00002, lng - 0.00002), (lat - 0.0003, lng + 0.0003)]
+    # 経路のあちこちの近傍と、経路から数km〜数十km離れた点（近いバケットが無く探索範囲が広がる）
+    spots += [(p[0] + rng.uniform(-0.002, 0.002), p[1] + rng.uniform(-0.002, 0.002)) for p in rng.sample(points, 30)]
+    spots += [(35.681 + dlat, 139.767 + dlng) for dlat in (-0.3, 0.05, 0.4) for dlng in (-0.5, 0.07, 0.3)]
+    assert len(spots) * (n_points - 1) >= polyline.SEGMENT_INDEX_MIN_PAIRS
+
+    got = polyline.distances_to_path(geometry, np.asarray(spots))
+    assert (geometry._segment_index is not None) == (n_points >= polyline.SEGMENT_INDEX_MIN_POINTS)
+    np.testing.assert_allclose(got, _brute_force_distances(geometry, spots), rtol=1e-12, atol=1e-6)
+    # 従来の1点ずつの計算とも一致する（遠い点は線分ごとの基準緯度の違いで 0.01% 程度ずれる）
+    for s, d in zip(spots[::7], got[::7].tolist()):
+        assert d == pytest.approx(_reference_distance_to_path_m(points, s), rel=1e-4, abs=0.05)
+
+
+@pytest.mark.parametrize(
+    "offsets_m, kept",
+    [
+        ([10.0, 26.0, 34.0, 28.0, 70.0], [0, 1, 3]),  # 30m 以内が3件 → 最初の閾値で確定
+        ([20.0, 35.0, 56.0, 64.0, 90.0], [0, 1, 2]),  # 30m 以内が1件 → 60m に緩和
+        ([45.0, 116.0, 124.0, 200.0, None], [0, 1]),  # 60m 以内も1件 → 120m に緩和（緯度経度なしは除外）
+    ],
+)
+def test_fetch_places_tiers_match_per_tier_computation(monkeypatch, offsets_m, kept):
+    """距離を1回だけ計算して閾値ごとに絞った結果は、閾値ごとに距離を計算し直す従来の絞り込みと一致する"""
+    import polyline as polyline_lib
+
+    from app import graph
+    from app.schemas import GenerateRouteRequest, LatLng
+    from app.services import places_client
+
+    route = [(35.681, 139.760 + 0.001 * i) for i in range(16)]
+    spots = []
+    for i, offset in enumerate(offsets_m):
+        spot = {"name": f"spot-{i}", "type": f"type-{i}", "place_id": f"p{i}"}
+        if offset is not None:
+            spot.update(lat=35.681 + offset / 111195.0, lng=139.7615 + 0.0021 * i)
+        spots.append(spot)
+
+    async def fake_search_spots(**kwargs):
+        return list(spots) if kwargs.get("keyword") is None else []
+
+    def reference_filter(places, max_distance_m):
+        scored = [
+            (_reference_distance_to_path_m(route, (p["lat"], p["lng"])), p)
+            for p in places
+            if p.get("lat") is not None and p.get("lng") is not None
+        ]
+        scored = [(d, p) for d, p in scored if d <= max_distance_m]
+        scored.sort(key=lambda x: x[0])
+        return [p for _, p in scored[:5]]
+
+    monkeypatch.setattr(places_client, "search_spots", fake_search_spots)
+    req = GenerateRouteRequest(
+        request_id="tier-request",
+        theme="nature",
+        distance_km=1.5,
+        start_location=LatLng(lat=route[0][0], lng=route[0][1]),
+        end_location=LatLng(lat=route[-1][0], lng=route[-1][1]),
+        round_trip=False,
+    )
+    state = graph._init_state(req)
+    state["best_route"] = {"polyline": polyline_lib.encode(route), "distance_km": 1.5}
+    state.update(asyncio.run(graph.sample_points_from_polyline(state)))
+    out = asyncio.run(graph.fetch_places(state))
+
+    selected = graph._select_unique_types(spots, 5)
+    expected = reference_filter(selected, settings.SPOT_MAX_DISTANCE_M)
+    if len(expected) < 3:
+        expected = reference_filter(spots, settings.SPOT_MAX_DISTANCE_M_RELAXED)
+        if len(expected) < 3:
+            expected = reference_filter(spots, settings.SPOT_MAX_DISTANCE_M_FALLBACK)
+    assert [p["name"] for p in out["places"]] == [p["name"] for p in expected]
+    assert [p["name"] for p in expected] == [f"spot-{i}" for i in kept]
+
+
+def _local_path(xy_m, origin=(35.68, 139.76)):
+    """原点からの東・北のオフセット（m）の列を緯度経度 (N, 2) にする"""
+    import math
+
+    import numpy as np
+
+    r = 6371000.0
+    return np.asarray(
+        [
+            (origin[0] + math.degrees(y / r), origin[1] + math.degrees(x / (r * math.cos(math.radians(origin[0])))))
+            for x, y in xy_m
+        ]
+    )
+
+
+def _leg(a, b, step_m=50.0):
+    """a から b まで step_m 間隔の点（b は含まない）"""
+    import math
+
+    n = max(1, int(round(math.dist(a, b) / step_m)))
+    return [(a[0] + (b[0] - a[0]) * i / n, a[1] + (b[1] - a[1]) * i / n) for i in range(n)]
+
+
+def test_route_geometry_straight_line():
+    from app.services.feature_calc import route_geometry
+
+    g = route_geometry(_local_path(_leg((0, 0), (1000, 0)) + [(1000, 0)]))
+    assert g.loop_closure_m == pytest.approx(1000.0, abs=1.0)
+    assert g.bbox_area == pytest.approx(0.0, abs=1e-6)
+    assert g.path_length_ratio == pytest.approx(1.0, abs=1e-6)
+    assert g.turn_count == 0
+    assert g.self_overlap_ratio == 0.0
+    assert g.straightness == pytest.approx(1.0)
+
+
+def test_route_geometry_square_loop():
+    from app.services.feature_calc import route_geometry
+
+    corners = [(0, 0), (500, 0), (500, 500), (0, 500), (0, 0)]
+    points = [p for a, b in zip(corners, corners[1:]) for p in _leg(a, b)] + [corners[-1]]
+    g = route_geometry(_local_path(points))
+    assert g.loop_closure_m == pytest.approx(0.0, abs=1e-6)
+    assert g.bbox_area == pytest.approx(0.25, rel=1e-3)  # 500m × 500m = 0.25 km²
+    # 経路長 2000m ÷（始点→対角 707m →終点 707m）
+    assert g.path_length_ratio == pytest.approx(2000.0 / (2 * 500.0 * 2**0.5), rel=1e-3)
+    assert g.turn_count == 3  # 終点（始点）は曲がった先の線分が無いので数えない
+    assert g.self_overlap_ratio < 0.05  # 始点のマスに戻る分だけ
+    # 角の直後の3本（50m）だけが直進でない
+    assert g.straightness == pytest.approx((2000.0 - 3 * 50.0) / 2000.0, rel=1e-3)
+
+
+def test_route_geometry_out_and_back():
+    from app.services.feature_calc import route_geometry
+
+    points = _leg((0, 0), (1000, 0)) + _leg((1000, 0), (0, 0)) + [(0, 0)]
+    g = route_geometry(_local_path(points))
+    assert g.loop_closure_m == pytest.approx(0.0, abs=1e-6)
+    assert g.path_length_ratio == pytest.approx(1.0, abs=1e-6)
+    assert g.turn_count == 1
+    # 折り返し地点の近く（OVERLAP_GAP_M 以内）を除き、行きも帰りも重複区間
+    assert g.self_overlap_ratio == pytest.approx(1.0, abs=0.05)
+
+
+def test_route_geometry_ignores_jitter_segments():
+    """5m 未満の短い線分の向きは曲がり角・直進の判定に使わない"""
+    from app.services.feature_calc import TURN_MIN_SEGMENT_M, route_geometry
+
+    points = []
+    for i in range(101):
+        points.append((i * 10.0, 0.0))
+        if i % 5 == 2:
+            # 北東に約2m 振れてから戻る（振れた線分は 45° 曲がっているが短い）
+            points.append((i * 10.0 + 1.5, 1.5))
+    assert (1.5**2 * 2) ** 0.5 < TURN_MIN_SEGMENT_M
+    g = route_geometry(_local_path(points))
+    assert g.turn_count == 0
+    assert g.straightness == pytest.approx(1.0)
+    assert g.path_length_ratio == pytest.approx(1.0, abs=0.02)
+
+    # 同じ振れでも線分が長ければ曲がり角として数える
+    zigzag = [(i * 20.0, 20.0 * (i % 2)) for i in range(11)]
+    assert route_geometry(_local_path(zigzag)).turn_count == 9
+
+
+def test_candidate_geometry_empty_polylines():
+    from app.services.feature_calc import EMPTY_GEOMETRY, candidate_geometry
+
+    assert candidate_geometry(None) == EMPTY_GEOMETRY
+    assert candidate_geometry("xxxx") == EMPTY_GEOMETRY
+    assert candidate_geometry("_p~iF~ps|U") == EMPTY_GEOMETRY  # 1点のみ
+
+
+def test_cache_miss_does_not_join_in_flight_refresh(fake_redis, monkeypatch):
+    """裏での再生成が進行中でも、キャッシュミスしたユーザーのリクエストは自分の request_id で生成して BigQuery に記録する"""
+    from app import main
+    from app.schemas import GenerateRouteRequest, LatLng
+
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_PROXIMITY_ENABLED", False)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_WAIT_SEC", 0.5)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_POLL_SEC", 0.01)
+    calls = []
+
+    async def scenario():
+        refresh_started = asyncio.Event()
+        release_refresh = asyncio.Event()
+
+        async def fake_run_generate_graph(req, log_to_bq=True):
+            calls.append((req.request_id, log_to_bq))
+            if not log_to_bq:
+                refresh_started.set()
+                await release_refresh.wait()
+            origin = (req.start_location.lat, req.start_location.lng)
+            return _cached_round_trip_response(origin, [(35.685, 139.770)]).model_copy(
+                update={"request_id": req.request_id}
+            )
+
+        monkeypatch.setattr(main, "run_generate_graph", fake_run_generate_graph)
+        req = GenerateRouteRequest(
+            request_id="stale-request",
+            theme="think",
+            distance_km=3.0,
+            start_location=LatLng(lat=35.681, lng=139.767),
+            round_trip=True,
+        )
+        key = main.build_cache_key(req)
+        main._schedule_refresh(req, key, main.cache_key_prefix(key))
+        await refresh_started.wait()
+
+        # 再生成の途中でキャッシュミスしたユーザー
+        user_req = req.model_copy(update={"request_id": "user-request"})
+        response = await asyncio.wait_for(main.generate(user_req), timeout=5.0)
+        assert response.request_id == "user-request"
+
+        release_refresh.set()
+        await asyncio.gather(*main._refresh_tasks)
+
+    asyncio.run(scenario())
+    refresh_calls = [c for c in calls if c[0].startswith("cache-refresh-")]
+    assert refresh_calls == [(refresh_calls[0][0], False)]
+    assert ("user-request", True) in calls
+
+
+def test_single_flight_shares_one_execution():
+    """同じキーの並行呼び出しは1回だけ実行し、全員が同じ結果を受け取る（完了後は表から消える）"""
+    from app.services.ttl_cache import SingleFlight
+
+    flight = SingleFlight()
+    executions = []
+
+    async def work():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run("k", work) for _ in range(10)))
+        assert flight.stats()["in_flight"] == 0 and not flight.in_flight("k")
+        return results
+
+    results = asyncio.run(scenario())
+    assert len(executions) == 1
+    assert [r for r, _ in results] == ["result"] * 10
+    assert sorted(shared for _, shared in results) == [False] + [True] * 9
+    assert flight.stats()["started"] == 1 and flight.stats()["coalesced"] == 9
+
+
+def test_single_flight_propagates_exception_and_clears_entry():
+    """例外も全員に伝わり、失敗後は表から消えて次の呼び出しで再実行される"""
+    from app.services.ttl_cache import SingleFlight
+
+    flight = SingleFlight()
+    executions = []
+
+    async def failing():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.stats() == {"in_flight": 0, "waiters": 0, "started": 1, "coalesced": 2}
+        with pytest.raises(ValueError):
+            await flight.run("k", failing)
+
+    asyncio.run(scenario())
+    assert len(executions) == 2
+
+
+def test_single_flight_cancelled_waiter_does_not_cancel_others():
+    """待ち手の1人がキャンセルされても、残りの待ち手と共有タスクは続く"""
+    from app.services.ttl_cache import SingleFlight
+
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 42
+
+        first = asyncio.create_task(flight.run("k", work))
+        second = asyncio.create_task(flight.run("k", work))
+        await asyncio.sleep(0)
+        assert flight.stats()["waiters"] == 2
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert first.cancelled()
+        assert flight.in_flight("k") and flight.stats()["waiters"] == 1
+        release.set()
+        assert await second == (42, True)
+        await asyncio.sleep(0)
+        assert not flight.in_flight("k")
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_cancels_shared_task_when_last_waiter_leaves():
+    """待ち手が全員いなくなれば共有タスクもキャンセルし、表から消す"""
+    from app.services.ttl_cache import SingleFlight
+
+    flight = SingleFlight()
+
+    async def scenario():
+        work_cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                work_cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.run("k", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(work_cancelled.wait(), timeout=1.0)
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def clean_places_cache():
+    from app.services import places_cache
+
+    places_cache.clear()
+    yield places_cache
+    places_cache.clear()
+
+
+def _places_key(places_cache, lat, lng, **overrides):
+    kwargs = dict(
+        lat=lat,
+        lng=lng,
+        theme="nature",
+        radius_m=800,
+        max_results=3,
+        included_types=None,
+        keyword=None,
+        allow_unfiltered_fallback=True,
+    )
+    kwargs.update(overrides)
+    return places_cache.build_key(**kwargs)
+
+
+def test_places_cache_tiles_share_keys_within_a_tile(clean_places_cache, monkeypatch):
+    """同じタイル内の検索中心は同じキーになり、隣のタイルとは別のキーになる"""
+    import math
+
+    places_cache = clean_places_cache
+    monkeypatch.setattr(settings, "PLACES_CACHE_TILE_M", 150.0)
+    dlat = 150.0 / places_cache._METERS_PER_DEG_LAT
+    lat_idx, lng_idx = places_cache.snap_to_tile(35.681, 139.767, 150.0)
+    lat_lo = lat_idx * dlat
+    # タイルの南端・北端のすぐ内側は同じ行、越えると隣の行（経度の幅は行ごとに変わるので行番号だけ比べる）
+    assert places_cache.snap_to_tile(lat_lo + 1e-7, 139.767, 150.0)[0] == lat_idx
+    assert places_cache.snap_to_tile(lat_lo + dlat - 1e-7, 139.767, 150.0)[0] == lat_idx
+    assert places_cache.snap_to_tile(lat_lo + dlat + 1e-7, 139.767, 150.0)[0] == lat_idx + 1
+    assert places_cache.snap_to_tile(lat_lo - 1e-7, 139.767, 150.0)[0] == lat_idx - 1
+    # 経度方向はタイル行の中心緯度で幅を補正した約150m
+    row_lat = (lat_idx + 0.5) * dlat
+    dlng = 150.0 / (places_cache._METERS_PER_DEG_LAT * math.cos(math.radians(row_lat)))
+    lng_lo = lng_idx * dlng
+    assert places_cache.snap_to_tile(row_lat, lng_lo + 1e-7, 150.0) == (lat_idx, lng_idx)
+    assert places_cache.snap_to_tile(row_lat, lng_lo + dlng - 1e-7, 150.0) == (lat_idx, lng_idx)
+    assert places_cache.snap_to_tile(row_lat, lng_lo + dlng + 1e-7, 150.0) == (lat_idx, lng_idx + 1)
+
+    center = (row_lat, lng_lo + dlng / 2)
+    key = _places_key(places_cache, *center)
+    assert _places_key(places_cache, center[0] + dlat * 0.3, center[1]) == key
+    assert _places_key(places_cache, center[0] + dlat, center[1]) != key
+    # 半径は PLACES_CACHE_RADIUS_BUCKET_M 単位に切り上げ、タイプ・キーワードは区別する
+    assert _places_key(places_cache, *center, radius_m=750) == key
+    assert _places_key(places_cache, *center, radius_m=850) != key
+    assert _places_key(places_cache, *center, keyword="hidden") != key
+    assert _places_key(places_cache, *center, theme="think") != key
+    assert _places_key(places_cache, *center, included_types=["park", "cafe"]) == _places_key(
+        places_cache, *center, included_types=["cafe", "park"]
+    )
+
+
+def test_places_cache_ttl_expiry_and_stats(clean_places_cache, monkeypatch):
+    """TTL を過ぎたエントリはミスになり、ヒット・ミス・保存・空結果のスキップを数える"""
+    import time
+
+    places_cache = clean_places_cache
+    monkeypatch.setattr(settings, "PLACES_CACHE_TTL_SEC", 0.05)
+    key = _places_key(places_cache, 35.681, 139.767)
+    assert places_cache.cache_get(key) is None
+    places_cache.cache_set(key, [{"name": "公園", "type": "park"}])
+    places_cache.cache_set(_places_key(places_cache, 36.0, 140.0), [])
+    hit = places_cache.cache_get(key)
+    assert hit == [{"name": "公園", "type": "park"}]
+    # 返り値を書き換えてもキャッシュの中身は変わらない
+    hit[0]["name"] = "changed"
+    assert places_cache.cache_get(key)[0]["name"] == "公園"
+    stats = places_cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"], stats["skipped_empty"]) == (2, 1, 1, 1)
+    assert stats["entries"] == 1 and stats["bytes"] > 0 and stats["hit_ratio"] == pytest.approx(2 / 3)
+
+    time.sleep(0.1)
+    assert places_cache.cache_get(key) is None
+    assert places_cache.get_stats()["misses"] == 2
+
+
+def test_places_cache_evicts_least_recently_used_by_bytes(clean_places_cache, monkeypatch):
+    """バイト数の予算を超えると、最も長く使われていないエントリから追い出す"""
+    places_cache = clean_places_cache
+    value = [{"name": "x" * 100, "type": "park"}]
+    entry_bytes = places_cache._entry_size(value)
+    monkeypatch.setattr(settings, "PLACES_CACHE_MAX_BYTES", entry_bytes * 3)
+    keys = [_places_key(places_cache, 35.0 + i * 0.01, 139.0) for i in range(4)]
+    for key in keys[:3]:
+        places_cache.cache_set(key, value)
+    assert places_cache.get_stats()["bytes"] == entry_bytes * 3
+    # keys[0] を使ったので、次の保存で追い出されるのは keys[1]
+    assert places_cache.cache_get(keys[0]) is not None
+    places_cache.cache_set(keys[3], value)
+    assert places_cache.cache_get(keys[1]) is None
+    assert all(places_cache.cache_get(k) is not None for k in (keys[0], keys[2], keys[3]))
+    assert places_cache.get_stats()["bytes"] <= entry_bytes * 3
+    # 1件で予算を超えるエントリは保存しない
+    places_cache.cache_set(_places_key(places_cache, 34.0, 139.0), [{"name": "y" * entry_bytes * 3}])
+    assert places_cache.get_stats()["entries"] == 3
+
+
+class FakeRoutes:
+    """maps_routes_client の compute_route_dests / compute_route_candidate の代替（目的地ごとの遅延・失敗を指定する）"""
+
+    def __init__(self, n_dests: int, delays: Optional[Dict[int, float]] = None, failures: Optional[Dict[int, Any]] = None):
+        import polyline as polyline_lib
+
+        self.n_dests = n_dests
+        self.delays = delays or {}
+        self.failures = failures or {}
+        self.polyline = polyline_lib.encode([(35.681, 139.767), (35.690, 139.770), (35.681, 139.767)])
+        self.active = 0
+        self.max_active = 0
+        self.started: list = []
+        self.cancelled: list = []
+
+    def compute_route_dests(self, **kwargs):
+        return [{"label": f"dest-{i}"} for i in range(1, self.n_dests + 1)]
+
+    async def compute_route_candidate(self, *, idx, **kwargs):
+        self.started.append(idx)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(idx, 0.0))
+            failure = self.failures.get(idx)
+            if isinstance(failure, BaseException):
+                raise failure
+            if failure == "none":
+                return None
+            return {"route_id": f"route-{idx}", "polyline": self.polyline, "distance_km": 5.0, "duration_min": 70.0}
+        except asyncio.CancelledError:
+            self.cancelled.append(idx)
+            raise
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def fake_routes(monkeypatch):
+    from app.services import maps_routes_client
+
+    monkeypatch.setattr(settings, "MAX_ROUTES", 5)
+    monkeypatch.setattr(settings, "MIN_ROUTES", 2)
+    monkeypatch.setattr(settings, "ROUTES_CONCURRENCY", 5)
+    monkeypatch.setattr(settings, "ROUTE_DISTANCE_RETRY_MAX", 0)
+    # 既定では早期終了しない（スコアは最大でも 1.15）
+    monkeypatch.setattr(settings, "SCORE_THRESHOLD", 10.0)
+
+    def install(routes: FakeRoutes) -> FakeRoutes:
+        monkeypatch.setattr(maps_routes_client, "compute_route_dests", routes.compute_route_dests)
+        monkeypatch.setattr(maps_routes_client, "compute_route_candidate", routes.compute_route_candidate)
+        return routes
+
+    return install
+
+
+def _routes_state():
+    from app import graph
+    from app.schemas import GenerateRouteRequest, LatLng
+
+    req = GenerateRouteRequest(
+        request_id="routes-request",
+        theme="exercise",
+        distance_km=5.0,
+        start_location=LatLng(lat=35.681, lng=139.767),
+        round_trip=True,
+    )
+    state = graph._init_state(req)
+    state["candidate_pool_bypass"] = True
+    return state
+
+
+def test_routes_fan_out_stops_early_and_cancels_the_rest(fake_routes, monkeypatch):
+    """MIN_ROUTES 本が閾値を超えた時点で打ち切り、残りの呼び出しはキャンセルする"""
+    from app import graph
+
+    monkeypatch.setattr(settings, "SCORE_THRESHOLD", 0.5)
+    routes = fake_routes(FakeRoutes(5, delays={1: 0.01, 2: 0.02, 3: 10.0, 4: 10.0, 5: 10.0}))
+    t0 = time.perf_counter()
+    out = asyncio.run(graph.generate_candidates_routes(_routes_state()))
+    assert time.perf_counter() - t0 < 2.0
+    assert out["routes_api_status"] == "ok"
+    assert [c["route_id"] for c in out["candidates"]] == ["route-1", "route-2"]
+    assert sorted(routes.cancelled) == [3, 4, 5]
+    assert routes.active == 0
+
+
+def test_routes_fan_out_respects_concurrency_limit(fake_routes, monkeypatch):
+    from app import graph
+
+    monkeypatch.setattr(settings, "ROUTES_CONCURRENCY", 2)
+    routes = fake_routes(FakeRoutes(5, delays={i: 0.02 for i in range(1, 6)}))
+    out = asyncio.run(graph.generate_candidates_routes(_routes_state()))
+    assert len(out["candidates"]) == 5
+    assert routes.max_active == 2
+
+
+def test_routes_fan_out_orders_candidates_by_destination(fake_routes):
+    """完了順に関係なく、候補は目的地の順に並ぶ"""
+    from app import graph
+
+    routes = fake_routes(FakeRoutes(5, delays={i: (6 - i) * 0.01 for i in range(1, 6)}))
+    out = asyncio.run(graph.generate_candidates_routes(_routes_state()))
+    assert [c["route_id"] for c in out["candidates"]] == [f"route-{i}" for i in range(1, 6)]
+    assert routes.max_active == 5
+
+
+def test_routes_fan_out_failures_keep_other_candidates_and_fall_back(fake_routes):
+    """タイムアウト・失敗した呼び出しは除いて残りの候補を返し、全滅ならダミー候補にフォールバックする"""
+    import httpx
+
+    from app import graph
+
+    fake_routes(FakeRoutes(5, failures={2: httpx.ReadTimeout("timed out"), 4: "none", 5: asyncio.TimeoutError()}))
+    out = asyncio.run(graph.generate_candidates_routes(_routes_state()))
+    assert out["routes_api_status"] == "ok"
+    assert [c["route_id"] for c in out["candidates"]] == ["route-1", "route-3"]
+
+    fake_routes(FakeRoutes(3, failures={i: httpx.ConnectTimeout("timed out") for i in range(1, 4)}))
+    state = _routes_state()
+    out = asyncio.run(graph.generate_candidates_routes(state))
+    assert out["candidates"] == []
+    assert out["routes_api_status"] == "error" and "ConnectTimeout" in out["routes_error"]
+    state.update(out)
+    fallback = asyncio.run(graph.fallback_candidates(state))
+    assert fallback["fallback_used"] is True
+    assert len(fallback["candidates"]) == 1 and fallback["candidates"][0]["is_fallback"] is True
+
+
+def test_compute_features_isolates_slow_and_failing_candidates(monkeypatch):
+    """候補ごとのスポット検索がタイムアウト・失敗しても、その候補だけ 0 にして他の候補と元の順序は保つ"""
+    import polyline as polyline_lib
+
+    from app import graph
+
+    monkeypatch.setattr(settings, "FEATURES_PLACES_TIMEOUT_SEC", 0.2)
+    monkeypatch.setattr(settings, "FEATURES_CONCURRENCY", 5)
+    polylines = [
+        polyline_lib.encode([(35.681, 139.767 + 0.001 * i), (35.690, 139.770 + 0.001 * i)]) for i in range(5)
+    ]
+    # 後ろの候補ほど早く終わる。2番目は遅すぎてタイムアウト、4番目は例外
+    behaviour = {polylines[0]: 0.08, polylines[1]: "slow", polylines[2]: 0.04, polylines[3]: "fail", polylines[4]: 0.0}
+    finished = []
+
+    async def fake_enrich(*, cand, **kwargs):
+        action = behaviour[cand.polyline]
+        if action == "slow":
+            await asyncio.sleep(10)
+        if action == "fail":
+            raise RuntimeError("places unavailable")
+        await asyncio.sleep(action)
+        index = polylines.index(cand.polyline)
+        finished.append(index)
+        return 0.1 * (index + 1), 0.01 * (index + 1)
+
+    monkeypatch.setattr(graph, "_enrich_candidate_places", fake_enrich)
+    state = _routes_state()
+    state["candidates"] = [{"polyline": p, "distance_km": 5.0, "duration_min": 70.0} for p in polylines]
+    t0 = time.perf_counter()
+    out = asyncio.run(graph.compute_features(state))
+    assert time.perf_counter() - t0 < 2.0
+    assert finished == [4, 2, 0]
+
+    assert [c["polyline"] for c in out["candidates"]] == polylines
+    features = [item["features"] for item in out["candidates_features"]]
+    assert [f["candidate_rank_in_theme"] for f in features] == [1, 2, 3, 4, 5]
+    assert [f["spot_type_diversity"] for f in features] == pytest.approx([0.1, 0.0, 0.3, 0.0, 0.5])
+    assert [f["detour_over_ratio"] for f in features] == pytest.approx([0.01, 0.0, 0.03, 0.0, 0.05])
+    assert [item["route_id"] for item in out["candidates_features"]] == [c["route_id"] for c in out["candidates"]]
+    assert [item["route_id"] for item in out["rep_routes_payload"]] == [c["route_id"] for c in out["candidates"]]
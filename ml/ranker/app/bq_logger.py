@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import logging
+import queue
+import threading
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from google.cloud import bigquery
 
-from app.settings import settings
+from .settings import settings
+
+logger = logging.getLogger(__name__)
 
 
 class BigQueryRankResultLogger:
@@ -35,6 +40,7 @@ class BigQueryRankResultLogger:
         rule_version: str,
         model_version: str,
         status: str,
+        scoring_role: str = "served",
     ) -> List[Dict[str, Any]]:
         created_at = datetime.now(timezone.utc).isoformat()
         rows: List[Dict[str, Any]] = []
@@ -50,6 +56,92 @@ class BigQueryRankResultLogger:
                     "model_score": item.get("model_score"),
                     "model_latency_ms": item.get("model_latency_ms", 0),
                     "status": item.get("status") or status,
+                    "scoring_role": scoring_role,
                 }
             )
         return rows
+
+
+class BufferedRankResultWriter:
+    """
+    rank_result 行をリクエスト横断でバッファし、バックグラウンドスレッドでまとめて書き込む。
+
+    - BQ_FLUSH_BATCH_SIZE 行溜まるか BQ_FLUSH_INTERVAL_S 経過でフラッシュ
+    - BigQuery クライアント（BigQueryRankResultLogger）はプロセス内で1つだけ作る
+    - バッファが BQ_BUFFER_MAXSIZE を超えた行は破棄して dropped をカウント
+    """
+
+    def __init__(self, logger_factory: Callable[[], BigQueryRankResultLogger] = BigQueryRankResultLogger) -> None:
+        self._logger_factory = logger_factory
+        self._bq_logger: Optional[BigQueryRankResultLogger] = None
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, int(settings.BQ_BUFFER_MAXSIZE)))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats: Dict[str, int] = {"enqueued": 0, "dropped": 0, "written": 0, "failed": 0, "batches": 0}
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rank-result-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout_s: Optional[float] = None) -> None:
+        """スレッドを止め、バッファに残った行を書き切る。"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def enqueue(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self.start()
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+                self._stats["enqueued"] += 1
+            except queue.Full:
+                self._stats["dropped"] += 1
+                logger.warning("rank_result buffer full dropped_total=%d", self._stats["dropped"])
+        if self._queue.qsize() >= max(1, int(settings.BQ_FLUSH_BATCH_SIZE)):
+            self._wake.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "queue_depth": self._queue.qsize()}
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self) -> None:
+        """バッファが空になるまでバッチ書き込みする（失敗した行は破棄して failed をカウント）。"""
+        batch_size = max(1, int(settings.BQ_FLUSH_BATCH_SIZE))
+        while True:
+            rows = self._drain(batch_size)
+            if not rows:
+                return
+            try:
+                if self._bq_logger is None:
+                    self._bq_logger = self._logger_factory()
+                self._bq_logger.log_rank_result(rows)
+                self._stats["written"] += len(rows)
+                self._stats["batches"] += 1
+            except Exception:
+                self._stats["failed"] += len(rows)
+                logger.exception("Failed to write rank_result to BigQuery rows=%d", len(rows))
+
+    def _run(self) -> None:
+        interval_s = max(0.01, float(settings.BQ_FLUSH_INTERVAL_S))
+        while not self._stop.is_set():
+            self._wake.wait(timeout=interval_s)
+            self._wake.clear()
+            self.flush()
+        self.flush()
@@ -1,17 +1,61 @@
 from __future__ import annotations
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
 import logging
+import time
 import uuid
 
 from fastapi import FastAPI, HTTPException
-from app.schemas import RankRequest, RankResponse, ScoreItem
-from app.settings import settings
-from app.model_scoring import ModelScorer
-from app.bq_logger import BigQueryRankResultLogger
+from .schemas import RankRequest, RankResponse, ScoreItem
+from .settings import settings
+from .model_scoring import ModelScorer
+from .model_registry import ModelRegistry
+from .bq_logger import BigQueryRankResultLogger, BufferedRankResultWriter
+from .shadow_scoring import ShadowScoringRunner, pick_scorers
 
 logger = logging.getLogger(__name__)
-app = FastAPI(title="firstdown Ranker API", version="1.0.0")
-model_scorer = ModelScorer()
+# モデルのバージョン管理とホットリロード（リクエストごとに primary を1回だけ参照する）
+model_registry = ModelRegistry()
+# プロセス共通の rank_result 書き込み（BigQueryクライアントは1つだけ作る）
+rank_result_writer = BufferedRankResultWriter()
+# モデル推論専用のスレッドプール（イベントループとリクエスト処理をブロックしない）
+inference_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.MODEL_EXECUTOR_WORKERS),
+    thread_name_prefix="model-inference",
+)
+# サービングに使わなかったモデルのスコアリング（レスポンス後に実行して rank_result に記録）
+shadow_runner = ShadowScoringRunner(rank_result_writer)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start()
+    yield
+    stop()
+
+
+def start() -> None:
+    """
+    バックグラウンド処理（rank_result の書き込み・モデルレジストリの監視）を開始する。
+
+    FastAPI の lifespan から呼ぶほか、Agent に組み込んで rank() を直接呼ぶ場合（RANKER_MODE=embedded）も
+    起動時に呼ぶ。
+    """
+    rank_result_writer.start()
+    model_registry.start()
+
+
+def stop() -> None:
+    """バックグラウンド処理を止め、バッファに残った rank_result を書き切ってから推論用スレッドプールを閉じる。"""
+    model_registry.stop()
+    shadow_runner.shutdown()
+    rank_result_writer.stop(timeout_s=settings.BQ_SHUTDOWN_FLUSH_TIMEOUT_S)
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="firstdown Ranker API", version="1.0.0", lifespan=lifespan)
 
 
 @app.get("/health")
@@ -19,6 +63,16 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics():
+    """rank_result 書き込みバッファの状態（queue_depth / dropped など）とモデルレジストリの状態"""
+    return {
+        "rank_result_writer": rank_result_writer.stats(),
+        "model_registry": model_registry.status(),
+        "shadow_scoring": shadow_runner.stats(),
+    }
+
+
 def _calculate_score(features: Dict[str, Any]) -> tuple[float, Dict[str, float]]:
     """
     ルールベーススコアリング: 距離乖離 / loop closure / POI数を考慮
@@ -99,15 +153,41 @@ def _calculate_score(features: Dict[str, Any]) -> tuple[float, Dict[str, float]]
     return score, breakdown
 
 
+async def _score_with_deadline(
+    scorer: ModelScorer,
+    features_list: List[Dict[str, Any]],
+) -> List[Tuple[Optional[float], int, str]]:
+    """
+    モデル推論を専用スレッドプールで実行し、MODEL_TIMEOUT_S を超えたら打ち切る。
+
+    打ち切った場合は全ルート model_status="timeout"（スコアは None）を返す。
+    推論スレッド自体は止められないため、結果は捨てられる。
+    """
+    if not features_list:
+        return []
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(inference_executor, scorer.score_batch, features_list)
+    timeout_s = float(settings.MODEL_TIMEOUT_S)
+    try:
+        return await asyncio.wait_for(future, timeout=timeout_s if timeout_s > 0 else None)
+    except asyncio.TimeoutError:
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        logger.warning("Model inference timed out routes=%d timeout_s=%.2f", len(features_list), timeout_s)
+        return [(None, elapsed_ms, "timeout")] * len(features_list)
+
+
 @app.post("/rank", response_model=RankResponse)
-def rank(req: RankRequest) -> RankResponse:
+async def rank(req: RankRequest) -> RankResponse:
     """
     ルート候補をスコアリングしてランキングする
     
     スコアリングロジック:
     - **モデルスコアを優先**: Vertex AI EndpointまたはXGBoostモデルからの推論スコアを採用
     - **ルールスコアはシャドー**: ルールベーススコアは必ず計算し、breakdownとBigQueryログに保存
-    - **フォールバック**: モデル推論に失敗した場合はルールスコアにフォールバック
+    - **フォールバック**: モデル推論に失敗した場合・MODEL_TIMEOUT_S を超えた場合はルールスコアにフォールバック
+    - **シャドウ / A/B**: シャドウ枠のモデルはレスポンス後にスコアリングして rank_result に記録
+      （MODEL_AB_TRAFFIC_PCT の割合のリクエストはシャドウ枠のモデルでサービング）
     
     ルールスコアの計算要素:
     - 距離乖離: 目標距離との誤差が小さいほど良い（ペナルティ方式）
@@ -133,43 +213,48 @@ def rank(req: RankRequest) -> RankResponse:
     failed = []  # 失敗したルートIDのリスト
     log_items = []  # BQ用ログ行
 
-    # 各ルートをスコアリング
+    # ルールスコアは必ず計算（シャドー用）
+    ruled = []  # (route, rule_score, breakdown)
     for r in req.routes:
         try:
-            # ルールスコアは必ず計算（シャドー用）
             rule_score, breakdown = _calculate_score(r.features)
-            breakdown = breakdown or {}
-            
-            # モデルスコアを取得（Vertex AIまたはXGBoost）
-            model_score, model_latency_ms, model_status = model_scorer.score(r.features)
-            
-            # モデルスコアを優先的に採用、失敗時はルールスコアにフォールバック
-            if model_score is not None and model_status == "ok":
-                final_score = float(model_score)
-            else:
-                # モデル推論失敗時はルールスコアにフォールバック
-                final_score = rule_score
-            
-            # breakdownに両方のスコアを記録
-            breakdown["rule_score"] = rule_score
-            breakdown["model_score"] = model_score
-            breakdown["model_latency_ms"] = model_latency_ms
-            breakdown["model_status"] = model_status
-            
-            scores.append(ScoreItem(route_id=r.route_id, score=final_score, breakdown=breakdown))
-            log_items.append(
-                {
-                    "route_id": r.route_id,
-                    "rule_score": rule_score,
-                    "model_score": model_score,
-                    "model_latency_ms": model_latency_ms,
-                    "status": model_status,
-                }
-            )
-        except Exception as e:
+            ruled.append((r, rule_score, breakdown or {}))
+        except Exception:
             # スコアリングに失敗したルートIDを記録
             failed.append(r.route_id)
 
+    # モデルスコアは全ルートをまとめて取得（Vertex AIまたはXGBoost、期限付き）
+    # リクエスト中にホットリロードされても同じモデルでスコアリング・ログする
+    # A/B 対象のリクエストはシャドウ枠のモデルでサービングし、プライマリをシャドウに回す
+    scorer, shadow_scorer = pick_scorers(request_id, model_registry.primary, model_registry.shadow)
+    model_results = await _score_with_deadline(scorer, [r.features for r, _, _ in ruled])
+
+    for (r, rule_score, breakdown), (model_score, model_latency_ms, model_status) in zip(ruled, model_results):
+        # モデルスコアを優先的に採用、失敗時はルールスコアにフォールバック
+        if model_score is not None and model_status == "ok":
+            final_score = float(model_score)
+        else:
+            # モデル推論失敗時はルールスコアにフォールバック
+            final_score = rule_score
+
+        # breakdownに両方のスコアを記録
+        breakdown["rule_score"] = rule_score
+        breakdown["model_score"] = model_score
+        breakdown["model_latency_ms"] = model_latency_ms
+        breakdown["model_status"] = model_status
+        breakdown["model_version"] = scorer.model_version
+
+        scores.append(ScoreItem(route_id=r.route_id, score=final_score, breakdown=breakdown))
+        log_items.append(
+            {
+                "route_id": r.route_id,
+                "rule_score": rule_score,
+                "model_score": model_score,
+                "model_latency_ms": model_latency_ms,
+                "status": model_status,
+            }
+        )
+
     # すべて失敗した場合はエラー
     if len(scores) == 0:
         raise HTTPException(status_code=422, detail="No successful inference")
@@ -181,16 +266,24 @@ def rank(req: RankRequest) -> RankResponse:
 
     if log_items:
         try:
-            bq_logger = BigQueryRankResultLogger()
-            rows = bq_logger.build_rows(
+            rows = BigQueryRankResultLogger.build_rows(
                 request_id=request_id,
                 items=log_items,
                 rule_version=settings.RANKER_VERSION,
-                model_version=settings.MODEL_VERSION,
+                model_version=scorer.model_version,
                 status="ok",
             )
-            bq_logger.log_rank_result(rows)
+            # 書き込みはバックグラウンドでまとめて行う（レスポンスを待たせない）
+            rank_result_writer.enqueue(rows)
         except Exception:
-            logger.exception("Failed to write rank_result to BigQuery")
+            logger.exception("Failed to enqueue rank_result rows")
+
+    if shadow_scorer is not None:
+        # 待たずに投げるだけ（シャドウの推論時間はレスポンスに乗らない）
+        shadow_runner.submit(
+            request_id,
+            shadow_scorer,
+            [{"route_id": r.route_id, "rule_score": rule_score, "features": r.features} for r, rule_score, _ in ruled],
+        )
 
     return response
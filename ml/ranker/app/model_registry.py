@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .model_scoring import ModelScorer
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.xgb.json"
+FEATURES_FILE = "feature_columns.json"
+METADATA_FILE = "metadata.json"
+
+# ファイルから読み込むモード（レジストリの対象）
+_FILE_MODES = ("xgb", "compiled")
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """レジストリ内の1バージョン分のモデル成果物"""
+    version: str
+    path: Path
+    trained_at: str
+    fingerprint: Tuple[Tuple[str, int, int], ...]  # (ファイル名, mtime_ns, size)
+
+
+@dataclass(frozen=True)
+class _Slot:
+    scorer: ModelScorer
+    bundle: Optional[ModelBundle]
+
+
+def scan_bundles(registry_dir: str | Path) -> List[ModelBundle]:
+    """
+    registry_dir 直下のサブディレクトリから、成果物3点が揃ったバンドルを古い順に返す。
+
+    metadata.json は最後に置く想定（揃っていないディレクトリはアップロード途中として無視する）。
+    """
+    root = Path(registry_dir)
+    if not root.is_dir():
+        return []
+    bundles: List[ModelBundle] = []
+    for child in root.iterdir():
+        files = [child / MODEL_FILE, child / FEATURES_FILE, child / METADATA_FILE]
+        if not child.is_dir() or not all(f.is_file() for f in files):
+            continue
+        try:
+            with (child / METADATA_FILE).open("r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            fingerprint = tuple((f.name, f.stat().st_mtime_ns, f.stat().st_size) for f in files)
+        except Exception as exc:
+            logger.warning("Skip model bundle path=%s err=%s", child, exc)
+            continue
+        bundles.append(
+            ModelBundle(
+                version=str(metadata.get("model_version") or child.name),
+                path=child,
+                trained_at=str(metadata.get("trained_at") or ""),
+                fingerprint=fingerprint,
+            )
+        )
+    bundles.sort(key=lambda b: (b.trained_at, b.path.name))
+    return bundles
+
+
+class ModelRegistry:
+    """
+    モデルのバージョン管理とホットリロード。
+
+    MODEL_REGISTRY_DIR 配下の <version>/{model.xgb.json, feature_columns.json, metadata.json} を
+    MODEL_REGISTRY_POLL_S ごとに確認し、新しいバンドルをバックグラウンドでロード・検証してから
+    プライマリ（と任意のシャドウ）を差し替える。差し替えは参照の代入1回で行う（推論中のリクエストは旧モデルのまま完了）。
+    MODEL_REGISTRY_DIR が空、または推論モードがファイル由来（xgb / compiled）でない場合は従来どおり MODEL_PATH を使う。
+    """
+
+    def __init__(self, mode: Optional[str] = None) -> None:
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, int] = {"reloads": 0, "rejected": 0}
+        self._primary = _Slot(scorer=ModelScorer(mode=mode), bundle=None)
+        self._shadow: Optional[_Slot] = None
+        # 検証に失敗したバンドル（ファイルが更新されるまで再ロードしない）
+        self._rejected: set[Tuple[Path, Tuple[Tuple[str, int, int], ...]]] = set()
+        if self.enabled:
+            self.refresh()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.MODEL_REGISTRY_DIR) and self._primary.scorer.mode in _FILE_MODES
+
+    @property
+    def primary(self) -> ModelScorer:
+        return self._primary.scorer
+
+    @property
+    def shadow(self) -> Optional[ModelScorer]:
+        slot = self._shadow
+        return slot.scorer if slot is not None else None
+
+    def status(self) -> Dict[str, Any]:
+        primary, shadow = self._primary, self._shadow
+        return {
+            "enabled": self.enabled,
+            "primary_version": primary.scorer.model_version,
+            "primary_path": str(primary.bundle.path) if primary.bundle else str(settings.MODEL_PATH),
+            "shadow_version": shadow.scorer.model_version if shadow else None,
+            **self._stats,
+        }
+
+    def _pick(self, bundles: List[ModelBundle], pinned: str) -> Optional[ModelBundle]:
+        if pinned:
+            for bundle in bundles:
+                if pinned in (bundle.version, bundle.path.name):
+                    return bundle
+            return None
+        return bundles[-1] if bundles else None
+
+    def _needs_load(self, target: Optional[ModelBundle], current: Optional[ModelBundle]) -> bool:
+        if target is None or (target.path, target.fingerprint) in self._rejected:
+            return False
+        return current is None or target.path != current.path or target.fingerprint != current.fingerprint
+
+    def _load(self, bundle: ModelBundle) -> Optional[ModelScorer]:
+        """バンドルをロードして検証する。失敗時は None（現在のモデルを使い続ける）。"""
+        scorer = ModelScorer(
+            mode=self._primary.scorer.mode,
+            model_path=str(bundle.path / MODEL_FILE),
+            features_path=str(bundle.path / FEATURES_FILE),
+        )
+        reason = scorer.load_error
+        if reason is None:
+            score, _, status = scorer.score_batch([{}])[0]
+            if status != "ok" or score is None or not math.isfinite(score):
+                reason = f"probe scoring failed status={status} score={score}"
+        if reason is not None:
+            self._stats["rejected"] += 1
+            self._rejected.add((bundle.path, bundle.fingerprint))
+            logger.error("Model bundle rejected version=%s path=%s reason=%s", bundle.version, bundle.path, reason)
+            return None
+        return scorer
+
+    def refresh(self) -> bool:
+        """レジストリを確認し、プライマリ/シャドウを必要に応じて差し替える。差し替えがあれば True。"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            bundles = scan_bundles(settings.MODEL_REGISTRY_DIR)
+            changed = False
+
+            target = self._pick(bundles, settings.MODEL_REGISTRY_PRIMARY)
+            if self._needs_load(target, self._primary.bundle):
+                scorer = self._load(target)
+                if scorer is not None:
+                    self._primary = _Slot(scorer=scorer, bundle=target)
+                    self._stats["reloads"] += 1
+                    changed = True
+                    logger.info("Primary model activated version=%s path=%s", scorer.model_version, target.path)
+
+            if not settings.MODEL_REGISTRY_SHADOW:
+                if self._shadow is not None:
+                    self._shadow = None
+                    changed = True
+                return changed
+            shadow_target = self._pick(bundles, settings.MODEL_REGISTRY_SHADOW)
+            if self._needs_load(shadow_target, self._shadow.bundle if self._shadow else None):
+                scorer = self._load(shadow_target)
+                if scorer is not None:
+                    self._shadow = _Slot(scorer=scorer, bundle=shadow_target)
+                    changed = True
+                    logger.info("Shadow model activated version=%s path=%s", scorer.model_version, shadow_target.path)
+            return changed
+
+    def start(self) -> None:
+        """MODEL_REGISTRY_POLL_S ごとの確認をバックグラウンドスレッドで開始する。"""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _run(self) -> None:
+        interval_s = max(1.0, float(settings.MODEL_REGISTRY_POLL_S))
+        while not self._stop.wait(timeout=interval_s):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Model registry refresh failed")
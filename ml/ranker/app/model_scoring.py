@@ -1,22 +1,32 @@
 from __future__ import annotations
 
 import json
+import logging
 import time
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import xgboost as xgb
 from google.protobuf import json_format
 from google.protobuf.struct_pb2 import Value
 
-from app.settings import settings
+from .settings import settings
+from .tree_engine import CompiledTreeModel
+
+logger = logging.getLogger(__name__)
 
 
 class ModelScorer:
     """シャドウ用のモデルスコアリング（XGBoost推論）"""
 
-    def __init__(self, timeout_s: float | None = None, mode: str | None = None) -> None:
+    def __init__(
+        self,
+        timeout_s: float | None = None,
+        mode: str | None = None,
+        model_path: str | None = None,
+        features_path: str | None = None,
+    ) -> None:
         self._timeout_s = timeout_s if timeout_s is not None else settings.MODEL_TIMEOUT_S
         self._mode = (
             mode
@@ -24,8 +34,14 @@ class ModelScorer:
             or settings.MODEL_SHADOW_MODE
             or "xgb"
         ).lower()
+        self._model_path = Path(model_path or settings.MODEL_PATH)
+        self._features_path = Path(features_path or settings.MODEL_FEATURES_PATH)
+        # モデルと同じディレクトリの metadata.json に model_version があればそれを使う
+        self.model_version: str = settings.MODEL_VERSION
         self._model: Optional[xgb.XGBRegressor] = None
+        self._compiled: Optional[CompiledTreeModel] = None  # compiled モード時の配列化した木
         self._feature_columns: list[str] = []
+        self._column_index: Dict[str, int] = {}  # 特徴量名 -> 列番号（ロード時に作成）
         self._load_error: Optional[str] = None
         self._vertex_client = None
         self._vertex_endpoint = ""
@@ -36,6 +52,12 @@ class ModelScorer:
                 self._load_model()
             except Exception as exc:
                 self._load_error = str(exc)
+        if self._mode == "compiled":
+            try:
+                self._load_model()
+                self._load_compiled()
+            except Exception as exc:
+                self._load_error = str(exc)
         if self._mode == "vertex":
             try:
                 self._init_vertex()
@@ -49,32 +71,66 @@ class ModelScorer:
         Returns:
             (score, latency_ms, status)
         """
+        return self.score_batch([features])[0]
+
+    def score_batch(self, features_list: List[Dict[str, Any]]) -> List[Tuple[Optional[float], int, str]]:
+        """
+        複数ルートの特徴量をまとめてスコアリングする（xgb は1回の predict で推論）。
+
+        Returns:
+            入力と同じ順序の (score, latency_ms, status) のリスト。latency_ms はバッチ全体の所要時間。
+        """
         start = time.perf_counter()
+        n = len(features_list)
+        if n == 0:
+            return []
+
+        def _all(score: Optional[float], status: str) -> List[Tuple[Optional[float], int, str]]:
+            elapsed = self._elapsed_ms(start)
+            return [(score, elapsed, status)] * n
+
         try:
             if self._mode == "disabled":
-                return None, self._elapsed_ms(start), "model_disabled"
+                return _all(None, "model_disabled")
             if self._mode == "stub":
-                score = self._stub_score(features)
-                return score, self._elapsed_ms(start), "ok"
+                stub_results: List[Tuple[Optional[float], str]] = []
+                for features in features_list:
+                    try:
+                        stub_results.append((self._stub_score(features), "ok"))
+                    except Exception:
+                        stub_results.append((None, "model_error"))
+                elapsed = self._elapsed_ms(start)
+                return [(score, elapsed, status) for score, status in stub_results]
             if self._mode == "vertex":
                 if self._load_error or self._vertex_client is None or not self._vertex_endpoint:
-                    return None, self._elapsed_ms(start), "model_not_loaded"
-                score = self._vertex_score(features)
-                return score, self._elapsed_ms(start), "ok"
-            if self._mode != "xgb":
-                return None, self._elapsed_ms(start), "model_mode_unsupported"
-            if self._load_error or self._model is None or not self._feature_columns:
-                return None, self._elapsed_ms(start), "model_not_loaded"
-
-            vector = self._vectorize_features(features)
-            pred = float(self._model.predict(vector)[0])
-            return pred, self._elapsed_ms(start), "ok"
+                    return _all(None, "model_not_loaded")
+                preds = self._vertex_score_batch(features_list)
+                elapsed = self._elapsed_ms(start)
+                return [(pred, elapsed, "ok" if pred is not None else "model_error") for pred in preds]
+            if self._mode not in ("xgb", "compiled"):
+                return _all(None, "model_mode_unsupported")
+            predictor = self._compiled if self._compiled is not None else self._model
+            if self._load_error or predictor is None or not self._feature_columns:
+                return _all(None, "model_not_loaded")
+
+            matrix = self._vectorize_batch(features_list)
+            preds = predictor.predict(matrix)
+            elapsed = self._elapsed_ms(start)
+            return [(float(pred), elapsed, "ok") for pred in preds]
         except Exception:
-            return None, self._elapsed_ms(start), "model_error"
+            return _all(None, "model_error")
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @property
+    def load_error(self) -> Optional[str]:
+        return self._load_error
 
     def _load_model(self) -> None:
-        model_path = Path(settings.MODEL_PATH)
-        features_path = Path(settings.MODEL_FEATURES_PATH)
+        model_path = self._model_path
+        features_path = self._features_path
 
         if not model_path.exists():
             raise FileNotFoundError(f"MODEL_PATH not found: {model_path}")
@@ -83,11 +139,48 @@ class ModelScorer:
 
         with features_path.open("r", encoding="utf-8") as f:
             self._feature_columns = json.load(f)
+        self._column_index = {name: i for i, name in enumerate(self._feature_columns)}
+
+        metadata_path = model_path.parent / "metadata.json"
+        if metadata_path.exists():
+            with metadata_path.open("r", encoding="utf-8") as f:
+                self.model_version = str(json.load(f).get("model_version") or self.model_version)
 
         model = xgb.XGBRegressor()
         model.load_model(str(model_path))
         self._model = model
 
+    def _load_compiled(self) -> None:
+        """
+        XGBoost モデルを配列化した木にコンパイルし、XGBoost の予測と一致するか確認する。
+
+        一致すれば XGBoost 側のモデルは破棄する（メモリ削減）。一致しなければ XGBoost で推論を続ける。
+        """
+        compiled = CompiledTreeModel.from_json_file(self._model_path)
+        if compiled.num_feature and compiled.num_feature != len(self._feature_columns):
+            raise ValueError(
+                f"feature_columns ({len(self._feature_columns)}) does not match model num_feature ({compiled.num_feature})"
+            )
+        probe = _parity_probe(len(self._feature_columns), int(settings.MODEL_PARITY_SAMPLES))
+        max_diff = float(np.max(np.abs(compiled.predict(probe) - self._model.predict(probe)))) if len(probe) else 0.0
+        if max_diff > float(settings.MODEL_PARITY_TOLERANCE):
+            logger.error(
+                "Compiled trees parity check failed max_diff=%.3g tolerance=%.3g; using XGBoost predict",
+                max_diff,
+                settings.MODEL_PARITY_TOLERANCE,
+            )
+            return
+        logger.info(
+            "Compiled trees loaded trees=%d nodes=%d max_depth=%d bytes=%d parity_max_diff=%.3g",
+            compiled.num_trees,
+            compiled.num_nodes,
+            compiled.max_depth,
+            compiled.nbytes(),
+            max_diff,
+        )
+        self._compiled = compiled
+        self._model = None
+
     def _init_vertex(self) -> None:
         from google.cloud.aiplatform_v1 import PredictionServiceClient
 
@@ -107,17 +200,36 @@ class ModelScorer:
         self._vertex_client = PredictionServiceClient()
         self._vertex_endpoint = endpoint
 
-    def _vertex_score(self, features: Dict[str, Any]) -> float:
-        instance = self._sanitize_instance(features)
-        value = json_format.ParseDict(instance, Value())
+    def _vertex_score_batch(self, features_list: List[Dict[str, Any]]) -> List[Optional[float]]:
+        """
+        全ルートを1回の predict（instances のリスト）で推論し、位置で対応付けて返す。
+
+        変換できないインスタンス・欠けた予測値・数値化できない予測値は None（呼び出し側でルールスコアへ）。
+        RPC 自体の失敗は例外として送出する。
+        """
+        preds: List[Optional[float]] = [None] * len(features_list)
+        values: List[Value] = []
+        positions: List[int] = []
+        for i, features in enumerate(features_list):
+            try:
+                values.append(json_format.ParseDict(self._sanitize_instance(features), Value()))
+                positions.append(i)
+            except Exception:
+                continue
+        if not values:
+            return preds
         response = self._vertex_client.predict(
             endpoint=self._vertex_endpoint,
-            instances=[value],
+            instances=values,
             timeout=self._vertex_timeout_s,
         )
-        if not response.predictions:
-            raise ValueError("Empty prediction response from Vertex AI.")
-        return _extract_prediction_value(response.predictions[0])
+        predictions = list(response.predictions)
+        for pos, prediction in zip(positions, predictions):
+            try:
+                preds[pos] = _extract_prediction_value(prediction)
+            except ValueError:
+                continue
+        return preds
 
     @staticmethod
     def _sanitize_instance(features: Dict[str, Any]) -> Dict[str, Any]:
@@ -132,21 +244,23 @@ class ModelScorer:
         return sanitized
 
 
-    def _vectorize_features(self, features: Dict[str, Any]) -> np.ndarray:
-        values: list[float] = []
-        for name in self._feature_columns:
-            raw = features.get(name, None)
-            if isinstance(raw, bool):
-                values.append(1.0 if raw else 0.0)
-                continue
-            if raw is None:
-                values.append(np.nan)
-                continue
-            try:
-                values.append(float(raw))
-            except (TypeError, ValueError):
-                values.append(np.nan)
-        return np.array([values], dtype=float)
+    def _vectorize_batch(self, features_list: List[Dict[str, Any]]) -> np.ndarray:
+        """特徴量辞書のリストを (ルート数, 特徴量数) の行列にする（欠損・変換不能は NaN）。"""
+        matrix = np.full((len(features_list), len(self._feature_columns)), np.nan, dtype=float)
+        column_index = self._column_index
+        for row, features in enumerate(features_list):
+            for name, raw in features.items():
+                col = column_index.get(name)
+                if col is None or raw is None:
+                    continue
+                if isinstance(raw, bool):
+                    matrix[row, col] = 1.0 if raw else 0.0
+                    continue
+                try:
+                    matrix[row, col] = float(raw)
+                except (TypeError, ValueError):
+                    pass
+        return matrix
 
     def _stub_score(self, features: Dict[str, Any]) -> float:
         """
@@ -177,6 +291,17 @@ class ModelScorer:
         return int((time.perf_counter() - start) * 1000)
 
 
+def _parity_probe(num_features: int, samples: int) -> np.ndarray:
+    """パリティ確認用の固定入力（桁の異なる値と欠損を混ぜる）。"""
+    rng = np.random.default_rng(0)
+    scale = rng.choice([0.01, 0.1, 1.0, 10.0, 100.0], size=(samples, num_features))
+    probe = rng.normal(size=(samples, num_features)) * scale
+    probe[rng.random(probe.shape) < 0.15] = np.nan
+    # 2値特徴量（0/1）の分岐も通るように一部の列を丸める
+    probe[:, ::3] = np.round(np.abs(probe[:, ::3])) % 2
+    return probe
+
+
 def _extract_prediction_value(prediction: Any) -> float:
     if isinstance(prediction, (int, float)):
         return float(prediction)
@@ -5,13 +5,28 @@ class Settings(BaseSettings):
     """Rankerアプリケーション設定クラス（環境変数から読み込み）"""
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
     MODEL_VERSION: str = "unknown"  # モデルバージョン（影響確認用）
-    MODEL_INFERENCE_MODE: str = ""  # vertex / xgb / stub / disabled（空ならMODEL_SHADOW_MODEへフォールバック）
-    MODEL_SHADOW_MODE: str = "xgb"  # vertex / xgb / stub / disabled
-    MODEL_TIMEOUT_S: float = 5.0  # 推論タイムアウト（秒）
+    MODEL_INFERENCE_MODE: str = ""  # vertex / xgb / compiled / stub / disabled（空ならMODEL_SHADOW_MODEへフォールバック）
+    MODEL_SHADOW_MODE: str = "xgb"  # vertex / xgb / compiled / stub / disabled
+    MODEL_TIMEOUT_S: float = 5.0  # 推論タイムアウト（秒、超過したルートはルールスコアで返す。0以下で無制限）
+    MODEL_EXECUTOR_WORKERS: int = 4  # モデル推論用スレッドプールのワーカー数
     MODEL_PATH: str = "models/model.xgb.json"  # XGBoost成果物パス
     MODEL_FEATURES_PATH: str = "models/feature_columns.json"  # 特徴量カラム定義
+    MODEL_PARITY_TOLERANCE: float = 1e-4  # compiled モードのロード時パリティ確認の許容誤差（XGBoost予測との差）
+    MODEL_PARITY_SAMPLES: int = 256  # パリティ確認に使う入力行数
     RANKER_VERSION: str = "unknown"  # ルール版のバージョン
 
+    # モデルレジストリ（<dir>/<version>/{model.xgb.json, feature_columns.json, metadata.json}、空なら MODEL_PATH を使う）
+    MODEL_REGISTRY_DIR: str = ""  # GCS はボリュームマウントしたローカルパスを指定
+    MODEL_REGISTRY_PRIMARY: str = ""  # プライマリに固定するバージョン（空なら trained_at が最新のもの）
+    MODEL_REGISTRY_SHADOW: str = ""  # シャドウとして読み込むバージョン（空なら無し）
+    MODEL_REGISTRY_POLL_S: float = 30.0  # レジストリの確認間隔（秒）
+
+    # シャドウ / A/B（シャドウ枠は MODEL_REGISTRY_SHADOW）
+    MODEL_SHADOW_SAMPLE_RATE: float = 1.0  # レスポンス後にシャドウでスコアリングするリクエストの割合（0.0-1.0）
+    MODEL_SHADOW_WORKERS: int = 1  # シャドウ推論用スレッドプールのワーカー数
+    MODEL_SHADOW_MAX_PENDING: int = 32  # 未完了のシャドウジョブの上限（超過分は破棄）
+    MODEL_AB_TRAFFIC_PCT: float = 0.0  # シャドウ枠のモデルでサービングするリクエストの割合（%、request_id で決定的に分割）
+
     # Vertex AI Endpoint
     VERTEX_PROJECT: str = ""
     VERTEX_LOCATION: str = "asia-northeast1"
@@ -21,6 +36,10 @@ class Settings(BaseSettings):
     BQ_PROJECT: str | None = None
     BQ_DATASET: str = "firstdown_mvp"
     BQ_RANK_RESULT_TABLE: str = "rank_result"
+    BQ_BUFFER_MAXSIZE: int = 5000  # rank_result 書き込みバッファの上限（超過分は破棄）
+    BQ_FLUSH_BATCH_SIZE: int = 500  # 1回の書き込みでまとめる最大行数
+    BQ_FLUSH_INTERVAL_S: float = 2.0  # 定期フラッシュ間隔（秒）
+    BQ_SHUTDOWN_FLUSH_TIMEOUT_S: float = 10.0  # 終了時のフラッシュ待ち上限（秒）
 
 
-settings = Settings()  # グローバル設定インスタンス
+settings = Settings()  # グローバル設定インスタンス（Agent に組み込む場合は接頭辞付きの Settings に差し替えられる）
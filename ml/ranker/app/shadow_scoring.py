@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .bq_logger import BigQueryRankResultLogger, BufferedRankResultWriter
+from .model_scoring import ModelScorer
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def request_bucket(request_id: str, salt: str = "") -> float:
+    """request_id から [0, 1) の決定的なバケット値を返す（同じ request_id は常に同じ群に入る）。"""
+    digest = hashlib.sha256(f"{salt}:{request_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / float(1 << 64)
+
+
+def in_treatment(request_id: str) -> bool:
+    """A/B で候補モデル（シャドウ枠）をサービングに使うリクエストか（MODEL_AB_TRAFFIC_PCT で分割）。"""
+    pct = float(settings.MODEL_AB_TRAFFIC_PCT)
+    return pct > 0 and request_bucket(request_id, "ab") * 100.0 < pct
+
+
+class ShadowScoringRunner:
+    """
+    サービングに使わなかったモデルのスコアリングをレスポンス後に行い、rank_result に記録する。
+
+    /rank はジョブを専用スレッドプールに投げるだけで待たない（レイテンシを増やさない）。
+    推論用プールとは分けてあり、未完了ジョブが MODEL_SHADOW_MAX_PENDING を超えた分は破棄して dropped をカウントする。
+    """
+
+    def __init__(self, writer: BufferedRankResultWriter) -> None:
+        self._writer = writer
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, int(settings.MODEL_SHADOW_WORKERS)),
+            thread_name_prefix="shadow-scoring",
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats: Dict[str, int] = {"submitted": 0, "dropped": 0, "completed": 0, "failed": 0}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "pending": self._pending}
+
+    def submit(self, request_id: str, scorer: ModelScorer, items: List[Dict[str, Any]]) -> bool:
+        """
+        items（route_id / rule_score / features）をシャドウとしてスコアリングする。投入できたら True。
+
+        MODEL_SHADOW_SAMPLE_RATE で request_id ごとに間引く。
+        """
+        if not items or request_bucket(request_id, "shadow") >= float(settings.MODEL_SHADOW_SAMPLE_RATE):
+            return False
+        with self._lock:
+            if self._pending >= max(1, int(settings.MODEL_SHADOW_MAX_PENDING)):
+                self._stats["dropped"] += 1
+                return False
+            self._pending += 1
+            self._stats["submitted"] += 1
+        try:
+            self._executor.submit(self._run, request_id, scorer, items)
+        except RuntimeError:
+            # シャットダウン後
+            with self._lock:
+                self._pending -= 1
+                self._stats["dropped"] += 1
+            return False
+        return True
+
+    def _run(self, request_id: str, scorer: ModelScorer, items: List[Dict[str, Any]]) -> None:
+        try:
+            results = scorer.score_batch([item["features"] for item in items])
+            log_items = [
+                {
+                    "route_id": item["route_id"],
+                    "rule_score": item["rule_score"],
+                    "model_score": model_score,
+                    "model_latency_ms": model_latency_ms,
+                    "status": model_status,
+                }
+                for item, (model_score, model_latency_ms, model_status) in zip(items, results)
+            ]
+            rows = BigQueryRankResultLogger.build_rows(
+                request_id=request_id,
+                items=log_items,
+                rule_version=settings.RANKER_VERSION,
+                model_version=scorer.model_version,
+                status="ok",
+                scoring_role="shadow",
+            )
+            self._writer.enqueue(rows)
+            outcome = "completed"
+        except Exception:
+            logger.exception("Shadow scoring failed request_id=%s model_version=%s", request_id, scorer.model_version)
+            outcome = "failed"
+        with self._lock:
+            self._pending -= 1
+            self._stats[outcome] += 1
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def pick_scorers(
+    request_id: str,
+    primary: ModelScorer,
+    shadow: Optional[ModelScorer],
+) -> tuple[ModelScorer, Optional[ModelScorer]]:
+    """(サービングに使うモデル, レスポンス後にシャドウでスコアリングするモデル) を返す。"""
+    if shadow is None:
+        return primary, None
+    if in_treatment(request_id):
+        return shadow, primary
+    return primary, shadow
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+# 出力変換が恒等（margin = 予測値）の目的関数
+_IDENTITY_OBJECTIVES = {
+    "reg:squarederror",
+    "reg:pseudohubererror",
+    "reg:absoluteerror",
+    "reg:linear",
+}
+# 出力にシグモイドをかける目的関数
+_LOGISTIC_OBJECTIVES = {"reg:logistic", "binary:logistic"}
+
+
+class CompiledTreeModel:
+    """
+    XGBoost の JSON モデル（gbtree・回帰）を配列化した木で推論する。
+
+    全ての木のノードを1本の配列に連結し、(行数, 木の数) のノード位置を深さ分だけ
+    NumPy でまとめて進める。XGBoost と同じく特徴量・閾値は float32 で比較する
+    （x < 閾値 なら左、欠損は default_left に従う）。
+    """
+
+    def __init__(
+        self,
+        *,
+        roots: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        default_left: np.ndarray,
+        is_leaf: np.ndarray,
+        leaf_value: np.ndarray,
+        max_depth: int,
+        base_margin: float,
+        logistic: bool,
+        num_feature: int,
+    ) -> None:
+        self.roots = roots
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.default_left = default_left
+        self.is_leaf = is_leaf
+        self.leaf_value = leaf_value
+        self.max_depth = max_depth
+        self.base_margin = base_margin
+        self.logistic = logistic
+        self.num_feature = num_feature
+
+    @property
+    def num_trees(self) -> int:
+        return int(self.roots.shape[0])
+
+    @property
+    def num_nodes(self) -> int:
+        return int(self.left.shape[0])
+
+    @classmethod
+    def from_json_file(cls, path: str | Path) -> "CompiledTreeModel":
+        with Path(path).open("r", encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+    @classmethod
+    def from_json(cls, model_json: Dict[str, Any]) -> "CompiledTreeModel":
+        learner = model_json["learner"]
+        objective = learner["objective"]["name"]
+        if objective in _IDENTITY_OBJECTIVES:
+            logistic = False
+        elif objective in _LOGISTIC_OBJECTIVES:
+            logistic = True
+        else:
+            raise ValueError(f"Unsupported objective for compiled trees: {objective}")
+
+        booster = learner["gradient_booster"]
+        if booster.get("name") != "gbtree":
+            raise ValueError(f"Unsupported booster for compiled trees: {booster.get('name')}")
+        model_param = learner["learner_model_param"]
+        if int(model_param.get("num_class", "0") or 0) > 1 or int(model_param.get("num_target", "1") or 1) > 1:
+            raise ValueError("Multi-output models are not supported by compiled trees.")
+
+        base_score = _parse_base_score(model_param.get("base_score", "0.5"))
+        if logistic:
+            base_score = min(max(base_score, 1e-7), 1.0 - 1e-7)
+            base_margin = float(np.log(base_score / (1.0 - base_score)))
+        else:
+            base_margin = base_score
+
+        trees: List[Dict[str, Any]] = booster["model"]["trees"]
+        roots: List[int] = []
+        left: List[np.ndarray] = []
+        right: List[np.ndarray] = []
+        feature: List[np.ndarray] = []
+        threshold: List[np.ndarray] = []
+        default_left: List[np.ndarray] = []
+        max_depth = 0
+        offset = 0
+        for tree in trees:
+            if any(int(t) != 0 for t in tree.get("split_type", [])):
+                raise ValueError("Categorical splits are not supported by compiled trees.")
+            lc = np.asarray(tree["left_children"], dtype=np.int64)
+            rc = np.asarray(tree["right_children"], dtype=np.int64)
+            leaf = lc == -1
+            # 葉は自分自身を指すようにして、深さ分まとめて進めても位置が変わらないようにする
+            own = np.arange(lc.shape[0], dtype=np.int64)
+            left.append(np.where(leaf, own, lc) + offset)
+            right.append(np.where(leaf, own, rc) + offset)
+            feature.append(np.where(leaf, 0, np.asarray(tree["split_indices"], dtype=np.int64)))
+            threshold.append(np.asarray(tree["split_conditions"], dtype=np.float32))
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            max_depth = max(max_depth, _tree_depth(lc, rc))
+            roots.append(offset)
+            offset += lc.shape[0]
+
+        left_arr = np.concatenate(left) if left else np.zeros(0, dtype=np.int64)
+        threshold_arr = np.concatenate(threshold) if threshold else np.zeros(0, dtype=np.float32)
+        is_leaf = left_arr == np.arange(left_arr.shape[0], dtype=np.int64)
+        return cls(
+            roots=np.asarray(roots, dtype=np.int64),
+            left=left_arr,
+            right=np.concatenate(right) if right else np.zeros(0, dtype=np.int64),
+            feature=np.concatenate(feature) if feature else np.zeros(0, dtype=np.int64),
+            threshold=threshold_arr,
+            default_left=np.concatenate(default_left) if default_left else np.zeros(0, dtype=bool),
+            is_leaf=is_leaf,
+            # XGBoost の JSON では葉の値は split_conditions に入っている
+            leaf_value=np.where(is_leaf, threshold_arr, 0.0).astype(np.float32),
+            max_depth=max_depth,
+            base_margin=base_margin,
+            logistic=logistic,
+            num_feature=int(model_param.get("num_feature", "0") or 0),
+        )
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        """(行数, 特徴量数) の行列から予測値（行数,）を返す。NaN は欠損として扱う。"""
+        x = np.asarray(matrix, dtype=np.float32)
+        if x.ndim != 2:
+            raise ValueError("matrix must be 2-dimensional")
+        n = x.shape[0]
+        if n == 0:
+            return np.zeros(0, dtype=float)
+        if self.num_trees == 0:
+            margin = np.full(n, self.base_margin, dtype=float)
+        else:
+            rows = np.arange(n)[:, None]
+            node = np.broadcast_to(self.roots, (n, self.num_trees)).copy()
+            for _ in range(self.max_depth):
+                value = x[rows, self.feature[node]]
+                go_left = np.where(np.isnan(value), self.default_left[node], value < self.threshold[node])
+                node = np.where(go_left, self.left[node], self.right[node])
+            # float32 で木ごとに足し込む XGBoost と丸め誤差の出方を揃える
+            margin = self.leaf_value[node].sum(axis=1, dtype=np.float32).astype(float) + self.base_margin
+        if self.logistic:
+            return 1.0 / (1.0 + np.exp(-margin))
+        return margin
+
+    def nbytes(self) -> int:
+        """配列化した木が使うメモリ量（バイト）。"""
+        return int(
+            sum(
+                a.nbytes
+                for a in (
+                    self.roots,
+                    self.left,
+                    self.right,
+                    self.feature,
+                    self.threshold,
+                    self.default_left,
+                    self.is_leaf,
+                    self.leaf_value,
+                )
+            )
+        )
+
+
+def _parse_base_score(raw: Any) -> float:
+    """base_score は "0.5" / "[4.410811E0]" のどちらの形式でも保存されうる。"""
+    text = str(raw).strip()
+    if text.startswith("[") and text.endswith("]"):
+        text = text[1:-1].split(",")[0]
+    return float(text)
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth = 0
+    stack = [(0, 0)]
+    while stack:
+        node, d = stack.pop()
+        if left[node] == -1:
+            depth = max(depth, d)
+            continue
+        stack.append((int(left[node]), d + 1))
+        stack.append((int(right[node]), d + 1))
+    return depth
@@ -12,7 +12,11 @@ CREATE TABLE IF NOT EXISTS `firstdown_mvp.rank_result` (
   rule_score FLOAT64,
   model_score FLOAT64,
   model_latency_ms INT64,
-  status STRING
+  status STRING,
+  scoring_role STRING  -- served: レスポンスに使ったモデル / shadow: レスポンス後に記録のみ
 )
 PARTITION BY DATE(created_at)
 CLUSTER BY request_id, route_id, model_version;
+
+-- 既存テーブルへの列追加:
+--   ALTER TABLE `firstdown_mvp.rank_result` ADD COLUMN IF NOT EXISTS scoring_role STRING;
@@ -1,6 +1,8 @@
 """
 Ranker 単体テスト: 入力固定で順序が崩れないことを確認
 """
+import asyncio
+
 import pytest
 from app.main import rank, _calculate_score
 from app.schemas import RankRequest, RankRoute
@@ -63,7 +65,7 @@ def test_score_ordering_stable():
     ]
     
     req = RankRequest(request_id="test-001", routes=routes)
-    response = rank(req)
+    response = asyncio.run(rank(req))
     
     # スコア順にソートされていることを確認
     assert len(response.scores) == 3, "すべてのルートがスコアリングされる"
@@ -74,7 +76,7 @@ def test_score_ordering_stable():
     assert response.scores[0].route_id == "route_1", "距離誤差が小さく、loop closureが良いroute_1が最高スコア"
     
     # 複数回実行しても同じ順序であることを確認
-    response2 = rank(req)
+    response2 = asyncio.run(rank(req))
     assert [s.route_id for s in response2.scores] == [s.route_id for s in response.scores], "同じ入力で同じ順序"
 
 
@@ -95,7 +97,7 @@ def test_score_breakdown_present():
     ]
     
     req = RankRequest(request_id="test-002", routes=routes)
-    response = rank(req)
+    response = asyncio.run(rank(req))
     
     assert len(response.scores) == 1
     assert response.scores[0].breakdown is not None, "スコア内訳が含まれている"
@@ -150,3 +152,206 @@ def test_poi_bonus():
     score_low, _ = _calculate_score(features_low_poi)
     
     assert score_high > score_low, "POI数が多い方がスコアが高い"
+
+
+def test_rank_result_writer_batches_rows():
+    """rank_result 行がバッファされ、1つのロガーでまとめて書き込まれることを確認"""
+    from app.bq_logger import BufferedRankResultWriter
+
+    created = []
+
+    class FakeLogger:
+        def __init__(self):
+            created.append(self)
+            self.batches = []
+
+        def log_rank_result(self, rows):
+            self.batches.append(list(rows))
+
+    writer = BufferedRankResultWriter(logger_factory=FakeLogger)
+    writer.enqueue([{"route_id": "route_1"}, {"route_id": "route_2"}])
+    writer.enqueue([{"route_id": "route_3"}])
+    writer.stop(timeout_s=5.0)
+
+    assert len(created) == 1, "BigQueryクライアントはプロセス内で1つだけ作る"
+    written = [row["route_id"] for batch in created[0].batches for row in batch]
+    assert written == ["route_1", "route_2", "route_3"]
+    assert writer.stats()["written"] == 3
+    assert writer.stats()["queue_depth"] == 0
+
+
+@pytest.mark.parametrize("mode", ["xgb", "stub"])
+def test_score_batch_matches_single_scoring(mode):
+    """score_batch の結果が1件ずつの score と一致し、入力順で返ることを確認"""
+    from app.model_scoring import ModelScorer
+
+    scorer = ModelScorer(mode=mode)
+    if mode == "xgb" and scorer.score({})[2] == "model_not_loaded":
+        pytest.skip("XGBoost model artifacts are not available")
+    features_list = [
+        {"distance_error_ratio": 0.05, "round_trip_req": 1, "round_trip_fit": True, "loop_closure_m": 30.0},
+        {"distance_error_ratio": 0.4, "round_trip_req": 0, "poi_density": 0.2, "unknown_feature": "x"},
+        {"distance_error_ratio": 0.1, "park_poi_ratio": 0.5},
+    ]
+
+    batch = scorer.score_batch(features_list)
+    single = [scorer.score(features) for features in features_list]
+
+    assert [status for _, _, status in batch] == ["ok"] * 3
+    for (batch_score, _, _), (single_score, _, _) in zip(batch, single):
+        assert batch_score == pytest.approx(single_score, rel=1e-6)
+
+
+def test_vertex_batch_single_rpc_with_partial_failure():
+    """vertex モードは1回の predict で全ルートを送り、欠けた予測だけ model_error になることを確認"""
+    from types import SimpleNamespace
+    from google.protobuf.struct_pb2 import Value
+    from app.model_scoring import ModelScorer
+
+    calls = []
+
+    class FakeClient:
+        def predict(self, endpoint, instances, timeout):
+            calls.append(len(instances))
+            # 最後のインスタンスの予測が欠けたレスポンス
+            return SimpleNamespace(predictions=[Value(number_value=0.7), Value(number_value=0.3)])
+
+    scorer = ModelScorer(mode="vertex")
+    scorer._load_error = None
+    scorer._vertex_client = FakeClient()
+    scorer._vertex_endpoint = "projects/p/locations/l/endpoints/e"
+
+    results = scorer.score_batch([{"distance_km": 3.0}, {"distance_km": 4.0}, {"distance_km": 5.0}])
+
+    assert calls == [3], "全ルートを1回のRPCで送る"
+    assert [score for score, _, _ in results] == [pytest.approx(0.7), pytest.approx(0.3), None]
+    assert [status for _, _, status in results] == ["ok", "ok", "model_error"]
+
+
+def test_rank_falls_back_to_rule_score_on_model_timeout(monkeypatch):
+    """モデル推論が MODEL_TIMEOUT_S を超えたらルールスコアで返し、model_status="timeout" を記録することを確認"""
+    import time
+    from app import main
+    from app.settings import settings
+
+    def slow_score_batch(features_list):
+        time.sleep(0.5)
+        return [(0.99, 500, "ok")] * len(features_list)
+
+    monkeypatch.setattr(main.model_registry.primary, "score_batch", slow_score_batch)
+    monkeypatch.setattr(settings, "MODEL_TIMEOUT_S", 0.05)
+    features = {"distance_error_ratio": 0.05, "round_trip_req": 1, "loop_closure_m": 30.0}
+    req = RankRequest(request_id="test-timeout", routes=[RankRoute(route_id="route_1", features=features)])
+
+    response = asyncio.run(rank(req))
+
+    rule_score, _ = _calculate_score(features)
+    assert response.scores[0].score == rule_score
+    assert response.scores[0].breakdown["model_status"] == "timeout"
+    assert response.scores[0].breakdown["model_score"] is None
+
+
+def test_compiled_trees_match_xgboost():
+    """compiled モード（配列化した木）が XGBoost の予測と一致することを確認"""
+    import numpy as np
+    from app.model_scoring import ModelScorer, _parity_probe
+
+    xgb_scorer = ModelScorer(mode="xgb")
+    if xgb_scorer._model is None:
+        pytest.skip("XGBoost model artifacts are not available")
+    compiled_scorer = ModelScorer(mode="compiled")
+    assert compiled_scorer._compiled is not None, "パリティ確認を通過して配列化した木が使われる"
+
+    probe = _parity_probe(len(xgb_scorer._feature_columns), 64)
+    expected = xgb_scorer._model.predict(probe)
+    actual = compiled_scorer._compiled.predict(probe)
+    assert np.max(np.abs(actual - expected)) < 1e-4
+
+
+def test_model_registry_hot_reload(tmp_path, monkeypatch):
+    """レジストリに新しいバンドルが置かれたらプライマリが差し替わり、壊れたバンドルは無視されることを確認"""
+    import json
+    import shutil
+    from pathlib import Path
+    from app.model_registry import ModelRegistry
+    from app.settings import settings
+
+    models_dir = Path(__file__).parent / "models"
+    if not (models_dir / "model.xgb.json").exists():
+        pytest.skip("XGBoost model artifacts are not available")
+
+    def put_bundle(version: str, trained_at: str, broken: bool = False) -> None:
+        bundle = tmp_path / version
+        bundle.mkdir()
+        shutil.copy(models_dir / "feature_columns.json", bundle / "feature_columns.json")
+        if broken:
+            (bundle / "model.xgb.json").write_text("{}", encoding="utf-8")
+        else:
+            shutil.copy(models_dir / "model.xgb.json", bundle / "model.xgb.json")
+        (bundle / "metadata.json").write_text(
+            json.dumps({"model_version": version, "trained_at": trained_at}), encoding="utf-8"
+        )
+
+    monkeypatch.setattr(settings, "MODEL_REGISTRY_DIR", str(tmp_path))
+    put_bundle("v1", "2026-01-01T00:00:00+00:00")
+    registry = ModelRegistry(mode="xgb")
+    assert registry.primary.model_version == "v1"
+
+    put_bundle("v2", "2026-02-01T00:00:00+00:00")
+    assert registry.refresh() is True
+    assert registry.primary.model_version == "v2"
+
+    put_bundle("v3", "2026-03-01T00:00:00+00:00", broken=True)
+    assert registry.refresh() is False
+    assert registry.primary.model_version == "v2", "検証に失敗したバンドルには切り替えない"
+    assert registry.status()["rejected"] == 1
+    registry.refresh()
+    assert registry.status()["rejected"] == 1, "同じ壊れたバンドルは再ロードしない"
+
+
+def test_shadow_scoring_logs_rows_after_response():
+    """シャドウ枠のモデルはレスポンス後にスコアリングされ、自身の model_version で記録されることを確認"""
+    from app.model_scoring import ModelScorer
+    from app.shadow_scoring import ShadowScoringRunner
+
+    class _Writer:
+        def __init__(self):
+            self.rows = []
+
+        def enqueue(self, rows):
+            self.rows.extend(rows)
+
+    writer = _Writer()
+    runner = ShadowScoringRunner(writer)
+    shadow = ModelScorer(mode="stub")
+    shadow.model_version = "candidate_v2"
+    items = [
+        {"route_id": "route_1", "rule_score": 0.7, "features": {"distance_error_ratio": 0.05, "poi_density": 0.5}},
+        {"route_id": "route_2", "rule_score": 0.4, "features": {"distance_error_ratio": 0.3}},
+    ]
+    assert runner.submit("req_shadow", shadow, items) is True
+    runner.shutdown(wait=True)
+
+    assert [row["route_id"] for row in writer.rows] == ["route_1", "route_2"]
+    assert all(row["model_version"] == "candidate_v2" for row in writer.rows)
+    assert all(row["scoring_role"] == "shadow" for row in writer.rows)
+    assert all(row["status"] == "ok" and row["model_score"] is not None for row in writer.rows)
+    assert runner.stats()["completed"] == 1
+
+
+def test_ab_split_is_deterministic(monkeypatch):
+    """A/B の割り当てが request_id で決まり、割合が MODEL_AB_TRAFFIC_PCT に近いことを確認"""
+    from app.model_scoring import ModelScorer
+    from app.settings import settings
+    from app.shadow_scoring import in_treatment, pick_scorers
+
+    monkeypatch.setattr(settings, "MODEL_AB_TRAFFIC_PCT", 20.0)
+    request_ids = [f"req_{i}" for i in range(2000)]
+    first = [in_treatment(rid) for rid in request_ids]
+    assert first == [in_treatment(rid) for rid in request_ids], "同じ request_id は常に同じ群"
+    assert 0.17 < sum(first) / len(first) < 0.23
+
+    primary, candidate = ModelScorer(mode="stub"), ModelScorer(mode="stub")
+    treated = request_ids[first.index(True)]
+    assert pick_scorers(treated, primary, candidate) == (candidate, primary)
+    assert pick_scorers(treated, primary, None) == (primary, None)
@@ -19,6 +19,8 @@ DEFAULT_FEATURE_COLUMNS: List[str] = [
     "path_length_ratio",
     "turn_count",
     "turn_density",
+    "self_overlap_ratio",
+    "straightness",
     "theme_exercise",
     "theme_think",
     "theme_refresh",
@@ -47,6 +49,12 @@ def parse_args() -> argparse.Namespace:
         help="Feature columns JSON file path (optional)",
     )
     parser.add_argument("--model-version", type=str, default="unknown", help="Model version tag")
+    parser.add_argument(
+        "--features-version",
+        type=str,
+        default="mvp_v2",
+        help="Only train on rows logged with this FEATURES_VERSION (empty string: all rows)",
+    )
     return parser.parse_args()
 
 
@@ -58,8 +66,10 @@ def load_feature_columns(path: Optional[str]) -> List[str]:
         return json.load(f)
 
 
-def build_query(table_id: str, feature_columns: Iterable[str]) -> str:
+def build_query(table_id: str, feature_columns: Iterable[str], features_version: Optional[str] = None) -> str:
     features_sql = ", ".join(feature_columns)
+    # mvp_v1 の形状特徴量（loop_closure_m など）は固定値のため、既定では mvp_v2 以降の行だけを使う
+    version_sql = f"AND features_version = '{features_version}'" if features_version else ""
     # split がビューにない場合は NULL で補う（全件を train として使用）
     return f"""
     SELECT
@@ -68,6 +78,7 @@ def build_query(table_id: str, feature_columns: Iterable[str]) -> str:
         CAST(NULL AS STRING) AS split
     FROM `{table_id}`
     WHERE feedback_rating IS NOT NULL
+    {version_sql}
     """
 
 
@@ -183,7 +194,7 @@ def main() -> None:
             raise ValueError("dataset/table or query must be provided.")
         project = args.project or bigquery.Client().project
         table_id = f"{project}.{args.dataset}.{args.table}"
-        query = build_query(table_id, feature_columns)
+        query = build_query(table_id, feature_columns, args.features_version)
 
     client = bigquery.Client(project=args.project)
     df = fetch_training_data(client, query)
@@ -240,6 +251,7 @@ def main() -> None:
         "model_version": args.model_version,
         "trained_at": datetime.now(timezone.utc).isoformat(),
         "feature_columns": feature_columns,
+        "features_version": args.features_version or None,
         "metrics": metrics,
     }
     with metadata_path.open("w", encoding="utf-8") as f:
@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import logging
 import os
+import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -20,17 +21,21 @@ app = FastAPI(title="Vertex Predictor", version="1.0.0")
 
 class PredictRequest(BaseModel):
     instances: List[Dict[str, Any]] = Field(default_factory=list)
+    # 列指向の入力（特徴量名 -> 値のリスト、全列同じ長さ）。rawPredict 用。指定時は instances より優先
+    columns: Optional[Dict[str, List[Any]]] = None
 
 
 class PredictResponse(BaseModel):
     predictions: List[float]
     model_version: Optional[str] = None
+    timings_ms: Optional[Dict[str, float]] = None  # vectorize / predict の所要時間
 
 
 class ModelBundle:
     def __init__(self) -> None:
         self.model: Optional[xgb.XGBRegressor] = None
         self.feature_columns: List[str] = []
+        self.column_index: Dict[str, int] = {}  # 特徴量名 -> 列番号（ロード時に1回だけ作る）
         self.model_version: Optional[str] = None
 
     def load(self) -> None:
@@ -56,6 +61,7 @@ class ModelBundle:
 
         with Path(features_path).open("r", encoding="utf-8") as f:
             self.feature_columns = json.load(f)
+        self.column_index = {name: i for i, name in enumerate(self.feature_columns)}
 
         if metadata_path and Path(metadata_path).exists():
             with Path(metadata_path).open("r", encoding="utf-8") as f:
@@ -85,36 +91,94 @@ def health() -> Dict[str, str]:
 def predict(req: PredictRequest) -> PredictResponse:
     if MODEL.model is None or not MODEL.feature_columns:
         raise HTTPException(status_code=500, detail="Model not loaded.")
-    if not req.instances:
+    if not req.instances and not req.columns:
         return PredictResponse(predictions=[], model_version=MODEL.model_version)
 
-    matrix = _vectorize_instances(req.instances, MODEL.feature_columns)
+    t0 = time.perf_counter()
+    try:
+        if req.columns:
+            matrix = _vectorize_columns(req.columns, MODEL.feature_columns)
+        else:
+            matrix = _vectorize_instances(req.instances, MODEL.feature_columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    t1 = time.perf_counter()
     preds = MODEL.model.predict(matrix)
-    predictions = [float(x) for x in preds]
-    return PredictResponse(predictions=predictions, model_version=MODEL.model_version)
+    predictions = preds.astype(float).tolist()
+    t2 = time.perf_counter()
+    timings_ms = {
+        "vectorize": round((t1 - t0) * 1000, 3),
+        "predict": round((t2 - t1) * 1000, 3),
+    }
+    logger.info(
+        "predict rows=%d vectorize_ms=%.3f predict_ms=%.3f",
+        matrix.shape[0],
+        timings_ms["vectorize"],
+        timings_ms["predict"],
+    )
+    return PredictResponse(predictions=predictions, model_version=MODEL.model_version, timings_ms=timings_ms)
 
 
 def _vectorize_instances(
     instances: List[Dict[str, Any]],
     feature_columns: List[str],
 ) -> np.ndarray:
-    rows: List[List[float]] = []
-    for inst in instances:
-        values: List[float] = []
-        for name in feature_columns:
-            raw = inst.get(name, None)
-            if isinstance(raw, bool):
-                values.append(1.0 if raw else 0.0)
-                continue
-            if raw is None:
-                values.append(np.nan)
-                continue
-            try:
-                values.append(float(raw))
-            except (TypeError, ValueError):
-                values.append(np.nan)
-        rows.append(values)
-    return np.asarray(rows, dtype=float)
+    """行指向の instances を (行数, 特徴量数) の float32 行列にする（欠損・変換不能は NaN、bool は 0/1）。"""
+    matrix = np.empty((len(instances), len(feature_columns)), dtype=np.float32)
+    for col, name in enumerate(feature_columns):
+        matrix[:, col] = _coerce_column([inst.get(name) for inst in instances])
+    return matrix
+
+
+def _vectorize_columns(
+    columns: Dict[str, List[Any]],
+    feature_columns: List[str],
+) -> np.ndarray:
+    """列指向の入力（特徴量名 -> 値のリスト）を (行数, 特徴量数) の float32 行列にする。無い列は NaN。"""
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"columns must have the same length: {sorted(lengths)}")
+    n_rows = lengths.pop() if lengths else 0
+    matrix = np.full((n_rows, len(feature_columns)), np.nan, dtype=np.float32)
+    for col, name in enumerate(feature_columns):
+        values = columns.get(name)
+        if values is not None:
+            matrix[:, col] = _coerce_column(values)
+    return matrix
+
+
+def _coerce_column(values: List[Any]) -> np.ndarray:
+    """
+    1列分の値を float32 にまとめて変換する。
+
+    数値・bool・None だけの列は NumPy の一括変換（None は NaN）で済ませ、
+    文字列などが混ざって一括変換できない列だけ1値ずつ float() を試す（変換不能は NaN）。
+    """
+    try:
+        arr = np.asarray(values, dtype=np.float32)
+        if arr.ndim == 1:
+            return arr
+    except (TypeError, ValueError, OverflowError):
+        pass
+    objects = np.empty(len(values), dtype=object)
+    objects[:] = values
+    return _coerce_values(objects).astype(np.float32)
+
+
+def _coerce_value(raw: Any) -> float:
+    """1値分の変換（_coerce_column のフォールバック用）"""
+    if isinstance(raw, bool):
+        return 1.0 if raw else 0.0
+    if raw is None:
+        return np.nan
+    try:
+        return float(raw)
+    except (TypeError, ValueError, OverflowError):
+        return np.nan
+
+
+# object 配列に要素ごとに適用する ufunc 版
+_coerce_values = np.frompyfunc(_coerce_value, 1, 1)
 
 
 def _resolve_path(